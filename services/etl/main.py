@@ -4,7 +4,7 @@ from elasticsearch import Elasticsearch
 from services.lodaer import ElasticLoader
 from utils.logger import logger
 from utils.wait_for_service import wait_for_service
-from libs.es.indices.document import index_name, index_json
+from libs.es.indices.document import index_name, index_json, versioned_index_name
 
 ELASTIC_PROTOCOL = os.getenv('ELASTICSEARCH_PROTOCOL', 'http')
 ELASTIC_HOST = os.getenv('ELASTICSEARCH_HOST', '127.0.0.1')
@@ -24,8 +24,8 @@ if __name__ == "__main__":
     wait_for_service(f'{ELASTIC_PROTOCOL}://{ELASTIC_HOST}:{ELASTIC_PORT}')
 
     if not client.indices.exists(index=index_name):
-        logger.info(f"Index {index_name} does not exist. Creating...")
-        client.indices.create(index=index_name, body=index_json)
+        logger.info(f"Index {index_name} does not exist. Creating {versioned_index_name}...")
+        client.indices.create(index=versioned_index_name, body={**index_json, "aliases": {index_name: {}}})
 
     logger.info(f"Loading documents from {FILE_PATH} into {index_name}...")
     loader.load_documents_from_file(index=index_name, file_path=FILE_PATH)
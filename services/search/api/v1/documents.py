@@ -5,21 +5,30 @@ from typing import List
 from fastapi import (
     APIRouter, 
     Depends, 
+    HTTPException,
     Query,
     UploadFile, 
     File,
     Request,
 )
+from fastapi.concurrency import run_in_threadpool
 from fastapi.responses import JSONResponse, FileResponse
 from PIL import Image
 
 from models.abstract import PaginatedParams
 from models.document import Document
+from models.search import BatchSearchRequest, DocumentFilters, SearchResult
 from services.document import DocumentService, get_document_service
-from utils.file import save_file
-from db.elastic import AsyncSearchService, get_elastic
+from utils.file import find_uploaded_file, save_file
+from utils.abstract import AsyncSearchService
+from dependencies.filters import get_document_filters
+from dependencies.search import get_search_service
 from services.preprocessing import PreprocessingService, get_preprocessing_service
+from services.ingestion import IngestionService, get_ingestion_service
 from core import config
+from utils import deadline
+from utils.metrics import QUERY_EMBEDDING_SECONDS
+from utils.profiling import stage
 
 
 router = APIRouter()
@@ -34,13 +43,91 @@ async def get_documents(
         description=config.QUERY_DESC,
     ),
     pagination: PaginatedParams = Depends(),
+    collapse_duplicates: bool = Query(
+        default=False,
+        description=config.COLLAPSE_DUPLICATES_DESC,
+    ),
     document_service: DocumentService = Depends(get_document_service)
 ):
     documents = await document_service.get_documents_by_query(
         query=query,
         page=pagination.page,
-        size=pagination.size
+        size=pagination.size,
+        collapse_duplicates=collapse_duplicates,
+    )
+
+    return documents
+
+
+@router.post("/batch_search/", response_model=List[SearchResult])
+async def batch_search(
+    request: BatchSearchRequest,
+    document_service: DocumentService = Depends(get_document_service),
+    preprocessing_service: PreprocessingService = Depends(get_preprocessing_service),
+):
+    """
+    Пакетный поиск: несколько полнотекстовых и/или векторных запросов за один вызов.
+
+    Текстовые запросы с semantic=true векторизуются одним вызовом модели,
+    все запросы выполняются одним обращением _msearch. Результаты
+    возвращаются в порядке запросов.
+    """
+    to_embed = [
+        i for i, item in enumerate(request.queries)
+        if item.semantic and item.vector is None
+    ]
+    if to_embed and not deadline.allows(config.deadline_settings.inference_reserve):
+        deadline.degrade("text_embedding_skipped")
+        to_embed = []
+    with QUERY_EMBEDDING_SECONDS.time(modality="text_batch"):
+        embedded = await run_in_threadpool(
+            preprocessing_service.vectorize_texts,
+            [request.queries[i].query for i in to_embed],
+        )
+    vectors = {i: vector for i, vector in zip(to_embed, embedded)}
+
+    bodies = []
+    for i, item in enumerate(request.queries):
+        vector = item.vector if item.vector is not None else vectors.get(i)
+        bodies.append(document_service.build_query_body(
+            # Если векторизовать запрос не удалось, он выполняется как полнотекстовый
+            query='' if item.semantic and vector else item.query,
+            page=item.page,
+            size=item.size,
+            collapse_duplicates=item.collapse_duplicates,
+            vector=vector,
+            text_model=preprocessing_service.text_model_version,
+        ))
+
+    return await document_service.search_batch(bodies)
+
+
+@router.get("/{document_id}/similar/", response_model=List[Document])
+async def get_similar_documents(
+    document_id: str,
+    pagination: PaginatedParams = Depends(),
+    filters: DocumentFilters = Depends(get_document_filters),
+    include_duplicates: bool = Query(
+        default=False,
+        description=config.INCLUDE_DUPLICATES_DESC,
+    ),
+    document_service: DocumentService = Depends(get_document_service),
+    preprocessing_service: PreprocessingService = Depends(get_preprocessing_service),
+):
+    """
+    Документы, похожие на документ document_id, по его сохраненным
+    текстовому эмбеддингу и эмбеддингам изображений.
+    """
+    documents = await document_service.get_similar_documents(
+        document_id=document_id,
+        page=pagination.page,
+        size=pagination.size,
+        filters=filters.to_query(),
+        include_duplicates=include_duplicates,
+        image_model=preprocessing_service.image_model_version,
     )
+    if documents is None:
+        raise HTTPException(status_code=404, detail="Document not found")
 
     return documents
 
@@ -60,20 +147,39 @@ async def get_documents_by_multimodal_query(
 ):
     """
     Поиск документов с учетом текстового запроса и/или изображения.
+
+    Если до срока запроса не хватает времени на инференс, векторы не
+    вычисляются и поиск выполняется только по тексту запроса (BM25).
     """
     query_vector = None
     image_vector = None
+    inference_reserve = config.deadline_settings.inference_reserve
 
     # Обрабатываем текстовый запрос
     if query:
-        query_vector = preprocessing_service.vectorize_text(query)
+        if deadline.allows(inference_reserve):
+            with QUERY_EMBEDDING_SECONDS.time(modality="text"):
+                query_vector = await run_in_threadpool(preprocessing_service.vectorize_text, query)
+        else:
+            deadline.degrade("text_embedding_skipped")
 
     # Обрабатываем изображение
     if image:
-        temp_image_path = save_file(image, config.TEMP_FILES_DIR)
+        saved_image = await save_file(
+            image,
+            config.TEMP_FILES_DIR,
+            max_size=config.upload_settings.max_image_size,
+            chunk_size=config.upload_settings.chunk_size,
+            allowed_types=config.IMAGE_FILE_TYPES,
+        )
+        temp_image_path = saved_image.path
         try:
-            image_obj = Image.open(temp_image_path)
-            image_vector = preprocessing_service.vectorize_image(image_obj)
+            if deadline.allows(inference_reserve):
+                with Image.open(temp_image_path) as image_obj:
+                    with QUERY_EMBEDDING_SECONDS.time(modality="image"):
+                        image_vector = await run_in_threadpool(preprocessing_service.vectorize_image, image_obj)
+            else:
+                deadline.degrade("image_embedding_skipped")
         finally:
             os.remove(temp_image_path)
 
@@ -83,18 +189,24 @@ async def get_documents_by_multimodal_query(
         image_vector=image_vector,
         page=pagination.page,
         size=pagination.size,
+        text_model=preprocessing_service.text_model_version,
+        image_model=preprocessing_service.image_model_version,
+        fallback_query=query,
     )
 
     # Обработка результатов поиска
+    if response is None:
+        return {"message": "No image or query vector provided for the search."}
+
     hits = response["hits"]["hits"]
     if not hits:
         return {"message": "No documents found matching your query."}
 
     best_hit = hits[0]
-    file_path = best_hit["_source"]["file_path"]
+    file_path = find_uploaded_file(config.UPLOAD_FILES_DIR, best_hit["_id"], config.DOCUMENT_FILE_TYPES)
 
     # Возвращаем файл с наивысшим скором
-    if os.path.exists(file_path):
+    if file_path is not None:
         return FileResponse(file_path, media_type="application/octet-stream", filename=os.path.basename(file_path))
     else:
         return {"message": "Document found but file is missing on server."}
@@ -107,8 +219,11 @@ async def get_documents_by_multimodal_query(
 async def documents_vectors(
         _: Request,
         film_service: DocumentService = Depends(get_document_service),
+        preprocessing_service: PreprocessingService = Depends(get_preprocessing_service),
 ):
-    vectors: List[List[float]] = await film_service.get_documents_vectors()
+    vectors: List[List[float]] = await film_service.get_documents_vectors(
+        text_model=preprocessing_service.text_model_version,
+    )
 
     return vectors
 
@@ -117,22 +232,61 @@ async def documents_vectors(
 async def process_document_endpoint(
     file: UploadFile = File(...),
     preprocessing_service: PreprocessingService = Depends(get_preprocessing_service),
-    search_service: AsyncSearchService = Depends(get_elastic)
+    search_service: AsyncSearchService = Depends(get_search_service)
 ):
     """
     Эндпоинт для загрузки документа и его обработки.
     """
-    local_file_path = save_file(file, config.UPLOAD_FILES_DIR)
-    
-    result: Document = preprocessing_service.process_document(local_file_path)
+    saved_file = await save_file(
+        file,
+        config.UPLOAD_FILES_DIR,
+        max_size=config.upload_settings.max_document_size,
+        chunk_size=config.upload_settings.chunk_size,
+        allowed_types=config.DOCUMENT_FILE_TYPES,
+    )
+    local_file_path = saved_file.path
     
-    response = await search_service.index(index=config.document_index_name, body=result)
+    # Извлечение и инференс выполняются в пуле потоков, чтобы не блокировать цикл событий
+    extracted = {}
+    try:
+        extracted = await run_in_threadpool(
+            preprocessing_service.extract_document, local_file_path, title=saved_file.title
+        )
+        deadline.check("embedding")
+        result: Document = await run_in_threadpool(preprocessing_service.embed_document, extracted)
+
+        with stage("indexing"):
+            response = await search_service.index(index=config.document_index_name, body=result)
+    except BaseException:
+        # Непроиндексированный документ удаляется вместе с извлеченными изображениями
+        os.remove(local_file_path)
+        if extracted:
+            preprocessing_service.remove_document_folder(extracted["document_id"])
+        raise
     
     new_file_path = os.path.join(config.UPLOAD_FILES_DIR, f"{response['_id']}{os.path.splitext(local_file_path)[-1]}")
 
     os.rename(local_file_path, new_file_path)
+    await run_in_threadpool(preprocessing_service.register_document, extracted)
     
     result["file_path"] = new_file_path
+    result["content_hash"] = saved_file.content_hash
+    result["image_stats"] = extracted.get("image_stats")
 
     return JSONResponse(content=result)
 
+
+@router.post("/process/batch/")
+async def process_documents_batch_endpoint(
+    files: List[UploadFile] = File(...),
+    ingestion_service: IngestionService = Depends(get_ingestion_service),
+):
+    """
+    Эндпоинт для пакетной загрузки документов и ZIP-архивов с документами.
+
+    Документы обрабатываются конвейером и индексируются через bulk API.
+    Возвращает сводку с результатом обработки каждого файла.
+    """
+    summary = await ingestion_service.ingest_files(files)
+
+    return JSONResponse(content=summary)
@@ -0,0 +1,159 @@
+"""
+Сравнение маппинга индекса документов до и после оптимизации векторов.
+
+Создает два временных индекса на работающем Elasticsearch: с исходным
+маппингом (dense_vector без параметров, векторы в _source) и с текущим
+(int8_hnsw, cosine, векторы исключены из _source), загружает в оба
+одинаковый синтетический корпус и выводит размер индекса после
+forcemerge и задержки запросов:
+
+- text search: полнотекстовый запрос, 10 документов с _source;
+- script_score: исходный мультимодальный запрос полным перебором;
+- knn: приближенный поиск по text_content_embedding.
+
+Для исходного маппинга параметры dense_vector берутся по умолчанию
+для версии кластера.
+
+Запуск из каталога services/search:
+
+    python -m benchmarks.es_mapping --url http://localhost:9200 --docs 5000
+"""
+import copy
+import time
+import random
+import argparse
+import statistics
+from typing import Callable, Dict, List
+
+from elasticsearch import Elasticsearch, helpers
+
+from libs.es.indices.document import index_json
+
+
+WORDS = (
+    "никель медь палладий платина производство рудник обогащение концентрат "
+    "отчет добыча переработка металлургия плавка анализ показатель выпуск "
+    "nickel copper plant output report mining ore smelter annual"
+).split()
+
+
+def legacy_body(body: dict) -> dict:
+    """Исходный маппинг: векторы в _source, dense_vector без параметров."""
+    legacy = copy.deepcopy(body)
+    mappings = legacy["mappings"]
+    mappings.pop("_source", None)
+    mappings.pop("_meta", None)
+
+    properties = mappings["properties"]
+    for vector in (
+        properties["text_content_embedding"],
+        properties["images"]["properties"]["image_embedding"],
+    ):
+        for key in ("index", "similarity", "index_options"):
+            vector.pop(key, None)
+    return legacy
+
+
+def random_vector(rng: random.Random, dims: int) -> List[float]:
+    return [rng.uniform(-1, 1) for _ in range(dims)]
+
+
+def generate_documents(count: int, seed: int = 0):
+    rng = random.Random(seed)
+    for i in range(count):
+        yield {
+            "document_id": f"doc-{i}",
+            "title": " ".join(rng.choices(WORDS, k=4)),
+            "text_content": " ".join(rng.choices(WORDS, k=rng.randint(200, 2000))),
+            "text_content_embedding": random_vector(rng, 384),
+            "language": "ru",
+            "metadata": {"author": None, "created_date": "2024-01-01", "tags": rng.choices(WORDS, k=5)},
+            "images": [
+                {
+                    "image_id": f"img_{j + 1}",
+                    "image_embedding": random_vector(rng, 768),
+                    "position": f"Page {j + 1}",
+                    "image_path": f"data/doc-{i}/image_{j + 1}.png",
+                }
+                for j in range(rng.randint(0, 5))
+            ],
+        }
+
+
+def measure(func: Callable[[], None], repeat: int) -> Dict[str, float]:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    return {
+        "p50": statistics.median(timings),
+        "p95": timings[int(len(timings) * 0.95) - 1],
+    }
+
+
+def run(es: Elasticsearch, name: str, body: dict, docs: int, queries: int) -> None:
+    if es.indices.exists(index=name):
+        es.indices.delete(index=name)
+    es.indices.create(index=name, body=body)
+
+    helpers.bulk(
+        es,
+        ({"_index": name, "_source": doc} for doc in generate_documents(docs)),
+        chunk_size=200,
+        request_timeout=300,
+    )
+    es.indices.refresh(index=name)
+    es.indices.forcemerge(index=name, max_num_segments=1, request_timeout=600)
+
+    store = es.indices.stats(index=name, metric="store")["indices"][name]["total"]["store"]
+    print(f"\n{name}: {store['size_in_bytes'] / 1024 / 1024:.1f} MB")
+
+    rng = random.Random(42)
+    query_vectors = [random_vector(rng, 384) for _ in range(queries)]
+    cursor = iter(query_vectors * 3)
+
+    def text_search():
+        es.search(index=name, query={"match": {"text_content": rng.choice(WORDS)}}, size=10)
+
+    def script_score():
+        es.search(index=name, size=10, query={
+            "script_score": {
+                "query": {"match_all": {}},
+                "script": {
+                    "source": "cosineSimilarity(params.query_vector, 'text_content_embedding') + 1.0",
+                    "params": {"query_vector": next(cursor)},
+                },
+            }
+        })
+
+    def knn():
+        es.search(index=name, size=10, knn={
+            "field": "text_content_embedding",
+            "query_vector": next(cursor),
+            "k": 10,
+            "num_candidates": 100,
+        })
+
+    for label, func in (("text search", text_search), ("script_score", script_score), ("knn", knn)):
+        stats = measure(func, queries)
+        print(f"  {label:>12}: p50 {stats['p50']:7.1f} ms, p95 {stats['p95']:7.1f} ms")
+
+    es.indices.delete(index=name)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://localhost:9200")
+    parser.add_argument("--docs", type=int, default=5000)
+    parser.add_argument("--queries", type=int, default=100)
+    args = parser.parse_args()
+
+    es = Elasticsearch(hosts=[args.url], request_timeout=60)
+    run(es, "benchmark_documents_legacy", legacy_body(index_json), args.docs, args.queries)
+    run(es, "benchmark_documents_current", index_json, args.docs, args.queries)
+
+
+if __name__ == "__main__":
+    main()
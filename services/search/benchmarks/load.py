@@ -0,0 +1,395 @@
+"""
+Нагрузочный тест API поиска.
+
+Сценарии (доли задаются --mix):
+
+- search - POST /search/api/v1/documents/?query=...;
+- multimodal - POST /search/api/v1/documents/multimodal_search с запросом и изображением;
+- process - POST /search/api/v1/documents/process/ с синтетическим PDF или DOCX.
+
+Нагрузка замкнутая: --concurrency клиентов отправляют запросы один за другим
+в течение --duration секунд (или до --requests запросов). Поисковые запросы
+берутся из --queries: текстовый файл (запрос в строке) или JSON-логи сервиса
+(logs/logs.log), из которых повторяются запросы к поиску в записанном
+порядке; без файла запросы генерируются. Отчет - пропускная способность,
+ошибки и перцентили задержки по сценариям.
+
+С --url нагружается уже запущенный сервис. С --serve сервис запускается
+для каждой комбинации --workers и --variant (набор переменных окружения),
+поэтому конфигурации сравниваются одной командой. По умолчанию --serve
+работает полностью офлайн: встроенный поисковый индекс вместо Elasticsearch
+(SEARCH_BACKEND=embedded) и заглушки моделей (EMBEDDING_STUB_MODELS=true);
+--backend elasticsearch и --real-models используют Elasticsearch из окружения
+и настоящие модели. Перед замерами индекс заполняется --seed-documents
+документами через /process/. Встроенный индекс однопроцессный (каждый
+воркер держал бы свою копию), поэтому сравнение числа воркеров требует
+--backend elasticsearch.
+
+Запуск из каталога services/search:
+
+    python -m benchmarks.load --serve --backend elasticsearch --workers 1 2 4 --concurrency 32 --duration 30
+    python -m benchmarks.load --serve --variant "PREPROCESSING_WORKERS=1" --variant "PREPROCESSING_WORKERS=4"
+    python -m benchmarks.load --url http://localhost:8000 --mix search=90,multimodal=10 --queries logs/logs.log
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+import subprocess
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from collections import Counter
+from typing import Dict, Iterator, List, Tuple
+from urllib.parse import parse_qs
+
+import httpx
+
+from benchmarks.preprocess_image import generate_scan
+from benchmarks.synthetic import DocumentSpec, generate_document, generate_words
+from benchmarks.text_analysis import EN_WORDS, RU_WORDS
+
+
+SERVICE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+API_PREFIX = "/search/api/v1/documents"
+SCENARIOS = ("search", "multimodal", "process")
+MIME_TYPES = {
+    ".pdf": "application/pdf",
+    ".docx": "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+}
+
+
+@dataclass
+class ScenarioStats:
+    latencies: List[float] = field(default_factory=list)
+    statuses: Counter = field(default_factory=Counter)
+    errors: int = 0
+
+    def summary(self, elapsed: float) -> Dict[str, float]:
+        latencies = sorted(self.latencies)
+        return {
+            "requests": len(latencies),
+            "errors": self.errors,
+            "rps": len(latencies) / elapsed if elapsed else 0.0,
+            "p50_ms": percentile(latencies, 50) * 1000,
+            "p90_ms": percentile(latencies, 90) * 1000,
+            "p99_ms": percentile(latencies, 99) * 1000,
+            "max_ms": (latencies[-1] if latencies else 0.0) * 1000,
+            "statuses": dict(self.statuses),
+        }
+
+
+def percentile(values: List[float], percent: float) -> float:
+    """Перцентиль по методу ближайшего ранга; values отсортированы."""
+    if not values:
+        return 0.0
+    rank = max(int(round(percent / 100 * len(values) + 0.5)) - 1, 0)
+    return values[min(rank, len(values) - 1)]
+
+
+def parse_mix(value: str) -> Dict[str, float]:
+    mix = {}
+    for part in value.split(","):
+        name, _, weight = part.partition("=")
+        if name not in SCENARIOS:
+            raise argparse.ArgumentTypeError(f"Unknown scenario: {name}")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def load_queries(path: str | None, count: int = 1000, seed: int = 0) -> List[str]:
+    """Запросы из файла (текст или JSON-логи сервиса) или сгенерированные."""
+    if path is None:
+        rng = random.Random(seed)
+        vocabulary = RU_WORDS + EN_WORDS
+        return [generate_words(rng, vocabulary, rng.randint(1, 3)) for _ in range(count)]
+
+    queries = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            if not line.startswith("{"):
+                queries.append(line)
+                continue
+            record = json.loads(line)
+            # В логах сервиса - только запросы к полнотекстовому поиску
+            if record.get("path") != f"{API_PREFIX}/" or record.get("method") != "POST":
+                continue
+            query = parse_qs(record.get("query_params") or "").get("query")
+            if query:
+                queries.append(query[0])
+    if not queries:
+        raise ValueError(f"No search queries found in {path}")
+    return queries
+
+
+def prepare_files(directory: str, count: int = 4) -> Tuple[List[Tuple[str, bytes]], bytes]:
+    """Синтетические документы для /process/ и изображение для мультимодального поиска."""
+    documents = []
+    for index in range(count):
+        spec = DocumentSpec(
+            "pdf" if index % 2 == 0 else "docx",
+            pages=3,
+            words_per_page=300,
+            images=1,
+            image_width=800,
+            image_height=600,
+            seed=index,
+        )
+        path = os.path.join(directory, f"document_{index}{spec.extension}")
+        generate_document(path, spec)
+        with open(path, "rb") as f:
+            documents.append((os.path.basename(path), f.read()))
+
+    image_path = os.path.join(directory, "query.jpg")
+    generate_scan(image_path, 640, 480, seed=42)
+    with open(image_path, "rb") as f:
+        image = f.read()
+    return documents, image
+
+
+class LoadTest:
+    def __init__(
+        self,
+        url: str,
+        mix: Dict[str, float],
+        queries: List[str],
+        documents: List[Tuple[str, bytes]],
+        image: bytes,
+        concurrency: int,
+        duration: float,
+        requests: int | None = None,
+        timeout: float = 120.0,
+        seed: int = 0,
+    ) -> None:
+        self.url = url.rstrip("/")
+        self.scenarios = list(mix)
+        self.weights = [mix[name] for name in self.scenarios]
+        self.queries = queries
+        self.documents = documents
+        self.image = image
+        self.concurrency = concurrency
+        self.duration = duration
+        self.requests = requests
+        self.timeout = timeout
+        self.rng = random.Random(seed)
+        self.stats: Dict[str, ScenarioStats] = {name: ScenarioStats() for name in self.scenarios}
+        self._sent = 0
+        self._query_index = 0
+
+    def next_query(self) -> str:
+        # Записанные запросы повторяются по порядку, по кругу
+        query = self.queries[self._query_index % len(self.queries)]
+        self._query_index += 1
+        return query
+
+    async def send(self, client: httpx.AsyncClient, scenario: str) -> httpx.Response:
+        if scenario == "search":
+            return await client.post(f"{API_PREFIX}/", params={"query": self.next_query()})
+        if scenario == "multimodal":
+            return await client.post(
+                f"{API_PREFIX}/multimodal_search",
+                params={"query": self.next_query()},
+                files={"image": ("query.jpg", self.image, "image/jpeg")},
+            )
+        name, content = self.rng.choice(self.documents)
+        return await client.post(
+            f"{API_PREFIX}/process/",
+            files={"file": (name, content, MIME_TYPES[os.path.splitext(name)[1]])},
+        )
+
+    async def client_loop(self, client: httpx.AsyncClient, deadline: float) -> None:
+        while time.monotonic() < deadline:
+            if self.requests is not None:
+                if self._sent >= self.requests:
+                    return
+                self._sent += 1
+
+            scenario = self.rng.choices(self.scenarios, self.weights)[0]
+            stats = self.stats[scenario]
+            started = time.perf_counter()
+            try:
+                response = await self.send(client, scenario)
+                stats.statuses[response.status_code] += 1
+                if response.status_code >= 400:
+                    stats.errors += 1
+            except httpx.HTTPError as e:
+                stats.statuses[type(e).__name__] += 1
+                stats.errors += 1
+            stats.latencies.append(time.perf_counter() - started)
+
+    async def run(self) -> Dict[str, Dict[str, float]]:
+        limits = httpx.Limits(max_connections=self.concurrency, max_keepalive_connections=self.concurrency)
+        async with httpx.AsyncClient(base_url=self.url, limits=limits, timeout=self.timeout) as client:
+            started = time.monotonic()
+            deadline = started + self.duration if self.requests is None else float("inf")
+            await asyncio.gather(*(self.client_loop(client, deadline) for _ in range(self.concurrency)))
+            elapsed = time.monotonic() - started
+
+        report = {name: stats.summary(elapsed) for name, stats in self.stats.items()}
+        total = ScenarioStats()
+        for stats in self.stats.values():
+            total.latencies.extend(stats.latencies)
+            total.statuses.update(stats.statuses)
+            total.errors += stats.errors
+        report["total"] = total.summary(elapsed)
+        return report
+
+
+async def seed_index(url: str, documents: List[Tuple[str, bytes]], count: int) -> None:
+    """Загружает count документов через /process/, чтобы поиску было что искать."""
+    async with httpx.AsyncClient(base_url=url, timeout=300) as client:
+        for index in range(count):
+            name, content = documents[index % len(documents)]
+            response = await client.post(
+                f"{API_PREFIX}/process/",
+                files={"file": (name, content, MIME_TYPES[os.path.splitext(name)[1]])},
+            )
+            response.raise_for_status()
+
+
+def wait_until_healthy(url: str, process: subprocess.Popen, timeout: float) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Service exited with code {process.returncode}")
+        try:
+            if httpx.get(f"{url}/health", timeout=2).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.5)
+    raise TimeoutError(f"Service at {url} did not become healthy in {timeout:.0f}s")
+
+
+@contextmanager
+def serve(workers: int, env: Dict[str, str], port: int, workdir: str, startup_timeout: float) -> Iterator[str]:
+    """
+    Запускает сервис через uvicorn. Рабочий каталог - workdir, поэтому
+    загруженные файлы, логи и встроенный индекс не попадают в каталог сервиса.
+    """
+    url = f"http://127.0.0.1:{port}"
+    command = [
+        sys.executable, "-m", "uvicorn", "main:app",
+        "--app-dir", SERVICE_DIR,
+        "--host", "127.0.0.1",
+        "--port", str(port),
+        "--workers", str(workers),
+        "--log-level", "warning",
+    ]
+    process = subprocess.Popen(command, cwd=workdir, env={**os.environ, **env})
+    try:
+        wait_until_healthy(url, process, startup_timeout)
+        yield url
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+def parse_variant(value: str) -> Dict[str, str]:
+    env = {}
+    for assignment in value.split():
+        key, separator, val = assignment.partition("=")
+        if not separator:
+            raise argparse.ArgumentTypeError(f"Expected KEY=VALUE, got {assignment}")
+        env[key] = val
+    return env
+
+
+def print_report(title: str, report: Dict[str, Dict[str, float]]) -> None:
+    print(f"\n{title}")
+    print(f"  {'scenario':>10} {'requests':>9} {'errors':>7} {'rps':>8} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    for name, stats in report.items():
+        print(
+            f"  {name:>10} {stats['requests']:>9} {stats['errors']:>7} {stats['rps']:>8.1f} "
+            f"{stats['p50_ms']:>9.1f} {stats['p90_ms']:>9.1f} {stats['p99_ms']:>9.1f} {stats['max_ms']:>9.1f}"
+        )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("--url", help="адрес запущенного сервиса")
+    target.add_argument("--serve", action="store_true", help="запускать сервис для каждой конфигурации")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix("search=80,multimodal=15,process=5"))
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=30.0, help="длительность замера в секундах")
+    parser.add_argument("--requests", type=int, help="число запросов вместо длительности")
+    parser.add_argument("--queries", help="файл с запросами или JSON-логи сервиса")
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1], help="числа воркеров uvicorn (--serve)")
+    parser.add_argument("--variant", type=parse_variant, action="append", help="переменные окружения конфигурации (--serve)")
+    parser.add_argument("--backend", choices=("embedded", "elasticsearch"), default="embedded")
+    parser.add_argument("--real-models", action="store_true", help="загружать настоящие модели (--serve)")
+    parser.add_argument("--seed-documents", type=int, default=20)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--startup-timeout", type=float, default=600.0)
+    parser.add_argument("--output", help="сохранить отчеты в JSON")
+    args = parser.parse_args()
+    if args.serve and args.backend == "embedded" and max(args.workers) > 1:
+        parser.error("--workers > 1 requires --backend elasticsearch: the embedded index is single-process")
+
+    queries = load_queries(args.queries, seed=args.seed)
+    reports = {}
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        documents, image = prepare_files(tmp_dir)
+
+        def run(url: str) -> Dict[str, Dict[str, float]]:
+            test = LoadTest(
+                url, args.mix, queries, documents, image,
+                concurrency=args.concurrency,
+                duration=args.duration,
+                requests=args.requests,
+                timeout=args.timeout,
+                seed=args.seed,
+            )
+            return asyncio.run(test.run())
+
+        if args.url:
+            reports[args.url] = run(args.url)
+            print_report(args.url, reports[args.url])
+        else:
+            base_env = {
+                "SEARCH_BACKEND": args.backend,
+                "EMBEDDED_INDEX_DIR": os.path.join(tmp_dir, "index"),
+                "EMBEDDING_STUB_MODELS": "false" if args.real_models else "true",
+                "TERM_STATS_PATH": os.path.join(tmp_dir, "term_stats.sqlite3"),
+                "NEAR_DUPLICATE_PATH": os.path.join(tmp_dir, "near_duplicates.sqlite3"),
+            }
+
+            # Индекс заполняется один раз: встроенный индекс каждый воркер читает при запуске
+            if args.seed_documents:
+                with serve(1, base_env, args.port, tmp_dir, args.startup_timeout) as url:
+                    asyncio.run(seed_index(url, documents, args.seed_documents))
+                print(f"Seeded {args.seed_documents} documents.")
+
+            for variant in args.variant or [{}]:
+                for workers in args.workers:
+                    name = " ".join([f"workers={workers}"] + [f"{key}={value}" for key, value in variant.items()])
+                    with serve(workers, {**base_env, **variant}, args.port, tmp_dir, args.startup_timeout) as url:
+                        reports[name] = run(url)
+                    print_report(name, reports[name])
+
+    if len(reports) > 1:
+        print("\nСравнение конфигураций (все сценарии):")
+        for name, report in reports.items():
+            total = report["total"]
+            print(f"  {name:<40} {total['rps']:>8.1f} rps  p50 {total['p50_ms']:>8.1f} ms  p99 {total['p99_ms']:>8.1f} ms  errors {total['errors']}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(reports, f, indent=2, ensure_ascii=False)
+
+
+if __name__ == "__main__":
+    main()
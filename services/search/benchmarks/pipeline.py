@@ -0,0 +1,269 @@
+"""
+Бенчмарк конвейера обработки документов на синтетических PDF и DOCX.
+
+Для каждого документа из benchmarks.synthetic.CASES измеряет время,
+пропускную способность (документов, страниц и мегабайт в секунду) и рост
+пиковой памяти процесса для методов PreprocessingService и для
+process_document целиком. Каждый замер выполняется в отдельном процессе,
+модели загружаются до снятия исходной памяти и в замер не входят.
+Статистика терминов и индекс почти-дубликатов отключены, чтобы результат
+не зависел от накопленного состояния. Память процессов пула разбора
+страниц (больших PDF) в рост пиковой памяти не входит.
+
+Результаты сравниваются с сохраненной базой (benchmarks/baselines/pipeline.json):
+замер считается регрессией, если медиана времени или рост памяти больше
+базовых на --threshold (по умолчанию 15%). При регрессии команда
+завершается с кодом 1. Базу имеет смысл сравнивать только с прогонами
+на той же машине; при другом окружении выводится предупреждение.
+
+Запуск из каталога services/search:
+
+    python -m benchmarks.pipeline                     # сравнение с базой
+    python -m benchmarks.pipeline --save-baseline     # сохранить новую базу
+    python -m benchmarks.pipeline --cases pdf_text_200 --methods extract_text process_document
+    python -m benchmarks.pipeline --skip-models       # только этапы без моделей
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import resource
+import tempfile
+import statistics
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from multiprocessing import get_context
+from typing import Any, Callable, Dict, List, Tuple
+
+os.environ.setdefault("SEARCH_SERVICE_PROJECT_NAME", "benchmark")
+
+from benchmarks.synthetic import CASES, DocumentSpec, generate_document
+
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines", "pipeline.json")
+
+# Метод -> нужны ли модели векторизации
+METHODS: Dict[str, bool] = {
+    "extract_text": False,
+    "extract_metadata": False,
+    "extract_images": False,
+    "filter_images": False,
+    "analyze_text": False,
+    "vectorize_images": True,
+    "vectorize_text": True,
+    "process_document": True,
+}
+
+# Рост памяти меньше этого значения считается шумом
+MEMORY_SLACK_MB = 5.0
+
+
+def load_service(use_models: bool):
+    from core import config
+    from services.preprocessing import PreprocessingService
+
+    stopwords_collection = {}
+    try:
+        import nltk
+        from nltk.corpus import stopwords
+
+        nltk.data.find("corpora/stopwords")
+        stopwords_collection = {
+            language: set(stopwords.words(corpus))
+            for language, corpus in config.STOPWORD_LANGUAGES.items()
+        }
+    except (ImportError, LookupError):
+        print("Стоп-слова nltk не найдены, теги формируются без них", file=sys.stderr)
+
+    models = {"vectorizer_model": None, "vit_model": None, "vit_processor": None}
+    if use_models:
+        from sentence_transformers import SentenceTransformer
+        from transformers import ViTImageProcessor, ViTModel
+
+        models = {
+            "vectorizer_model": SentenceTransformer(config.embedding_settings.text_model),
+            "vit_model": ViTModel.from_pretrained(config.embedding_settings.image_model),
+            "vit_processor": ViTImageProcessor.from_pretrained(config.embedding_settings.image_model),
+        }
+
+    return PreprocessingService(stopwords_collection=stopwords_collection, **models)
+
+
+def prepare(method: str, service, path: str) -> Callable[[], Any]:
+    """
+    Подготавливает входные данные метода (вне замера) и возвращает вызов,
+    время которого измеряется.
+    """
+    pdf = path.endswith(".pdf")
+    extract_text = service.extract_text_from_pdf if pdf else service.extract_text_from_word
+    extract_metadata = service.extract_metadata_pdf if pdf else service.extract_metadata_word
+    extract_images = service.extract_images_from_pdf if pdf else service.extract_images_from_word
+
+    if method == "extract_text":
+        return partial(extract_text, path)
+    if method == "extract_metadata":
+        return partial(extract_metadata, path)
+    if method == "extract_images":
+        return partial(extract_images, path, tempfile.mkdtemp(dir="."))
+    if method == "filter_images":
+        return partial(service.filter_images, extract_images(path, tempfile.mkdtemp(dir=".")))
+    if method == "analyze_text":
+        return partial(service.analyze_text, extract_text(path))
+    if method == "vectorize_images":
+        images, _ = service.filter_images(extract_images(path, tempfile.mkdtemp(dir=".")))
+        return lambda: list(service.vectorize_images(images))
+    if method == "vectorize_text":
+        return partial(service.vectorize_text, service.analyze_text(extract_text(path)).cleaned_text)
+    if method == "process_document":
+        return partial(service.process_document, path)
+    raise ValueError(f"Unknown method: {method}")
+
+
+def run_measurement(method: str, path: str, spec: DocumentSpec, repeat: int) -> Dict[str, float]:
+    """Выполняется в отдельном процессе, чтобы пиковая память не смешивалась."""
+    path = os.path.abspath(path)
+    workdir = tempfile.mkdtemp()
+    # process_document создает папки изображений в ./data
+    os.chdir(workdir)
+    try:
+        service = load_service(METHODS[method])
+        rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+        timings = []
+        for _ in range(repeat):
+            call = prepare(method, service, path)
+            start = time.perf_counter()
+            call()
+            timings.append(time.perf_counter() - start)
+
+        rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    finally:
+        from services import preprocessing
+
+        preprocessing.shutdown_page_pool()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    median = statistics.median(timings)
+    return {
+        "median_s": median,
+        "min_s": min(timings),
+        "docs_per_s": 1 / median if median else 0.0,
+        "pages_per_s": spec.pages / median if median else 0.0,
+        "mb_per_s": os.path.getsize(path) / 1024 / 1024 / median if median else 0.0,
+        "peak_rss_growth_mb": (rss_after - rss_before) / 1024,
+    }
+
+
+def environment() -> Dict[str, Any]:
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+    }
+
+
+def load_baseline(path: str) -> Dict[str, Any] | None:
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_baseline(path: str, results: Dict[str, Dict[str, Dict[str, float]]]) -> None:
+    baseline = load_baseline(path) or {"results": {}}
+    # Замеры, не вошедшие в прогон, остаются из прежней базы
+    for case, methods in results.items():
+        baseline["results"].setdefault(case, {}).update(methods)
+    baseline["environment"] = environment()
+    baseline["updated_at"] = time.strftime("%Y-%m-%dT%H:%M:%S")
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(baseline, f, indent=2, ensure_ascii=False, sort_keys=True)
+        f.write("\n")
+
+
+def compare(current: Dict[str, float], base: Dict[str, float] | None, threshold: float) -> Tuple[str, List[str]]:
+    """Изменение относительно базы и список регрессий."""
+    if base is None:
+        return "нет базы", []
+
+    regressions = []
+    time_change = current["median_s"] / base["median_s"] - 1 if base["median_s"] else 0.0
+    if time_change > threshold:
+        regressions.append(f"время +{time_change:.0%}")
+
+    memory_limit = base["peak_rss_growth_mb"] * (1 + threshold) + MEMORY_SLACK_MB
+    if current["peak_rss_growth_mb"] > memory_limit:
+        regressions.append(f"память {base['peak_rss_growth_mb']:.0f} -> {current['peak_rss_growth_mb']:.0f} MB")
+
+    return f"{time_change:+.0%}", regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--cases", nargs="+", choices=tuple(CASES), default=list(CASES))
+    parser.add_argument("--methods", nargs="+", choices=tuple(METHODS), default=list(METHODS))
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--threshold", type=float, default=0.15, help="допустимый рост времени и памяти")
+    parser.add_argument("--skip-models", action="store_true", help="не измерять методы, которым нужны модели")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--save-baseline", action="store_true", help="сохранить результаты как базу")
+    parser.add_argument("--output", help="сохранить результаты прогона в JSON")
+    args = parser.parse_args()
+
+    methods = [method for method in args.methods if not (args.skip_models and METHODS[method])]
+    baseline = None if args.save_baseline else load_baseline(args.baseline)
+    if baseline is not None and baseline.get("environment") != environment():
+        print(f"Внимание: база снята в другом окружении {baseline.get('environment')}", file=sys.stderr)
+
+    results: Dict[str, Dict[str, Dict[str, float]]] = {}
+    regressions = []
+    context = get_context("spawn")
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for case in args.cases:
+            spec = CASES[case]
+            path = os.path.join(tmp_dir, f"{case}{spec.extension}")
+            generate_document(path, spec)
+            size_mb = os.path.getsize(path) / 1024 / 1024
+            print(f"\n{case}: {spec.pages} стр., {spec.words_per_page} слов/стр., "
+                  f"{spec.images} изобр. {spec.image_width}x{spec.image_height}, {size_mb:.1f} MB")
+
+            for method in methods:
+                if method in ("extract_images", "filter_images", "vectorize_images") and not spec.images:
+                    continue
+                with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+                    stats = pool.submit(run_measurement, method, path, spec, args.repeat).result()
+                results.setdefault(case, {})[method] = stats
+
+                base = (baseline or {}).get("results", {}).get(case, {}).get(method)
+                change, failed = compare(stats, base, args.threshold)
+                regressions.extend(f"{case}/{method}: {reason}" for reason in failed)
+                print(
+                    f"  {method:>18}: {stats['median_s'] * 1000:9.1f} ms, "
+                    f"{stats['pages_per_s']:8.1f} стр/с, {stats['mb_per_s']:7.2f} MB/s, "
+                    f"peak RSS +{stats['peak_rss_growth_mb']:6.0f} MB  [{change}]"
+                    + (f"  РЕГРЕССИЯ: {', '.join(failed)}" if failed else "")
+                )
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"environment": environment(), "results": results}, f, indent=2, ensure_ascii=False)
+
+    if args.save_baseline:
+        save_baseline(args.baseline, results)
+        print(f"\nБаза сохранена в {args.baseline}")
+    elif regressions:
+        print(f"\nРегрессии (порог {args.threshold:.0%}):")
+        for regression in regressions:
+            print(f"  {regression}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
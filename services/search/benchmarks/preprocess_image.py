@@ -0,0 +1,171 @@
+"""
+Бенчмарк предобработки изображений на больших сканах.
+
+Сравнивает исходную предобработку (полное декодирование, серый, резкость
+в исходном размере) с декодированием в уменьшенном размере: время, пиковую
+память процесса и, с флагом --embeddings, косинусную близость эмбеддингов ViT.
+
+Уменьшенное декодирование выключено по умолчанию (PREPROCESSING_IMAGE_DECODE_SIZE=0):
+его включают, когда минимальная близость эмбеддингов на этом бенчмарке не ниже
+--min-cosine. Иначе бенчмарк завершается с кодом 1.
+
+Запуск из каталога services/search:
+
+    python -m benchmarks.preprocess_image --count 5 --embeddings [--min-cosine 0.98]
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import resource
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from typing import Dict, List
+
+from PIL import Image, ImageDraw, ImageEnhance, ImageOps
+
+os.environ.setdefault("SEARCH_SERVICE_PROJECT_NAME", "benchmark")
+
+VIT_CHECKPOINT = "google/vit-base-patch16-224-in21k"
+
+
+def generate_scan(path: str, width: int, height: int, seed: int, quality: int = 90) -> None:
+    """Генерирует синтетический скан страницы: строки «текста», таблицу и шум."""
+    rng = random.Random(seed)
+    page = Image.new("L", (width, height), 245)
+    draw = ImageDraw.Draw(page)
+
+    margin = width // 12
+    line_height = max(height // 90, 8)
+    y = margin
+    while y < height - margin:
+        x = margin
+        while x < width - margin:
+            word = rng.randint(line_height, line_height * 6)
+            draw.rectangle((x, y, min(x + word, width - margin), y + line_height // 2), fill=rng.randint(10, 60))
+            x += word + line_height // 2
+        y += line_height + rng.randint(0, line_height)
+
+    table_top = height // 2
+    for i in range(8):
+        draw.line((margin, table_top + i * line_height * 2, width - margin, table_top + i * line_height * 2), fill=0, width=3)
+
+    noise = Image.effect_noise((width, height), 18)
+    page = Image.blend(page, noise, 0.08)
+    page.convert("RGB").save(path, "JPEG", quality=quality)
+
+
+def legacy_preprocess_image(image_path: str) -> Image.Image:
+    """Исходная предобработка: все операции над изображением в полном размере."""
+    image = Image.open(image_path)
+    gray_image = ImageOps.grayscale(image).convert("RGB")
+    return ImageEnhance.Sharpness(gray_image).enhance(2.0)
+
+
+def _preprocess(mode: str, decode_size: int):
+    if mode == "legacy":
+        return legacy_preprocess_image
+
+    from services.preprocessing import PreprocessingService
+
+    service = PreprocessingService(
+        stopwords_collection={},
+        vectorizer_model=None,
+        vit_model=None,
+        vit_processor=None,
+        image_decode_size=decode_size,
+    )
+    return service.preprocess_image
+
+
+def run_variant(mode: str, paths: List[str], decode_size: int) -> Dict[str, float]:
+    """Выполняется в отдельном процессе, чтобы пиковая память не смешивалась."""
+    preprocess = _preprocess(mode, decode_size)
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    timings = []
+    for path in paths:
+        start = time.perf_counter()
+        image = preprocess(path)
+        image.load()
+        timings.append(time.perf_counter() - start)
+        image.close()
+
+    rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return {
+        "mean_s": sum(timings) / len(timings),
+        "max_s": max(timings),
+        "peak_rss_growth_mb": (rss_after - rss_before) / 1024,
+    }
+
+
+def compare_embeddings(paths: List[str], decode_size: int) -> Dict[str, float]:
+    import torch
+    from transformers import ViTImageProcessor, ViTModel
+
+    processor = ViTImageProcessor.from_pretrained(VIT_CHECKPOINT)
+    model = ViTModel.from_pretrained(VIT_CHECKPOINT)
+    resized = _preprocess("resized", decode_size)
+
+    def embed(image: Image.Image) -> "torch.Tensor":
+        with torch.no_grad():
+            outputs = model(**processor(images=image, return_tensors="pt"))
+        return outputs.last_hidden_state.mean(dim=1).squeeze()
+
+    similarities = []
+    for path in paths:
+        legacy = embed(legacy_preprocess_image(path))
+        current = embed(resized(path))
+        similarities.append(torch.nn.functional.cosine_similarity(legacy, current, dim=0).item())
+
+    return {
+        "cosine_min": min(similarities),
+        "cosine_mean": sum(similarities) / len(similarities),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--count", type=int, default=5, help="количество сканов")
+    parser.add_argument("--width", type=int, default=5000)
+    parser.add_argument("--height", type=int, default=7000)
+    parser.add_argument("--decode-size", type=int, default=448)
+    parser.add_argument("--embeddings", action="store_true", help="сравнить эмбеддинги ViT")
+    parser.add_argument(
+        "--min-cosine", type=float, default=0.98,
+        help="минимальная допустимая близость эмбеддингов для уменьшенного декодирования",
+    )
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        paths = []
+        for i in range(args.count):
+            path = os.path.join(tmp_dir, f"scan_{i}.jpg")
+            generate_scan(path, args.width, args.height, seed=i)
+            paths.append(path)
+
+        print(f"{args.count} сканов {args.width}x{args.height}, decode size {args.decode_size}")
+
+        context = get_context("spawn")
+        for mode in ("legacy", "resized"):
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+                stats = pool.submit(run_variant, mode, paths, args.decode_size).result()
+            print(
+                f"{mode:>8}: mean {stats['mean_s'] * 1000:8.1f} ms, "
+                f"max {stats['max_s'] * 1000:8.1f} ms, "
+                f"peak RSS +{stats['peak_rss_growth_mb']:.0f} MB"
+            )
+
+        if args.embeddings:
+            stats = compare_embeddings(paths, args.decode_size)
+            print(f"cosine similarity legacy vs resized: min {stats['cosine_min']:.4f}, mean {stats['cosine_mean']:.4f}")
+            if stats["cosine_min"] < args.min_cosine:
+                print(f"decode size {args.decode_size} is below tolerance {args.min_cosine}, keep full decoding")
+                sys.exit(1)
+            print(f"decode size {args.decode_size} is within tolerance {args.min_cosine}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+"""
+Генерация синтетических PDF и DOCX для бенчмарков обработки документов.
+
+Документы создаются локально и воспроизводимо (по seed): число страниц,
+плотность текста, количество изображений и их разрешение задаются в
+DocumentSpec. Изображения - синтетические сканы из benchmarks.preprocess_image,
+у каждого свой seed, поэтому фильтр повторяющихся изображений их не отбрасывает.
+
+PDF создаются через PyMuPDF со встроенным шрифтом Helvetica, который не
+содержит кириллицы, поэтому текст PDF англоязычный; текст DOCX - русский.
+"""
+import io
+import random
+import tempfile
+import textwrap
+from dataclasses import dataclass
+from typing import Dict, Iterator, List
+
+import fitz
+from docx import Document
+from docx.shared import Inches
+
+from benchmarks.preprocess_image import generate_scan
+from benchmarks.text_analysis import EN_WORDS, RU_WORDS
+
+
+@dataclass(frozen=True)
+class DocumentSpec:
+    format: str  # pdf или docx
+    pages: int
+    words_per_page: int
+    images: int = 0
+    image_width: int = 1240
+    image_height: int = 1754
+    seed: int = 0
+
+    @property
+    def extension(self) -> str:
+        return f".{self.format}"
+
+
+CASES: Dict[str, DocumentSpec] = {
+    "pdf_text_10": DocumentSpec("pdf", pages=10, words_per_page=400),
+    "pdf_text_200": DocumentSpec("pdf", pages=200, words_per_page=400),
+    "pdf_dense_50": DocumentSpec("pdf", pages=50, words_per_page=1000),
+    "pdf_images_20": DocumentSpec("pdf", pages=10, words_per_page=200, images=20, image_width=800, image_height=600),
+    "pdf_scans_5": DocumentSpec("pdf", pages=5, words_per_page=50, images=5, image_width=2480, image_height=3508),
+    "docx_text_50": DocumentSpec("docx", pages=50, words_per_page=400),
+    "docx_images_10": DocumentSpec("docx", pages=10, words_per_page=300, images=10, image_width=1200, image_height=900),
+}
+
+
+def generate_words(rng: random.Random, vocabulary: List[str], count: int) -> str:
+    words = []
+    for _ in range(count):
+        word = rng.choice(vocabulary)
+        if rng.random() < 0.08:
+            word = word.capitalize() + rng.choice([".", ",", ":"])
+        words.append(word)
+    return " ".join(words)
+
+
+def generate_images(spec: DocumentSpec) -> Iterator[bytes]:
+    """JPEG-изображения документа, каждое со своим seed."""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = f"{tmp_dir}/image.jpg"
+        for index in range(spec.images):
+            generate_scan(path, spec.image_width, spec.image_height, seed=spec.seed * 1000 + index)
+            with open(path, "rb") as f:
+                yield f.read()
+
+
+def images_per_page(spec: DocumentSpec) -> List[int]:
+    """Распределяет изображения по страницам как можно равномернее."""
+    base, extra = divmod(spec.images, spec.pages)
+    return [base + (1 if page < extra else 0) for page in range(spec.pages)]
+
+
+def generate_pdf(path: str, spec: DocumentSpec) -> None:
+    rng = random.Random(spec.seed)
+    images = generate_images(spec)
+    document = fitz.open()
+
+    for page_images in images_per_page(spec):
+        page = document.new_page(width=595, height=842)
+        lines = textwrap.wrap(generate_words(rng, EN_WORDS, spec.words_per_page), width=110)
+        page.insert_text((40, 50), lines, fontname="helv", fontsize=7)
+
+        # Изображения занимают нижнюю половину страницы в один ряд
+        width = 515 / max(page_images, 1)
+        for index in range(page_images):
+            rect = fitz.Rect(40 + index * width, 440, 40 + (index + 1) * width - 5, 800)
+            page.insert_image(rect, stream=next(images), keep_proportion=True)
+
+    document.save(path, deflate=True)
+    document.close()
+
+
+def generate_docx(path: str, spec: DocumentSpec) -> None:
+    rng = random.Random(spec.seed)
+    images = generate_images(spec)
+    document = Document()
+
+    for page, page_images in enumerate(images_per_page(spec)):
+        words = spec.words_per_page
+        # Страница - несколько абзацев примерно по 80 слов
+        while words > 0:
+            document.add_paragraph(generate_words(rng, RU_WORDS, min(words, 80)))
+            words -= 80
+        for _ in range(page_images):
+            document.add_picture(io.BytesIO(next(images)), width=Inches(5))
+        if page < spec.pages - 1:
+            document.add_page_break()
+
+    document.save(path)
+
+
+def generate_document(path: str, spec: DocumentSpec) -> None:
+    if spec.format == "pdf":
+        generate_pdf(path, spec)
+    elif spec.format == "docx":
+        generate_docx(path, spec)
+    else:
+        raise ValueError(f"Unsupported format: {spec.format}")
@@ -0,0 +1,92 @@
+"""
+Микробенчмарк очистки текста и генерации тегов.
+
+Сравнивает исходную цепочку (decode_unicode_sequence -> clean_text ->
+preprocess_text -> фильтрация стоп-слов -> Counter) с однопроходным
+utils.text.analyze_text на синтетических текстах в несколько мегабайт
+и проверяет, что результаты совпадают. Определение языка в замер не входит.
+
+Запуск из каталога services/search:
+
+    python -m benchmarks.text_analysis --sizes 1 4 16
+"""
+import re
+import time
+import random
+import argparse
+from collections import Counter
+from typing import Callable, List, Tuple
+
+from utils.text import analyze_text
+
+
+RU_WORDS = (
+    "никель медь палладий производство рудник обогащение концентрат отчет "
+    "добыча переработка металлургия плавка анализ показатель выпуск и в на по с"
+).split()
+EN_WORDS = "nickel copper plant output report mining ore the of and to in".split()
+STOPWORDS = {"и", "в", "на", "по", "с", "the", "of", "and", "to", "in"}
+
+
+def legacy_chain(text: str, stopwords: set, num_tags: int = 10) -> Tuple[str, List[str]]:
+    """Исходная реализация из PreprocessingService."""
+    text = re.sub(r"/uni([0-9A-Fa-f]{4})", lambda x: chr(int(x.group(1), 16)), text)
+    text = re.sub(r'[^a-zA-Zа-яА-Я0-9.,\s]', '', text)
+    cleaned = re.sub(r'\s+', ' ', text).strip()
+
+    words = re.sub(r'[^\w\s]', '', cleaned).lower().split()
+    meaningful_words = [word for word in words if word not in stopwords]
+    tags = [word for word, _ in Counter(meaningful_words).most_common(num_tags)]
+    return cleaned, tags
+
+
+def single_pass(text: str, stopwords: set, num_tags: int = 10) -> Tuple[str, List[str]]:
+    analysis = analyze_text(text, stopwords, num_tags=num_tags)
+    return analysis.cleaned_text, analysis.tags
+
+
+def generate_text(size_mb: float, seed: int = 0) -> str:
+    rng = random.Random(seed)
+    vocabulary = RU_WORDS * 3 + EN_WORDS + ["/uni0416", "2024", "12,5%", "(т)", "—", "№"]
+    parts, size = [], 0
+    target = int(size_mb * 1024 * 1024)
+    while size < target:
+        word = rng.choice(vocabulary)
+        if rng.random() < 0.1:
+            word = word.capitalize() + rng.choice([".", ",", ";", ":", "!"])
+        separator = "\n" if rng.random() < 0.05 else " "
+        parts.append(word + separator)
+        size += len(word) + 1
+    return "".join(parts)
+
+
+def measure(func: Callable, text: str, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(text, STOPWORDS)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=float, nargs="+", default=[1, 4, 16], help="размеры текста в МБ")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    for size_mb in args.sizes:
+        text = generate_text(size_mb)
+        if legacy_chain(text, STOPWORDS) != single_pass(text, STOPWORDS):
+            raise SystemExit(f"Результаты не совпадают для текста {size_mb} МБ")
+
+        legacy = measure(legacy_chain, text, args.repeat)
+        current = measure(single_pass, text, args.repeat)
+        print(
+            f"{size_mb:6.1f} MB: legacy {legacy * 1000:8.1f} ms, "
+            f"single pass {current * 1000:8.1f} ms, x{legacy / current:.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
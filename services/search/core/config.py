@@ -3,7 +3,8 @@ from typing import List, Dict, Union
 from logging import config as logging_config
 from libs.es.indices.document import (
     index_name as document_index_name,
-    index_json as document_index_json
+    index_json as document_index_json,
+    index_version as document_index_version,
 )
 
 from core.logger import LOGGING
@@ -21,12 +22,39 @@ PAGE_ALIAS = "page"
 SIZE_DESC = "Количество элементов на странице"
 SIZE_ALIAS = "size"
 
+COLLAPSE_DUPLICATES_DESC = "Возвращать только один документ из группы почти-дубликатов"
+
+VECTOR_DESC = "Вектор запроса, полученный текущей текстовой моделью"
+SEMANTIC_DESC = "Искать по эмбеддингу текстового запроса вместо полнотекстового поиска"
+INCLUDE_DUPLICATES_DESC = "Включать в результат почти-дубликаты исходного документа"
+LANGUAGE_DESC = "Язык документа"
+TAGS_DESC = "Теги документа (достаточно совпадения одного)"
+AUTHOR_DESC = "Автор документа"
+CREATED_FROM_DESC = "Дата создания документа, не раньше"
+CREATED_TO_DESC = "Дата создания документа, не позже"
+
 MAX_PAGE_SIZE = 100
 MAX_GENRES_SIZE = 50
+MAX_BATCH_QUERIES = 100
 
 UPLOAD_FILES_DIR = "./data/uploaded_documents"
 TEMP_FILES_DIR = "./data/temp_files"
 
+DOCUMENT_FILE_TYPES = {".pdf", ".docx"}
+ARCHIVE_FILE_TYPES = {".zip"}
+# Языки со своими стоп-словами (названия корпусов nltk) и анализаторами в индексе
+STOPWORD_LANGUAGES = {"ru": "russian", "en": "english"}
+ANALYZED_LANGUAGES = ("ru", "en")
+
+IMAGE_FILE_TYPES = {".png", ".jpg", ".jpeg", ".gif", ".bmp", ".tif", ".tiff"}
+
+# Модели, которыми получены векторы, сохраненные без поля *_embedding_model
+LEGACY_TEXT_MODEL = "paraphrase-multilingual-MiniLM-L12-v2"
+LEGACY_IMAGE_MODEL = "google/vit-base-patch16-224-in21k"
+# Модель изображения, файл которого не найден при пересчете эмбеддингов:
+# вектора у него нет, и повторно он для пересчета не выбирается
+UNAVAILABLE_IMAGE_MODEL = "unavailable"
+
 
 logging_config.dictConfig(LOGGING)
 
@@ -40,13 +68,213 @@ class Settings(BaseSettings):
 settings = Settings()
 
 
+class UploadSettings(BaseSettings):
+    max_document_size: int = Field(200 * 1024 * 1024, alias='UPLOAD_MAX_DOCUMENT_SIZE')
+    max_image_size: int = Field(20 * 1024 * 1024, alias='UPLOAD_MAX_IMAGE_SIZE')
+    chunk_size: int = Field(1024 * 1024, alias='UPLOAD_CHUNK_SIZE')
+
+
+upload_settings = UploadSettings()
+
+
+class IngestionSettings(BaseSettings):
+    bulk_size: int = Field(20, alias='INGEST_BULK_SIZE')
+    pipeline_depth: int = Field(2, alias='INGEST_PIPELINE_DEPTH')
+    max_batch_files: int = Field(500, alias='INGEST_MAX_BATCH_FILES')
+    max_archive_size: int = Field(2 * 1024 * 1024 * 1024, alias='INGEST_MAX_ARCHIVE_SIZE')
+
+
+ingestion_settings = IngestionSettings()
+
+
+class PreprocessingSettings(BaseSettings):
+    page_window: int = Field(50, alias='PREPROCESSING_PAGE_WINDOW')
+    parallel_pages_threshold: int = Field(200, alias='PREPROCESSING_PARALLEL_PAGES_THRESHOLD')
+    workers: int = Field(os.cpu_count() or 1, alias='PREPROCESSING_WORKERS')
+    # Размер декодированных изображений одного окна векторизации, байт (не вся память обработки)
+    image_memory_limit: int = Field(256 * 1024 * 1024, alias='PREPROCESSING_IMAGE_MEMORY_LIMIT')
+    image_batch_size: int = Field(16, alias='PREPROCESSING_IMAGE_BATCH_SIZE')
+    # 0 - полное декодирование; уменьшенное включается после проверки
+    # близости эмбеддингов (benchmarks/preprocess_image.py --embeddings)
+    image_decode_size: int = Field(0, alias='PREPROCESSING_IMAGE_DECODE_SIZE')
+
+
+preprocessing_settings = PreprocessingSettings()
+
+
+class ImageFilterSettings(BaseSettings):
+    enabled: bool = Field(True, alias='IMAGE_FILTER_ENABLED')
+    min_bytes: int = Field(2048, alias='IMAGE_FILTER_MIN_BYTES')
+    min_side: int = Field(48, alias='IMAGE_FILTER_MIN_SIDE')
+    max_aspect: float = Field(12.0, alias='IMAGE_FILTER_MAX_ASPECT')
+    min_entropy: float = Field(1.5, alias='IMAGE_FILTER_MIN_ENTROPY')
+    max_repeats: int = Field(3, alias='IMAGE_FILTER_MAX_REPEATS')
+
+
+image_filter_settings = ImageFilterSettings()
+
+
+class LanguageSettings(BaseSettings):
+    sample_size: int = Field(3000, alias='LANGUAGE_SAMPLE_SIZE')
+    sample_windows: int = Field(3, alias='LANGUAGE_SAMPLE_WINDOWS')
+    default_language: str = Field('ru', alias='LANGUAGE_DEFAULT')
+
+
+language_settings = LanguageSettings()
+
+
+class TermStatsSettings(BaseSettings):
+    enabled: bool = Field(True, alias='TERM_STATS_ENABLED')
+    path: str = Field('./data/term_stats.sqlite3', alias='TERM_STATS_PATH')
+    compaction_interval: int = Field(1000, alias='TERM_STATS_COMPACTION_INTERVAL')
+    max_terms: int = Field(500_000, alias='TERM_STATS_MAX_TERMS')
+
+
+term_stats_settings = TermStatsSettings()
+
+
+class NearDuplicateSettings(BaseSettings):
+    enabled: bool = Field(True, alias='NEAR_DUPLICATE_ENABLED')
+    path: str = Field('./data/near_duplicates.sqlite3', alias='NEAR_DUPLICATE_PATH')
+    num_perm: int = Field(128, alias='NEAR_DUPLICATE_NUM_PERM')
+    num_bands: int = Field(16, alias='NEAR_DUPLICATE_NUM_BANDS')
+    shingle_size: int = Field(5, alias='NEAR_DUPLICATE_SHINGLE_SIZE')
+    threshold: float = Field(0.85, alias='NEAR_DUPLICATE_THRESHOLD')
+    min_tokens: int = Field(50, alias='NEAR_DUPLICATE_MIN_TOKENS')
+    skip_images: bool = Field(True, alias='NEAR_DUPLICATE_SKIP_IMAGES')
+
+
+near_duplicate_settings = NearDuplicateSettings()
+
+
+class EmbeddingSettings(BaseSettings):
+    text_model: str = Field(LEGACY_TEXT_MODEL, alias='EMBEDDING_TEXT_MODEL')
+    image_model: str = Field(LEGACY_IMAGE_MODEL, alias='EMBEDDING_IMAGE_MODEL')
+    # Детерминированные заглушки вместо моделей (нагрузочные тесты, офлайн-стенды)
+    stub_models: bool = Field(False, alias='EMBEDDING_STUB_MODELS')
+
+
+embedding_settings = EmbeddingSettings()
+
+
+class ReembedSettings(BaseSettings):
+    batch_size: int = Field(16, alias='REEMBED_BATCH_SIZE')
+    max_docs_per_second: float = Field(2.0, alias='REEMBED_MAX_DOCS_PER_SECOND')
+    torch_threads: int = Field(1, alias='REEMBED_TORCH_THREADS')
+    state_path: str = Field('./data/reembed_state.json', alias='REEMBED_STATE_PATH')
+
+
+reembed_settings = ReembedSettings()
+
+
+class ProjectionSettings(BaseSettings):
+    # Пустой путь отключает проекцию векторов соответствующего типа
+    text_path: str = Field('', alias='PROJECTION_TEXT_PATH')
+    image_path: str = Field('', alias='PROJECTION_IMAGE_PATH')
+
+
+projection_settings = ProjectionSettings()
+
+
+class ProfilingSettings(BaseSettings):
+    # Пустой токен выключает профилирование по запросу
+    token: str = Field('', alias='PROFILING_TOKEN')
+    # Доля запросов, профилируемых всегда; сохраняются только медленные
+    sample_rate: float = Field(0.0, alias='PROFILING_SAMPLE_RATE')
+    slow_threshold: float = Field(1.0, alias='PROFILING_SLOW_THRESHOLD')
+    interval: float = Field(0.005, alias='PROFILING_INTERVAL')
+    path: str = Field('./logs/profiles', alias='PROFILING_DIR')
+
+
+profiling_settings = ProfilingSettings()
+
+
+class LoggingSettings(BaseSettings):
+    # Записи сверх размера очереди отбрасываются, чтобы не блокировать запросы
+    queue_size: int = Field(10000, alias='LOG_QUEUE_SIZE')
+    # Доля успешных быстрых запросов в журнале доступа; ошибки и медленные пишутся всегда
+    access_sample_rate: float = Field(1.0, alias='LOG_ACCESS_SAMPLE_RATE')
+    access_slow_threshold: float = Field(1.0, alias='LOG_ACCESS_SLOW_THRESHOLD')
+
+
+logging_settings = LoggingSettings()
+
+
+class AdmissionSettings(BaseSettings):
+    enabled: bool = Field(True, alias='ADMISSION_ENABLED')
+    # Общий предел одновременных дорогих запросов всех классов
+    capacity: int = Field(max(os.cpu_count() or 1, 2), alias='ADMISSION_CAPACITY')
+    # Места из capacity, недоступные загрузке документов: поиску всегда остается
+    # хотя бы столько мест, даже если загрузки заняли все остальные
+    search_reserved: int = Field(1, alias='ADMISSION_SEARCH_RESERVED')
+    ingestion_limit: int = Field(2, alias='ADMISSION_INGESTION_LIMIT')
+    ingestion_queue: int = Field(16, alias='ADMISSION_INGESTION_QUEUE')
+    multimodal_limit: int = Field(4, alias='ADMISSION_MULTIMODAL_LIMIT')
+    multimodal_queue: int = Field(32, alias='ADMISSION_MULTIMODAL_QUEUE')
+    batch_search_limit: int = Field(4, alias='ADMISSION_BATCH_SEARCH_LIMIT')
+    batch_search_queue: int = Field(32, alias='ADMISSION_BATCH_SEARCH_QUEUE')
+    queue_timeout: float = Field(10.0, alias='ADMISSION_QUEUE_TIMEOUT')
+    retry_after: float = Field(2.0, alias='ADMISSION_RETRY_AFTER')
+
+
+admission_settings = AdmissionSettings()
+
+
+class DeadlineSettings(BaseSettings):
+    # Срок запроса в секундах, переопределяется заголовком X-Request-Timeout; 0 - без срока
+    timeout: float = Field(30.0, alias='REQUEST_DEADLINE')
+    ingestion_timeout: float = Field(0.0, alias='REQUEST_DEADLINE_INGESTION')
+    max_timeout: float = Field(300.0, alias='REQUEST_DEADLINE_MAX')
+    # Меньше этого времени на инференс не запускается: запрос выполняется без векторов
+    inference_reserve: float = Field(1.0, alias='REQUEST_DEADLINE_INFERENCE_RESERVE')
+    # Время на передачу и разбор ответа Elasticsearch, не входящее в timeout поиска
+    search_margin: float = Field(0.1, alias='REQUEST_DEADLINE_SEARCH_MARGIN')
+
+
+deadline_settings = DeadlineSettings()
+
+
+class LoopMonitorSettings(BaseSettings):
+    enabled: bool = Field(True, alias='LOOP_MONITOR_ENABLED')
+    interval: float = Field(0.1, alias='LOOP_MONITOR_INTERVAL')
+    # Задержка цикла событий, начиная с которой он считается заблокированным
+    threshold: float = Field(0.1, alias='LOOP_MONITOR_THRESHOLD')
+    # Писать в лог стек кода, блокирующего цикл событий
+    debug: bool = Field(False, alias='LOOP_MONITOR_DEBUG')
+
+
+loop_monitor_settings = LoopMonitorSettings()
+
+
+class SearchBackendSettings(BaseSettings):
+    # elasticsearch или embedded (встроенный индекс в процессе сервиса)
+    backend: str = Field('elasticsearch', alias='SEARCH_BACKEND')
+    embedded_path: str = Field('./data/embedded_index', alias='EMBEDDED_INDEX_DIR')
+
+
+search_backend_settings = SearchBackendSettings()
+
+
 class ElasticsearchSettings(BaseSettings):
     es_protocol: str = Field('http', alias='ELASTICSEARCH_PROTOCOL')
     es_host: str = Field('elasticsearch', alias='ELASTICSEARCH_HOST')
     es_port: int = Field(9200, alias='ELASTICSEARCH_PORT')
-    indicies: List[Dict[str, Union[str, dict]]] = [
+    connections_per_node: int = Field(32, alias='ELASTICSEARCH_CONNECTIONS_PER_NODE')
+    request_timeout: float = Field(10.0, alias='ELASTICSEARCH_REQUEST_TIMEOUT')
+    bulk_request_timeout: float = Field(120.0, alias='ELASTICSEARCH_BULK_REQUEST_TIMEOUT')
+    # Сжатие тел запросов: векторы в bulk и script_score занимают основную часть трафика
+    http_compress: bool = Field(True, alias='ELASTICSEARCH_HTTP_COMPRESS')
+    # Повторы чтений при таймаутах, обрывах соединения и 429/502/503/504
+    max_retries: int = Field(2, alias='ELASTICSEARCH_MAX_RETRIES')
+    retry_backoff: float = Field(0.2, alias='ELASTICSEARCH_RETRY_BACKOFF')
+    retry_backoff_max: float = Field(2.0, alias='ELASTICSEARCH_RETRY_BACKOFF_MAX')
+    # Подряд идущих отказов до размыкания и время до пробного запроса
+    circuit_failure_threshold: int = Field(5, alias='ELASTICSEARCH_CIRCUIT_FAILURE_THRESHOLD')
+    circuit_reset_timeout: float = Field(15.0, alias='ELASTICSEARCH_CIRCUIT_RESET_TIMEOUT')
+    indicies: List[Dict[str, Union[str, int, dict]]] = [
         {
             "name": document_index_name,
+            "version": document_index_version,
             "body": document_index_json
         }
     ]
@@ -5,6 +5,10 @@ LOG_DEFAULT_HANDLERS = ['console', ]
 # Про логирование в Python можно прочитать в документации
 # https://docs.python.org/3/howto/logging.html
 # https://docs.python.org/3/howto/logging-cookbook.html
+#
+# Обработчики из этой конфигурации при старте приложения переносятся
+# в фоновые потоки (utils.logger.enqueue_handlers): запись в stdout
+# не блокирует цикл событий.
 
 LOGGING = {
     'version': 1,
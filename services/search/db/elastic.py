@@ -1,19 +1,207 @@
-from elasticsearch import AsyncElasticsearch, BadRequestError, NotFoundError
+import time
+import random
+import asyncio
+from typing import Any, Awaitable, Callable
 
-from utils.abstract import AsyncSearchService
+from elasticsearch import (
+    ApiError,
+    AsyncElasticsearch,
+    BadRequestError,
+    ConnectionError,
+    ConnectionTimeout,
+    NotFoundError,
+    TransportError,
+)
+
+from core.config import ElasticsearchSettings, deadline_settings
+from utils import deadline
+from utils.abstract import (
+    AsyncSearchService,
+    SearchNotFoundError,
+    SearchRequestError,
+    SearchServiceError,
+    SearchUnavailableError,
+)
+from utils.metrics import (
+    ELASTICSEARCH_CIRCUIT_REJECTIONS,
+    ELASTICSEARCH_ERRORS,
+    ELASTICSEARCH_REQUEST_SECONDS,
+    ELASTICSEARCH_RETRIES,
+)
 
 es: AsyncElasticsearch | None = None
+breaker: "CircuitBreaker | None" = None
+
+# Responses meaning the cluster is overloaded or partially down rather than the request being wrong
+UNAVAILABLE_STATUSES = (429, 502, 503, 504)
+
+
+def create_client(settings: ElasticsearchSettings, **kwargs) -> AsyncElasticsearch:
+    """
+    Build a client with pool size, timeouts and compression from settings.
+
+    Transport-level retries are off by default: they retry immediately,
+    while ElasticsearchAdapter retries with jittered backoff.
+    """
+    options = {
+        "connections_per_node": settings.connections_per_node,
+        "request_timeout": settings.request_timeout,
+        "http_compress": settings.http_compress,
+        "max_retries": 0,
+        "retry_on_timeout": False,
+    }
+    options.update(kwargs)
+    return AsyncElasticsearch(hosts=[settings.elastic_url], **options)
+
+
+class CircuitBreaker:
+    """
+    Fail fast while the cluster is unhealthy.
+
+    After failure_threshold consecutive failures (timeouts, connection errors,
+    overload responses) the circuit opens and requests are rejected without a
+    call for reset_timeout seconds. Then a single trial request is let through:
+    success closes the circuit, failure opens it for another reset_timeout.
+    """
+
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: float | None = None
+        self.probing = False
+
+    @property
+    def is_open(self) -> bool:
+        return self.opened_at is not None
+
+    def before_request(self) -> None:
+        """:raises SearchUnavailableError: while the circuit is open."""
+        if self.opened_at is None:
+            return
+        remaining = self.opened_at + self.reset_timeout - time.monotonic()
+        if remaining > 0 or self.probing:
+            raise SearchUnavailableError(
+                "Elasticsearch is unavailable, requests are suspended",
+                retry_after=max(remaining, 1.0),
+            )
+        self.probing = True
+
+    def record(self, healthy: bool | None) -> None:
+        """
+        Record the outcome of a request let through by before_request.
+
+        :param healthy: None if the outcome is unknown (the request was cancelled).
+        """
+        self.probing = False
+        if healthy is None:
+            return
+        if healthy:
+            self.failures = 0
+            self.opened_at = None
+            return
+        self.failures += 1
+        if self.opened_at is not None or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+
+
+def is_unavailable(error: Exception) -> bool:
+    if isinstance(error, (ConnectionError, ConnectionTimeout)):
+        return True
+    return isinstance(error, ApiError) and error.meta.status in UNAVAILABLE_STATUSES
 
 
 class ElasticsearchAdapter(AsyncSearchService):
-    def __init__(self, elastic: AsyncElasticsearch):
+    """
+    Search service on top of AsyncElasticsearch.
+
+    Errors are raised as SearchServiceError subclasses. Reads (get, search,
+    msearch) are retried on timeouts, connection errors and overload responses
+    with full-jitter exponential backoff; writes are not retried, because
+    documents without an explicit id would be indexed twice. All requests go
+    through the shared circuit breaker.
+
+    Within a request deadline (utils.deadline) the remaining time bounds the
+    HTTP request and the search timeout; search responses that timed out on
+    some shards are returned as partial results and marked as degraded.
+    """
+
+    def __init__(
+        self,
+        elastic: AsyncElasticsearch,
+        breaker: CircuitBreaker | None = None,
+        settings: ElasticsearchSettings | None = None,
+    ):
         self.elastic = elastic
+        self.breaker = breaker
+        self.max_retries = settings.max_retries if settings is not None else 0
+        self.retry_backoff = settings.retry_backoff if settings is not None else 0.0
+        self.retry_backoff_max = settings.retry_backoff_max if settings is not None else 0.0
+        self.bulk_request_timeout = settings.bulk_request_timeout if settings is not None else None
+
+    def _client(self, operation: str, request_timeout: float | None) -> AsyncElasticsearch:
+        """Client whose request timeout does not exceed the request deadline."""
+        budget = deadline.remaining()
+        if budget is not None:
+            if budget <= 0:
+                raise deadline.DeadlineExceeded(operation)
+            request_timeout = min(request_timeout, budget) if request_timeout is not None else budget
+        if request_timeout is None:
+            return self.elastic
+        return self.elastic.options(request_timeout=request_timeout)
+
+    async def _call(
+        self,
+        operation: str,
+        request: Callable[[AsyncElasticsearch], Awaitable[Any]],
+        retry: bool = True,
+        request_timeout: float | None = None,
+    ):
+        attempts = self.max_retries + 1 if retry else 1
+        with ELASTICSEARCH_REQUEST_SECONDS.time(operation=operation):
+            for attempt in range(attempts):
+                client = self._client(operation, request_timeout)
+                if self.breaker is not None:
+                    try:
+                        self.breaker.before_request()
+                    except SearchUnavailableError:
+                        ELASTICSEARCH_CIRCUIT_REJECTIONS.inc(operation=operation)
+                        raise
+
+                healthy = None
+                try:
+                    response = await request(client)
+                    healthy = True
+                    return response
+                except NotFoundError as e:
+                    healthy = True
+                    ELASTICSEARCH_ERRORS.inc(operation=operation)
+                    raise SearchNotFoundError(f"Elasticsearch {operation}: {e}") from e
+                except BadRequestError as e:
+                    healthy = True
+                    ELASTICSEARCH_ERRORS.inc(operation=operation)
+                    raise SearchRequestError(f"Invalid {operation} request: {e}") from e
+                except (ApiError, TransportError) as e:
+                    if isinstance(e, ConnectionTimeout) and not deadline.allows(deadline_settings.search_margin):
+                        # The request ran out of its deadline, which says nothing about cluster health
+                        raise deadline.DeadlineExceeded(operation) from e
+                    ELASTICSEARCH_ERRORS.inc(operation=operation)
+                    healthy = not is_unavailable(e)
+                    if healthy:
+                        raise SearchServiceError(f"Elasticsearch {operation} failed: {e}") from e
+                    delay = random.uniform(0, min(self.retry_backoff_max, self.retry_backoff * 2 ** attempt))
+                    # A retry that cannot complete before the request deadline is pointless
+                    if attempt + 1 == attempts or not deadline.allows(delay):
+                        raise SearchUnavailableError(f"Elasticsearch {operation} failed: {e}") from e
+                finally:
+                    if self.breaker is not None:
+                        self.breaker.record(healthy)
+
+                ELASTICSEARCH_RETRIES.inc(operation=operation)
+                await asyncio.sleep(delay)
 
     async def get(self, index: str, id: str, **kwargs):
-        try:
-            return await self.elastic.get(index=index, id=id, **kwargs)
-        except (NotFoundError, BadRequestError):
-            return None
+        return await self._call("get", lambda client: client.get(index=index, id=id, **kwargs))
 
     async def search(
         self,
@@ -21,13 +209,19 @@ class ElasticsearchAdapter(AsyncSearchService):
         body: dict,
         **kwargs
     ):
-        try:
-            return await self.elastic.search(
+        timeout = deadline.search_timeout(deadline_settings.search_margin)
+        if timeout is not None:
+            body = {**body, "timeout": timeout}
+        response = await self._call(
+            "search",
+            lambda client: client.search(
                 index=index, body=body,
                 **kwargs
-            )
-        except (NotFoundError, BadRequestError):
-            return None
+            ),
+        )
+        if response.get("timed_out"):
+            deadline.degrade("partial_results")
+        return response
 
     async def index(
         self,
@@ -38,19 +232,53 @@ class ElasticsearchAdapter(AsyncSearchService):
     ):
         """
         Add or update a document in the Elasticsearch index.
-        
+
         :param index: Name of the Elasticsearch index.
         :param body: The document to be indexed as a dictionary.
         :param id: Optional document ID. If not provided, Elasticsearch generates one.
         :param kwargs: Additional parameters for the Elasticsearch index method.
         :return: Response from Elasticsearch.
         """
-        try:
-            return await self.elastic.index(index=index, body=body, id=id, **kwargs)
-        except BadRequestError as e:
-            raise ValueError(f"Invalid indexing request: {e}")
-        except Exception as e:
-            raise RuntimeError(f"Failed to index document: {e}")
+        return await self._call(
+            "index",
+            lambda client: client.index(index=index, body=body, id=id, **kwargs),
+            retry=False,
+        )
+
+    async def bulk(self, operations: list, **kwargs):
+        """
+        Perform multiple index/update/delete operations in a single request.
+
+        :param operations: Alternating action and source lines of the bulk API.
+        :param kwargs: Additional parameters for the Elasticsearch bulk method.
+        :return: Response from Elasticsearch with per-item results.
+        """
+        return await self._call(
+            "bulk",
+            lambda client: client.bulk(operations=operations, **kwargs),
+            retry=False,
+            request_timeout=self.bulk_request_timeout,
+        )
+
+    async def msearch(self, searches: list, **kwargs):
+        """
+        Execute several searches in a single request.
+
+        :param searches: Alternating header and body lines of the multi search API.
+        :param kwargs: Additional parameters for the Elasticsearch msearch method.
+        :return: Response from Elasticsearch with per-search responses in order.
+        """
+        timeout = deadline.search_timeout(deadline_settings.search_margin)
+        if timeout is not None:
+            # Headers and bodies alternate: the timeout goes into every body
+            searches = [
+                {**line, "timeout": timeout} if position % 2 else line
+                for position, line in enumerate(searches)
+            ]
+        response = await self._call("msearch", lambda client: client.msearch(searches=searches, **kwargs))
+        if any(item.get("timed_out") for item in response["responses"]):
+            deadline.degrade("partial_results")
+        return response
 
 
 async def get_elastic() -> AsyncElasticsearch:
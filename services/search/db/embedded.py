@@ -0,0 +1,855 @@
+import os
+import re
+import json
+import math
+import uuid
+import fcntl
+import heapq
+import sqlite3
+from datetime import date
+from collections import Counter, defaultdict
+from typing import Any, Dict, Hashable, Iterable, Iterator, List, Tuple
+
+import numpy as np
+
+from utils.abstract import AsyncSearchService, SearchNotFoundError, SearchRequestError
+from utils.text import tokenize
+
+engine: "EmbeddedSearchService | None" = None
+
+TEXT_FIELDS = ("title", "text_content")
+TEXT_VECTOR_FIELD = "text_content_embedding"
+IMAGE_VECTOR_FIELD = "image_embedding"
+VECTOR_VALUE_PATTERN = re.compile(r"doc\['([^']+)'\]\.vectorValue")
+COSINE_SCRIPT_PATTERN = re.compile(
+    r"^\s*cosineSimilarity\(params\.(\w+),\s*'([^']+)'\)\s*(?:\+\s*([\d.]+))?\s*;?\s*$"
+)
+
+Key = Hashable
+
+
+class VectorMatrix:
+    """
+    Float32 matrix of vectors addressed by key.
+
+    Rows are appended into a preallocated buffer and removed by moving the
+    last row into the freed slot, so the live rows are always matrix[:len].
+    """
+
+    def __init__(self) -> None:
+        self.keys: List[Key] = []
+        self.rows: Dict[Key, int] = {}
+        self.matrix: np.ndarray | None = None
+        self.norms = np.zeros(0, dtype=np.float32)
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    @property
+    def dims(self) -> int | None:
+        return None if self.matrix is None else self.matrix.shape[1]
+
+    def get(self, key: Key) -> np.ndarray | None:
+        row = self.rows.get(key)
+        return None if row is None else self.matrix[row]
+
+    def check(self, vector: List[float]) -> None:
+        if self.keys and len(vector) != self.dims:
+            raise ValueError(f"Expected {self.dims}-dimensional vector, got {len(vector)}")
+
+    def add(self, key: Key, vector: List[float]) -> None:
+        vector = np.asarray(vector, dtype=np.float32)
+        if key in self.rows:
+            self.remove(key)
+        self.check(vector)
+        if self.matrix is None or not self.keys:
+            self.matrix = np.zeros((16, len(vector)), dtype=np.float32)
+            self.norms = np.zeros(16, dtype=np.float32)
+
+        row = len(self.keys)
+        if row == len(self.matrix):
+            self.matrix = np.concatenate([self.matrix, np.zeros_like(self.matrix)])
+            self.norms = np.concatenate([self.norms, np.zeros_like(self.norms)])
+
+        self.matrix[row] = vector
+        self.norms[row] = np.linalg.norm(vector)
+        self.keys.append(key)
+        self.rows[key] = row
+
+    def remove(self, key: Key) -> None:
+        row = self.rows.pop(key, None)
+        if row is None:
+            return
+        last = len(self.keys) - 1
+        if row != last:
+            moved = self.keys[last]
+            self.matrix[row] = self.matrix[last]
+            self.norms[row] = self.norms[last]
+            self.keys[row] = moved
+            self.rows[moved] = row
+        self.keys.pop()
+
+    def cosine(self, query: List[float]) -> np.ndarray:
+        """Cosine similarity of the query with every live row."""
+        if not self.keys:
+            return np.zeros(0, dtype=np.float32)
+        query = np.asarray(query, dtype=np.float32)
+        if len(query) != self.dims:
+            raise ValueError(f"Expected {self.dims}-dimensional query vector, got {len(query)}")
+        count = len(self.keys)
+        scale = np.maximum(self.norms[:count] * np.linalg.norm(query), 1e-12)
+        return self.matrix[:count] @ query / scale
+
+
+class BM25Index:
+    """Inverted index of one text field with BM25 scoring."""
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75) -> None:
+        self.k1 = k1
+        self.b = b
+        self.postings: Dict[str, Dict[str, int]] = defaultdict(dict)
+        self.lengths: Dict[str, int] = {}
+        self.doc_terms: Dict[str, List[str]] = {}
+        self.total_length = 0
+
+    def add(self, doc_id: str, text: str | None) -> None:
+        self.remove(doc_id)
+        tokens = tokenize(text or "")
+        counts = Counter(tokens)
+        for term, count in counts.items():
+            self.postings[term][doc_id] = count
+        self.lengths[doc_id] = len(tokens)
+        self.doc_terms[doc_id] = list(counts)
+        self.total_length += len(tokens)
+
+    def remove(self, doc_id: str) -> None:
+        for term in self.doc_terms.pop(doc_id, ()):
+            postings = self.postings[term]
+            postings.pop(doc_id, None)
+            if not postings:
+                del self.postings[term]
+        self.total_length -= self.lengths.pop(doc_id, 0)
+
+    def scores(self, terms: Iterable[str]) -> Dict[str, float]:
+        count = len(self.lengths)
+        if not count:
+            return {}
+        average_length = self.total_length / count or 1.0
+
+        scores: Dict[str, float] = defaultdict(float)
+        for term in terms:
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+            for doc_id, tf in postings.items():
+                norm = self.k1 * (1 - self.b + self.b * self.lengths[doc_id] / average_length)
+                scores[doc_id] += idf * tf * (self.k1 + 1) / (tf + norm)
+        return scores
+
+
+class EmbeddedIndex:
+    """
+    One index of the embedded backend.
+
+    Documents are kept in memory: sources without vectors, a BM25 index per
+    text field and vector matrices for text and image embeddings. Every
+    write goes through to a local SQLite file, which is replayed on open.
+    """
+
+    def __init__(self, name: str, path: str) -> None:
+        self.name = name
+        self.sources: Dict[str, dict] = {}
+        self.text_index = {field: BM25Index() for field in TEXT_FIELDS}
+        self.text_vectors = VectorMatrix()
+        self.image_vectors = VectorMatrix()
+        self.versions: Dict[str, int] = {}
+
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS documents ("
+            "id TEXT PRIMARY KEY, version INTEGER NOT NULL, document TEXT NOT NULL)"
+        )
+        self._conn.commit()
+
+        for doc_id, version, document in self._conn.execute(
+            "SELECT id, version, document FROM documents ORDER BY rowid"
+        ):
+            self._load(doc_id, json.loads(document))
+            self.versions[doc_id] = version
+
+    def _load(self, doc_id: str, document: dict) -> None:
+        source = dict(document)
+        text_vector = source.pop(TEXT_VECTOR_FIELD, None)
+        images = [dict(image) for image in source.get("images") or []]
+        image_vectors = [image.pop(IMAGE_VECTOR_FIELD, None) for image in images]
+        if "images" in source:
+            source["images"] = images
+
+        # Размерность проверяется до удаления прежней версии документа
+        if text_vector:
+            self.text_vectors.check(text_vector)
+        for vector in image_vectors:
+            if vector:
+                self.image_vectors.check(vector)
+
+        self._unload(doc_id)
+
+        if text_vector:
+            self.text_vectors.add(doc_id, text_vector)
+        for offset, vector in enumerate(image_vectors):
+            if vector:
+                self.image_vectors.add((doc_id, offset), vector)
+        for field, index in self.text_index.items():
+            index.add(doc_id, source.get(field))
+        self.sources[doc_id] = source
+
+    def _unload(self, doc_id: str) -> None:
+        source = self.sources.pop(doc_id, None)
+        if source is None:
+            return
+        self.text_vectors.remove(doc_id)
+        for offset in range(len(source.get("images") or [])):
+            self.image_vectors.remove((doc_id, offset))
+        for index in self.text_index.values():
+            index.remove(doc_id)
+
+    def document(self, doc_id: str) -> dict:
+        """Source with the stored vectors put back in."""
+        document = dict(self.sources[doc_id])
+        vector = self.text_vectors.get(doc_id)
+        if vector is not None:
+            document[TEXT_VECTOR_FIELD] = vector.tolist()
+        if "images" in document:
+            images = []
+            for offset, image in enumerate(document["images"]):
+                image = dict(image)
+                vector = self.image_vectors.get((doc_id, offset))
+                if vector is not None:
+                    image[IMAGE_VECTOR_FIELD] = vector.tolist()
+                images.append(image)
+            document["images"] = images
+        return document
+
+    def put(self, doc_id: str, document: dict) -> str:
+        result = "updated" if doc_id in self.sources else "created"
+        self._load(doc_id, document)
+        self.versions[doc_id] = self.versions.get(doc_id, 0) + 1
+        self._conn.execute(
+            "INSERT OR REPLACE INTO documents (id, version, document) VALUES (?, ?, ?)",
+            (doc_id, self.versions[doc_id], json.dumps(document, ensure_ascii=False, default=str)),
+        )
+        return result
+
+    def delete(self, doc_id: str) -> bool:
+        if doc_id not in self.sources:
+            return False
+        self._unload(doc_id)
+        self.versions.pop(doc_id, None)
+        self._conn.execute("DELETE FROM documents WHERE id = ?", (doc_id,))
+        return True
+
+    def commit(self) -> None:
+        self._conn.commit()
+
+    def close(self) -> None:
+        self._conn.close()
+
+
+class EmbeddedSearchService(AsyncSearchService):
+    """
+    In-process search backend for development, CI, benchmarks and small sites.
+
+    Implements the subset of the Elasticsearch API that DocumentService,
+    IngestionService and the API endpoints use:
+
+    - queries: match_all, ids, term, terms, exists, range, match,
+      multi_match (BM25, best_fields), bool, nested (with inner_hits) and
+      script_score with cosineSimilarity;
+    - knn (exact search over the vector matrix, including nested image
+      vectors), from/size, collapse, _source filtering and vectorValue
+      script_fields.
+
+    Text is analyzed with utils.text.tokenize, so language subfields
+    (title.ru, text_content.en) are searched as their parent field. Each
+    index is persisted to {path}/{index}.sqlite3. Unsupported requests
+    raise SearchRequestError, missing indices and documents SearchNotFoundError,
+    like in ElasticsearchAdapter.
+
+    The backend is single-process: indices are loaded into memory on open,
+    so a second process would serve a diverging copy and overwrite the other
+    one's documents and versions. The directory is locked while open, and
+    opening it from another process raises RuntimeError.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.indices: Dict[str, EmbeddedIndex] = {}
+        os.makedirs(path, exist_ok=True)
+        self._lock_file = open(os.path.join(path, ".lock"), "w")
+        try:
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            self._lock_file.close()
+            raise RuntimeError(
+                f"Embedded index '{path}' is already open in another process: "
+                f"the embedded backend supports a single process (one uvicorn worker)"
+            ) from None
+        for filename in sorted(os.listdir(path)):
+            if filename.endswith(".sqlite3"):
+                name = filename[:-len(".sqlite3")]
+                self.indices[name] = EmbeddedIndex(name, os.path.join(path, filename))
+
+    def _get_index(self, name: str, create: bool = False) -> EmbeddedIndex | None:
+        if name not in self.indices and create:
+            self.indices[name] = EmbeddedIndex(name, os.path.join(self.path, f"{name}.sqlite3"))
+        return self.indices.get(name)
+
+    def create_index(self, name: str) -> None:
+        self._get_index(name, create=True)
+
+    def vector_dims(self, name: str) -> Dict[str, int | None]:
+        """Dimensions of the stored vectors, keyed like utils.projection.get_vector_dims."""
+        store = self._get_index(name)
+        if store is None:
+            return {"text_content_embedding": None, "images.image_embedding": None}
+        return {
+            "text_content_embedding": store.text_vectors.dims,
+            f"images.{IMAGE_VECTOR_FIELD}": store.image_vectors.dims,
+        }
+
+    def close(self) -> None:
+        for index in self.indices.values():
+            index.close()
+        # Закрытие файла снимает блокировку каталога
+        self._lock_file.close()
+
+    async def get(self, index: str, id: str, **kwargs):
+        store = self._get_index(index)
+        if store is None or id not in store.sources:
+            raise SearchNotFoundError(f"[{id}]: document missing in [{index}]")
+        return {
+            "_index": index,
+            "_id": id,
+            "_version": store.versions.get(id, 1),
+            "found": True,
+            "_source": store.sources[id],
+        }
+
+    async def search(self, index: str, body: dict, **kwargs):
+        store = self._get_index(index)
+        if store is None:
+            raise SearchNotFoundError(f"no such index [{index}]")
+        try:
+            return _Search(store, body, kwargs).run()
+        except ValueError as e:
+            raise SearchRequestError(f"Invalid search request: {e}") from e
+
+    async def index(
+        self,
+        index: str,
+        body: dict,
+        id: str | None = None,
+        **kwargs
+    ):
+        store = self._get_index(index, create=True)
+        doc_id = id or uuid.uuid4().hex
+        try:
+            result = store.put(doc_id, body)
+        except (TypeError, ValueError) as e:
+            raise SearchRequestError(f"Invalid indexing request: {e}") from e
+        store.commit()
+        return {"_index": index, "_id": doc_id, "_version": store.versions[doc_id], "result": result}
+
+    async def bulk(self, operations: list, **kwargs):
+        items = []
+        touched = set()
+        actions = iter(operations)
+
+        for action in actions:
+            (op_type, meta), = action.items()
+            name = meta.get("_index") or kwargs.get("index")
+            store = self._get_index(name, create=op_type != "delete")
+            doc_id = meta.get("_id") or uuid.uuid4().hex
+            item = {"_index": name, "_id": doc_id}
+
+            if op_type in ("index", "create"):
+                document = next(actions)
+                if op_type == "create" and doc_id in store.sources:
+                    error = (409, "version_conflict_engine_exception", f"[{doc_id}]: document already exists")
+                else:
+                    error = self._write(item, lambda: store.put(doc_id, document))
+            elif op_type == "update":
+                update = next(actions)
+                if store is None or doc_id not in store.sources:
+                    error = (404, "document_missing_exception", f"[{doc_id}]: document missing")
+                else:
+                    error = self._write(item, lambda: store.put(doc_id, {**store.document(doc_id), **update.get("doc", {})}))
+            elif op_type == "delete":
+                if store is None or not store.delete(doc_id):
+                    error = (404, "not_found", f"[{doc_id}]: document missing")
+                else:
+                    item["result"] = "deleted"
+                    error = None
+            else:
+                raise SearchRequestError(f"Unsupported bulk action: {op_type}")
+
+            if error is None:
+                item["status"] = 201 if item["result"] == "created" else 200
+                touched.add(store)
+            else:
+                status, error_type, reason = error
+                item.update(status=status, error={"type": error_type, "reason": reason})
+            items.append({op_type: item})
+
+        for store in touched:
+            store.commit()
+
+        return {"errors": any("error" in next(iter(item.values())) for item in items), "items": items}
+
+    @staticmethod
+    def _write(item: dict, write) -> Tuple[int, str, str] | None:
+        try:
+            item["result"] = write()
+        except (TypeError, ValueError) as e:
+            return 400, "document_parsing_exception", str(e)
+        return None
+
+    async def msearch(self, searches: list, **kwargs):
+        responses = []
+        for header, body in zip(searches[::2], searches[1::2]):
+            name = header.get("index") or kwargs.get("index")
+            store = self._get_index(name)
+            if store is None:
+                responses.append({
+                    "error": {"type": "index_not_found_exception", "reason": f"no such index [{name}]"},
+                    "status": 404,
+                })
+                continue
+            try:
+                responses.append({**_Search(store, body, {}).run(), "status": 200})
+            except ValueError as e:
+                responses.append({"error": {"type": "illegal_argument_exception", "reason": str(e)}, "status": 400})
+        return {"responses": responses}
+
+
+class _Search:
+    """Evaluation of one search request against an EmbeddedIndex."""
+
+    SUPPORTED_OPTIONS = {
+        "query", "knn", "from", "size", "collapse", "_source", "script_fields", "track_total_hits",
+    }
+
+    def __init__(self, store: EmbeddedIndex, body: dict, kwargs: dict) -> None:
+        unsupported = set(body) - self.SUPPORTED_OPTIONS
+        if unsupported:
+            raise ValueError(f"Unsupported search options: {sorted(unsupported)}")
+        self.store = store
+        self.body = body
+        self.kwargs = kwargs
+        # name -> doc_id -> [(offset, score)]
+        self.inner_hits: Dict[str, Dict[str, List[Tuple[int, float]]]] = {}
+        self.inner_hits_specs: Dict[str, Tuple[str, dict]] = {}
+
+    def run(self) -> dict:
+        knn = self.body.get("knn") or []
+        if isinstance(knn, dict):
+            knn = [knn]
+
+        if "query" in self.body:
+            scores = self.evaluate(self.body["query"], None)
+        elif knn:
+            scores = {}
+        else:
+            scores = {doc_id: 1.0 for doc_id in self.store.sources}
+
+        for clause in knn:
+            for doc_id, score in self.knn(clause).items():
+                scores[doc_id] = scores.get(doc_id, 0.0) + score
+
+        order = {doc_id: position for position, doc_id in enumerate(self.store.sources)}
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], order[item[0]]))
+
+        collapse = self.body.get("collapse")
+        if collapse:
+            seen = set()
+            collapsed = []
+            for doc_id, score in ranked:
+                values = self.values(doc_id, self.store.sources[doc_id], collapse["field"], None)
+                value = values[0] if values else None
+                if value is not None and value in seen:
+                    continue
+                seen.add(value)
+                collapsed.append((doc_id, score))
+            ranked = collapsed
+
+        start = self.body.get("from", 0)
+        size = self.body.get("size", 10)
+        page = ranked[start:start + size]
+
+        return {
+            "took": 0,
+            "timed_out": False,
+            "hits": {
+                "total": {"value": len(scores), "relation": "eq"},
+                "max_score": ranked[0][1] if ranked else None,
+                "hits": [self.hit(doc_id, score) for doc_id, score in page],
+            },
+        }
+
+    # Ответ
+
+    def source_filter(self) -> Tuple[bool, List[str] | None, List[str] | None]:
+        source = self.body.get("_source", True)
+        includes = self.kwargs.get("_source_includes")
+        excludes = self.kwargs.get("_source_excludes")
+        if isinstance(source, bool):
+            return source, includes, excludes
+        if isinstance(source, (list, str)):
+            return True, [source] if isinstance(source, str) else source, excludes
+        return True, source.get("includes") or includes, source.get("excludes") or excludes
+
+    def hit(self, doc_id: str, score: float) -> dict:
+        result = {"_index": self.store.name, "_id": doc_id, "_score": score}
+
+        enabled, includes, excludes = self.source_filter()
+        if enabled:
+            result["_source"] = filter_source(self.store.sources[doc_id], includes, excludes)
+
+        fields = self.script_fields(self.body.get("script_fields"), doc_id, None)
+        if fields:
+            result["fields"] = fields
+
+        if self.inner_hits_specs:
+            result["inner_hits"] = {}
+            for name, (path, spec) in self.inner_hits_specs.items():
+                matches = sorted(self.inner_hits.get(name, {}).get(doc_id, []), key=lambda item: (-item[1], item[0]))
+                hits = []
+                for offset, inner_score in matches[spec.get("from", 0):spec.get("from", 0) + spec.get("size", 3)]:
+                    inner = {
+                        "_index": self.store.name,
+                        "_id": doc_id,
+                        "_nested": {"field": path, "offset": offset},
+                        "_score": inner_score,
+                    }
+                    if spec.get("_source", True) is not False:
+                        inner["_source"] = self.store.sources[doc_id][path][offset]
+                    inner_fields = self.script_fields(spec.get("script_fields"), (doc_id, offset), path)
+                    if inner_fields:
+                        inner["fields"] = inner_fields
+                    hits.append(inner)
+                result["inner_hits"][name] = {
+                    "hits": {"total": {"value": len(matches), "relation": "eq"}, "hits": hits}
+                }
+
+        return result
+
+    def script_fields(self, specs: dict | None, key: Key, path: str | None) -> Dict[str, list]:
+        fields = {}
+        for name, spec in (specs or {}).items():
+            match = VECTOR_VALUE_PATTERN.search(spec["script"]["source"])
+            if match is None:
+                raise ValueError(f"Unsupported script field: {spec['script']['source']}")
+            vector = self.vector(key, match.group(1), path)
+            if vector is not None:
+                fields[name] = vector.tolist()
+        return fields
+
+    # Поля
+
+    def vector(self, key: Key, field: str, path: str | None) -> np.ndarray | None:
+        if path is None and field == TEXT_VECTOR_FIELD:
+            return self.store.text_vectors.get(key)
+        if path == "images" and field == f"images.{IMAGE_VECTOR_FIELD}":
+            return self.store.image_vectors.get(key)
+        return None
+
+    def values(self, key: Key, record: dict, field: str, path: str | None) -> list:
+        vector = self.vector(key, field, path)
+        if vector is not None:
+            return [vector]
+
+        base = field
+        for suffix in (".ru", ".en"):
+            if base.endswith(suffix) and base[:-len(suffix)] in TEXT_FIELDS:
+                base = base[:-len(suffix)]
+        if path is not None and base.startswith(f"{path}."):
+            base = base[len(path) + 1:]
+
+        values = [record]
+        for part in base.split("."):
+            found = []
+            for value in values:
+                if isinstance(value, dict) and value.get(part) is not None:
+                    item = value[part]
+                    found.extend(item if isinstance(item, list) else [item])
+            values = found
+        return values
+
+    def records(self, path: str | None) -> Iterator[Tuple[Key, dict]]:
+        if path is None:
+            yield from self.store.sources.items()
+            return
+        for doc_id, source in self.store.sources.items():
+            objects = source.get(path) or []
+            if isinstance(objects, dict):
+                objects = [objects]
+            for offset, record in enumerate(objects):
+                yield (doc_id, offset), record
+
+    def matching(self, path: str | None, predicate) -> Dict[Key, float]:
+        return {
+            key: 1.0 for key, record in self.records(path)
+            if predicate(key, record)
+        }
+
+    # Запросы
+
+    def evaluate(self, query: dict, path: str | None) -> Dict[Key, float]:
+        (name, params), = query.items()
+        handler = getattr(self, f"query_{name}", None)
+        if handler is None:
+            raise ValueError(f"Unsupported query: {name}")
+        return handler(params, path)
+
+    def query_match_all(self, params: dict, path: str | None) -> Dict[Key, float]:
+        return {key: 1.0 for key, _ in self.records(path)}
+
+    def query_match_none(self, params: dict, path: str | None) -> Dict[Key, float]:
+        return {}
+
+    def query_ids(self, params: dict, path: str | None) -> Dict[Key, float]:
+        return {doc_id: 1.0 for doc_id in params["values"] if doc_id in self.store.sources}
+
+    def query_term(self, params: dict, path: str | None) -> Dict[Key, float]:
+        (field, value), = params.items()
+        if isinstance(value, dict):
+            value = value["value"]
+        return self.matching(path, lambda key, record: value in self.values(key, record, field, path))
+
+    def query_terms(self, params: dict, path: str | None) -> Dict[Key, float]:
+        (field, values), = ((k, v) for k, v in params.items() if k != "boost")
+        expected = set(values)
+        return self.matching(
+            path,
+            lambda key, record: any(
+                not isinstance(value, np.ndarray) and value in expected
+                for value in self.values(key, record, field, path)
+            ),
+        )
+
+    def query_exists(self, params: dict, path: str | None) -> Dict[Key, float]:
+        field = params["field"]
+        return self.matching(path, lambda key, record: bool(self.values(key, record, field, path)))
+
+    def query_range(self, params: dict, path: str | None) -> Dict[Key, float]:
+        (field, bounds), = params.items()
+        checks = {
+            "gt": lambda a, b: a > b,
+            "gte": lambda a, b: a >= b,
+            "lt": lambda a, b: a < b,
+            "lte": lambda a, b: a <= b,
+        }
+
+        def in_range(key, record):
+            for value in self.values(key, record, field, path):
+                value = comparable(value)
+                try:
+                    if all(
+                        check(value, comparable(bounds[op]))
+                        for op, check in checks.items() if op in bounds
+                    ):
+                        return True
+                except TypeError:
+                    continue
+            return False
+
+        return self.matching(path, in_range)
+
+    def query_match(self, params: dict, path: str | None) -> Dict[Key, float]:
+        (field, query), = params.items()
+        if isinstance(query, dict):
+            query = query["query"]
+        return self.query_multi_match({"query": query, "fields": [field]}, path)
+
+    def query_multi_match(self, params: dict, path: str | None) -> Dict[Key, float]:
+        terms = tokenize(str(params["query"]))
+        scores: Dict[Key, float] = {}
+
+        for field in params.get("fields") or list(TEXT_FIELDS):
+            field, _, boost = field.partition("^")
+            boost = float(boost or 1.0)
+            base = field.split(".")[0] if field.split(".")[-1] in ("ru", "en") else field
+
+            if path is None and base in TEXT_FIELDS:
+                field_scores = self.store.text_index[base].scores(terms)
+            else:
+                # Поля без инвертированного индекса: совпадение хотя бы одного токена
+                query_terms = set(terms)
+                field_scores = self.matching(
+                    path,
+                    lambda key, record: any(
+                        query_terms & set(tokenize(str(value)))
+                        for value in self.values(key, record, field, path)
+                    ),
+                )
+
+            # best_fields: оценка документа - лучшая оценка среди полей
+            for key, score in field_scores.items():
+                scores[key] = max(scores.get(key, 0.0), score * boost)
+
+        return scores
+
+    def query_bool(self, params: dict, path: str | None) -> Dict[Key, float]:
+        def clauses(name):
+            value = params.get(name) or []
+            return [self.evaluate(query, path) for query in (value if isinstance(value, list) else [value])]
+
+        must, filters, should, must_not = clauses("must"), clauses("filter"), clauses("should"), clauses("must_not")
+        minimum_should_match = int(str(params.get("minimum_should_match", 0 if must or filters else 1)).rstrip("%"))
+        if not should:
+            minimum_should_match = 0
+
+        if must or filters:
+            required = must + filters
+            keys = set(required[0]).intersection(*required[1:])
+        elif minimum_should_match:
+            keys = set().union(*should)
+        else:
+            keys = {key for key, _ in self.records(path)}
+
+        excluded = set().union(*must_not) if must_not else set()
+        scores = {}
+        for key in keys:
+            if key in excluded:
+                continue
+            matched = [clause[key] for clause in should if key in clause]
+            if len(matched) < minimum_should_match:
+                continue
+            scores[key] = sum(clause[key] for clause in must) + sum(matched)
+        return scores
+
+    def query_nested(self, params: dict, path: str | None) -> Dict[Key, float]:
+        if path is not None:
+            raise ValueError("Nested queries inside nested queries are not supported")
+
+        nested_path = params["path"]
+        nested_scores = self.evaluate(params["query"], nested_path)
+        score_mode = params.get("score_mode", "avg")
+
+        grouped: Dict[str, List[Tuple[int, float]]] = defaultdict(list)
+        for (doc_id, offset), score in nested_scores.items():
+            grouped[doc_id].append((offset, score))
+
+        if "inner_hits" in params:
+            spec = params["inner_hits"]
+            name = spec.get("name", nested_path)
+            self.inner_hits_specs[name] = (nested_path, spec)
+            self.inner_hits[name] = grouped
+
+        aggregate = {
+            "avg": lambda scores: sum(scores) / len(scores),
+            "max": max,
+            "min": min,
+            "sum": sum,
+            "none": lambda scores: 0.0,
+        }[score_mode]
+        return {
+            doc_id: aggregate([score for _, score in matches])
+            for doc_id, matches in grouped.items()
+        }
+
+    def query_script_score(self, params: dict, path: str | None) -> Dict[Key, float]:
+        candidates = self.evaluate(params["query"], path)
+        script = params["script"]
+        match = COSINE_SCRIPT_PATTERN.match(script["source"])
+        if match is None:
+            raise ValueError(f"Unsupported script: {script['source']}")
+
+        param, field, offset = match.groups()
+        matrix = self.vector_matrix(field, path)
+        similarities = matrix.cosine(script.get("params", {})[param])
+        offset = float(offset or 0.0)
+
+        return {
+            key: float(similarities[matrix.rows[key]]) + offset
+            for key in candidates if key in matrix.rows
+        }
+
+    def vector_matrix(self, field: str, path: str | None) -> VectorMatrix:
+        if field == TEXT_VECTOR_FIELD and path is None:
+            return self.store.text_vectors
+        if field == f"images.{IMAGE_VECTOR_FIELD}" and path == "images":
+            return self.store.image_vectors
+        raise ValueError(f"Field {field} is not a vector field in this context")
+
+    def knn(self, clause: dict) -> Dict[str, float]:
+        field = clause["field"]
+        filters = clause.get("filter") or []
+        allowed = self.evaluate({"bool": {"filter": filters if isinstance(filters, list) else [filters]}}, None)
+
+        nested = field == f"images.{IMAGE_VECTOR_FIELD}"
+        matrix = self.store.image_vectors if nested else self.vector_matrix(field, None)
+        similarities = matrix.cosine(clause["query_vector"])
+        boost = clause.get("boost", 1.0)
+
+        # Оценка Elasticsearch для cosine: (1 + cos) / 2; для вложенных векторов - лучший вектор документа
+        scores: Dict[str, float] = {}
+        for key, similarity in zip(matrix.keys, similarities):
+            doc_id = key[0] if nested else key
+            if doc_id not in allowed:
+                continue
+            score = (1.0 + float(similarity)) / 2 * boost
+            if score > scores.get(doc_id, -1.0):
+                scores[doc_id] = score
+
+        return dict(heapq.nlargest(clause.get("k", 10), scores.items(), key=lambda item: item[1]))
+
+
+def comparable(value: Any) -> Any:
+    """Значение для сравнения в range: число, дата или строка."""
+    if isinstance(value, (int, float)):
+        return value
+    value = str(value)
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        return date.fromisoformat(value[:10])
+    except ValueError:
+        return value
+
+
+def filter_source(source: dict, includes: List[str] | None, excludes: List[str] | None) -> dict:
+    """Оставляет в _source поля includes (с вложенными путями) и убирает excludes."""
+    def select(value: Any, paths: List[List[str]]) -> Any:
+        if any(not path for path in paths):
+            return value
+        if isinstance(value, list):
+            return [select(item, paths) for item in value]
+        if not isinstance(value, dict):
+            return value
+        selected = {}
+        for key, item in value.items():
+            nested = [path[1:] for path in paths if path[0] == key]
+            if nested:
+                selected[key] = select(item, nested)
+        return selected
+
+    def drop(value: Any, path: List[str]) -> Any:
+        if isinstance(value, list):
+            return [drop(item, path) for item in value]
+        if not isinstance(value, dict) or path[0] not in value:
+            return value
+        if len(path) == 1:
+            return {key: item for key, item in value.items() if key != path[0]}
+        return {**value, path[0]: drop(value[path[0]], path[1:])}
+
+    if includes:
+        source = select(source, [path.split(".") for path in includes])
+    for path in excludes or []:
+        source = drop(source, path.split("."))
+    return source
@@ -0,0 +1,169 @@
+import os
+import sqlite3
+import hashlib
+import threading
+from collections import defaultdict
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from utils.minhash import MinHasher
+
+
+class NearDuplicateIndex:
+    """
+    LSH-индекс MinHash-сигнатур документов для поиска почти-дубликатов.
+
+    Сигнатура делится на num_bands полос; документы, совпавшие хотя бы
+    в одной полосе, становятся кандидатами и проверяются по оценке
+    коэффициента Жаккара. Поиск затрагивает только корзины полос документа,
+    а не весь корпус. Индекс хранится в локальном SQLite-файле.
+
+    Поиск (find) и регистрация (add) разделены: документ регистрируется
+    только после успешной индексации, чтобы дубликаты не ссылались на
+    документ, которого нет в индексе.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        hasher: MinHasher,
+        num_bands: int = 16,
+        threshold: float = 0.85,
+    ) -> None:
+        if hasher.num_perm % num_bands:
+            raise ValueError("num_perm must be divisible by num_bands")
+
+        self.path = path
+        self.hasher = hasher
+        self.num_bands = num_bands
+        self.threshold = threshold
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS signatures ("
+            "document_id TEXT PRIMARY KEY, canonical_id TEXT NOT NULL, signature BLOB NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS lsh_buckets ("
+            "band INTEGER NOT NULL, bucket INTEGER NOT NULL, document_id TEXT NOT NULL)"
+        )
+        # Повторы, записанные до появления ограничения уникальности
+        self._conn.execute(
+            "DELETE FROM lsh_buckets WHERE rowid NOT IN "
+            "(SELECT MIN(rowid) FROM lsh_buckets GROUP BY band, bucket, document_id)"
+        )
+        self._conn.execute(
+            "CREATE UNIQUE INDEX IF NOT EXISTS lsh_buckets_unique ON lsh_buckets (band, bucket, document_id)"
+        )
+        # Поиск по (band, bucket) использует префикс уникального индекса
+        self._conn.execute("DROP INDEX IF EXISTS lsh_buckets_band_bucket")
+        self._conn.commit()
+
+    @staticmethod
+    def _bucket(band: bytes) -> int:
+        return int.from_bytes(hashlib.blake2b(band, digest_size=8).digest(), "big", signed=True)
+
+    def _find(self, buckets: list, signature: np.ndarray) -> Tuple[str | None, float]:
+        candidates = set()
+        for band, bucket in enumerate(buckets):
+            candidates.update(
+                row[0] for row in self._conn.execute(
+                    "SELECT document_id FROM lsh_buckets WHERE band = ? AND bucket = ?",
+                    (band, bucket),
+                )
+            )
+
+        best_id, best_similarity = None, 0.0
+        for document_id in candidates:
+            row = self._conn.execute(
+                "SELECT canonical_id, signature FROM signatures WHERE document_id = ?",
+                (document_id,),
+            ).fetchone()
+            if row is None:
+                continue
+            similarity = self.hasher.similarity(signature, np.frombuffer(row[1], dtype=np.uint64))
+            if similarity > best_similarity:
+                best_id, best_similarity = row[0], similarity
+
+        if best_similarity >= self.threshold:
+            return best_id, best_similarity
+        return None, best_similarity
+
+    def _buckets(self, signature: np.ndarray) -> list:
+        return [self._bucket(band) for band in self.hasher.bands(signature, self.num_bands)]
+
+    def find(self, signature: np.ndarray) -> Tuple[str | None, float]:
+        """
+        Ищет почти-дубликат документа с сигнатурой signature.
+
+        Returns:
+            Tuple[str | None, float]: ID исходного (канонического) документа,
+            если найден дубликат, и оценка сходства с ближайшим кандидатом.
+        """
+        buckets = self._buckets(signature)
+        with self._lock:
+            return self._find(buckets, signature)
+
+    def add(self, document_id: str, signature: np.ndarray, canonical_id: str) -> None:
+        """Регистрирует проиндексированный документ как копию canonical_id (или исходный, если это он сам)."""
+        buckets = self._buckets(signature)
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO signatures (document_id, canonical_id, signature) VALUES (?, ?, ?)",
+                (document_id, canonical_id, signature.tobytes()),
+            )
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO lsh_buckets (band, bucket, document_id) VALUES (?, ?, ?)",
+                ((band, bucket, document_id) for band, bucket in enumerate(buckets)),
+            )
+
+    def batch(self) -> "BatchSignatures":
+        """Индекс документов одной загрузки с теми же параметрами LSH."""
+        return BatchSignatures(self)
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+class BatchSignatures:
+    """
+    Сигнатуры документов текущей пакетной загрузки в памяти.
+
+    Документы регистрируются в NearDuplicateIndex только после индексации
+    своей пачки, поэтому почти-дубликат из того же архива (например,
+    следующая редакция документа) не нашелся бы в нем. Пакетная загрузка
+    ищет дубликаты и здесь, среди уже векторизованных документов загрузки.
+    """
+
+    def __init__(self, index: NearDuplicateIndex) -> None:
+        self.index = index
+        self._documents: Dict[str, Tuple[str, np.ndarray]] = {}
+        self._buckets: Dict[Tuple[int, int], List[str]] = defaultdict(list)
+
+    def find(self, signature: np.ndarray) -> Tuple[str | None, float]:
+        """Ищет почти-дубликат среди документов загрузки; результат как у NearDuplicateIndex.find."""
+        candidates = set()
+        for band, bucket in enumerate(self.index._buckets(signature)):
+            candidates.update(self._buckets.get((band, bucket), ()))
+
+        best_id, best_similarity = None, 0.0
+        for document_id in candidates:
+            canonical_id, candidate = self._documents[document_id]
+            similarity = self.index.hasher.similarity(signature, candidate)
+            if similarity > best_similarity:
+                best_id, best_similarity = canonical_id, similarity
+
+        if best_similarity >= self.index.threshold:
+            return best_id, best_similarity
+        return None, best_similarity
+
+    def add(self, document_id: str, signature: np.ndarray, canonical_id: str) -> None:
+        self._documents[document_id] = (canonical_id, signature)
+        for band, bucket in enumerate(self.index._buckets(signature)):
+            self._buckets[(band, bucket)].append(document_id)
@@ -0,0 +1,151 @@
+import os
+import math
+import heapq
+import sqlite3
+import threading
+from typing import Dict, Iterable, List, Mapping
+
+from utils.logger import logger
+
+
+class TermStatsStore:
+    """
+    Корпусная статистика документной частоты терминов (term -> df).
+
+    Хранится в SQLite-файле и обновляется инкрементально при каждой
+    проиндексированной загрузке документа, поэтому для расчета IDF не нужно
+    пересчитывать весь корпус. Раз в compaction_interval документов фоновый
+    поток удаляет из хранилища термины, встретившиеся лишь в одном документе,
+    если их больше max_terms, и сжимает файл; загрузка документов сжатия не ждет.
+    """
+
+    SQLITE_MAX_VARIABLES = 900
+
+    def __init__(
+        self,
+        path: str,
+        compaction_interval: int = 1000,
+        max_terms: int = 500_000,
+    ) -> None:
+        self.path = path
+        self.compaction_interval = compaction_interval
+        self.max_terms = max_terms
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS term_df (term TEXT PRIMARY KEY, df INTEGER NOT NULL) WITHOUT ROWID"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS corpus_meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL)"
+        )
+        self._conn.execute(
+            "INSERT OR IGNORE INTO corpus_meta (key, value) VALUES ('doc_count', 0), ('since_compaction', 0)"
+        )
+        self._conn.commit()
+
+        self._compaction_requested = threading.Event()
+        self._closing = False
+        self._compactor = threading.Thread(target=self._compaction_loop, name="term-stats-compaction", daemon=True)
+        self._compactor.start()
+
+    def _get_meta(self, key: str) -> int:
+        row = self._conn.execute("SELECT value FROM corpus_meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else 0
+
+    @property
+    def doc_count(self) -> int:
+        with self._lock:
+            return self._get_meta("doc_count")
+
+    def get_df(self, terms: Iterable[str]) -> Dict[str, int]:
+        """Возвращает документную частоту для переданных терминов."""
+        terms = list(terms)
+        result = {}
+        with self._lock:
+            for start in range(0, len(terms), self.SQLITE_MAX_VARIABLES):
+                chunk = terms[start:start + self.SQLITE_MAX_VARIABLES]
+                placeholders = ",".join("?" * len(chunk))
+                result.update(self._conn.execute(
+                    f"SELECT term, df FROM term_df WHERE term IN ({placeholders})", chunk
+                ))
+        return result
+
+    def add_document(self, terms: Iterable[str]) -> None:
+        """Учитывает в статистике один документ с указанным набором терминов."""
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT INTO term_df (term, df) VALUES (?, 1) "
+                "ON CONFLICT(term) DO UPDATE SET df = df + 1",
+                ((term,) for term in set(terms)),
+            )
+            self._conn.execute(
+                "UPDATE corpus_meta SET value = value + 1 WHERE key IN ('doc_count', 'since_compaction')"
+            )
+            due = self._get_meta("since_compaction") >= self.compaction_interval
+
+        if due:
+            self._compaction_requested.set()
+
+    def _compaction_loop(self) -> None:
+        while True:
+            self._compaction_requested.wait()
+            self._compaction_requested.clear()
+            if self._closing:
+                return
+            try:
+                self.compact()
+            except Exception as e:
+                logger.error(f"Ошибка сжатия статистики терминов: {e}")
+
+    def compact(self) -> None:
+        """Удаляет единичные термины сверх max_terms и сжимает файл."""
+        with self._lock, self._conn:
+            (term_count,) = self._conn.execute("SELECT COUNT(*) FROM term_df").fetchone()
+            excess = term_count - self.max_terms
+            if excess > 0:
+                self._conn.execute(
+                    "DELETE FROM term_df WHERE term IN "
+                    "(SELECT term FROM term_df WHERE df = 1 LIMIT ?)",
+                    (excess,),
+                )
+            self._conn.execute("UPDATE corpus_meta SET value = 0 WHERE key = 'since_compaction'")
+
+        # VACUUM переписывает весь файл, поэтому выполняется отдельным соединением
+        # без блокировки хранилища: чтение продолжается, запись ждет освобождения базы
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            conn.execute("VACUUM")
+        finally:
+            conn.close()
+
+    def top_tfidf_terms(self, term_counts: Mapping[str, int], num_terms: int) -> List[str]:
+        """
+        Возвращает num_terms терминов документа с наибольшим TF-IDF.
+
+        Работает за O(число терминов документа): частоты берутся из уже
+        посчитанного term_counts, IDF - из хранилища. Для пустого корпуса
+        IDF одинаков у всех терминов и результат совпадает с частотным.
+        """
+        if not term_counts:
+            return []
+
+        total = sum(term_counts.values())
+        doc_count = self.doc_count
+        df = self.get_df(term_counts.keys())
+
+        scores = {
+            term: (count / total) * (math.log((doc_count + 1) / (df.get(term, 0) + 1)) + 1)
+            for term, count in term_counts.items()
+        }
+        return heapq.nlargest(num_terms, scores, key=scores.__getitem__)
+
+    def close(self) -> None:
+        self._closing = True
+        self._compaction_requested.set()
+        self._compactor.join()
+        with self._lock:
+            self._conn.close()
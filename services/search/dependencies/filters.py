@@ -0,0 +1,25 @@
+from datetime import date
+from typing import List, Union
+
+from fastapi import Query
+
+import core.config as config
+from models.search import DocumentFilters
+
+
+async def get_document_filters(
+    language: Union[str, None] = Query(default=None, description=config.LANGUAGE_DESC),
+    tags: Union[List[str], None] = Query(default=None, description=config.TAGS_DESC),
+    author: Union[str, None] = Query(default=None, description=config.AUTHOR_DESC),
+    created_from: Union[date, None] = Query(default=None, description=config.CREATED_FROM_DESC),
+    created_to: Union[date, None] = Query(default=None, description=config.CREATED_TO_DESC),
+) -> DocumentFilters:
+    # Списочный параметр в модели, переданной в Depends(), FastAPI читает из тела запроса,
+    # поэтому фильтры объявляются параметрами запроса явно
+    return DocumentFilters(
+        language=language,
+        tags=tags,
+        author=author,
+        created_from=created_from,
+        created_to=created_to,
+    )
@@ -2,10 +2,14 @@ from elasticsearch import AsyncElasticsearch
 from fastapi import Depends
 
 from utils.abstract import AsyncSearchService
+from core.config import es_settings
+from db import elastic as elastic_db, embedded
 from db.elastic import get_elastic, ElasticsearchAdapter
 
 
 async def get_search_service(
     elastic: AsyncElasticsearch = Depends(get_elastic)
 ) -> AsyncSearchService:
-    return ElasticsearchAdapter(elastic)
+    if embedded.engine is not None:
+        return embedded.engine
+    return ElasticsearchAdapter(elastic, breaker=elastic_db.breaker, settings=es_settings)
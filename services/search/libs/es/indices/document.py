@@ -1,100 +1,18 @@
-index_name = "documents"
+import os
+import json
 
-index_json = {
-  "settings": {
-    "refresh_interval": "1s",
-    "analysis": {
-      "filter": {
-        "english_stop": {
-          "type": "stop",
-          "stopwords": "_english_"
-        },
-        "english_stemmer": {
-          "type": "stemmer",
-          "language": "english"
-        },
-        "english_possessive_stemmer": {
-          "type": "stemmer",
-          "language": "possessive_english"
-        },
-        "russian_stop": {
-          "type": "stop",
-          "stopwords": "_russian_"
-        },
-        "russian_stemmer": {
-          "type": "stemmer",
-          "language": "russian"
-        }
-      },
-      "analyzer": {
-        "ru_en": {
-          "tokenizer": "standard",
-          "filter": [
-            "lowercase",
-            "english_stop",
-            "english_stemmer",
-            "english_possessive_stemmer",
-            "russian_stop",
-            "russian_stemmer"
-          ]
-        }
-      }
-    }
-  },
-  "mappings": {
-    "dynamic": "strict",
-    "properties": {
-      "document_id": {
-        "type": "keyword"
-      },
-      "title": {
-        "type": "text",
-        "analyzer": "standard"
-      },
-      "text_content": {
-        "type": "text",
-        "analyzer": "standard"
-      },
-      "text_content_embedding": {
-        "type": "dense_vector",
-        "dims": 384
-      },
-      "metadata": {
-        "type": "nested",
-        "properties": {
-          "author": {
-            "type": "text",
-            "analyzer": "standard"
-          },
-          "created_date": {
-            "type": "date"
-          },
-          "tags": {
-            "type": "keyword"
-          },
-          "file_type": {
-            "type": "keyword"
-          }
-        }
-      },
-      "images": {
-        "type": "nested",
-        "properties": {
-          "image_id": {
-            "type": "keyword"
-          },
-          "image_embedding": {
-            "type": "dense_vector",
-            "dims": 768
-          },
-          "position": {
-            "type": "keyword"
-          },
-          "image_path": {
-            "type": "keyword"
-          }
-        }
-      }
-    }
-  }
-}
+# Маппинг индекса общий для сервисов search и etl и хранится в services/es/indices.
+# В контейнерах каталог монтируется в /es/indices (см. docker-compose.yaml).
+INDICES_DIR = os.getenv(
+    'ES_INDICES_DIR',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', '..', '..', 'es', 'indices'),
+)
+
+with open(os.path.join(INDICES_DIR, 'document.json'), encoding='utf-8') as f:
+    _definition = json.load(f)
+
+# index_name - алиас для чтения и записи, за которым стоит физический индекс версии маппинга
+index_name = _definition["index_name"]
+index_version = _definition["version"]
+index_json = _definition["body"]
+versioned_index_name = f"{index_name}_v{index_version}"
@@ -1,4 +1,7 @@
 import os
+import math
+import uuid
+import random
 import uvicorn
 import logging
 
@@ -6,27 +9,118 @@ from datetime import datetime
 from contextlib import asynccontextmanager
 
 from fastapi import FastAPI, Request
-from fastapi.responses import ORJSONResponse
-from elasticsearch import AsyncElasticsearch
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import ORJSONResponse, PlainTextResponse
+from db import elastic, embedded
+from services import preprocessing
 
-from db import elastic
-
-from core.config import settings, es_settings
+from core.config import (
+    settings,
+    admission_settings,
+    deadline_settings,
+    es_settings,
+    logging_settings,
+    loop_monitor_settings,
+    profiling_settings,
+    search_backend_settings,
+)
 from core.logger import LOGGING
-from utils.logger import logger
+from utils.logger import REQUEST_ID, enqueue_handlers, logger
+from utils import admission, deadline, loop_monitor
+from utils.abstract import SearchNotFoundError, SearchRequestError, SearchServiceError, SearchUnavailableError
+from utils.file import FileTooLargeError, UnsupportedFileTypeError
+from utils.metrics import HTTP_REQUEST_SECONDS, REGISTRY
+from utils.profiling import CURRENT_PROFILE, RequestProfile, requested_profile_mode
 from managers.lifespan import LifespanManager
 
 from api.v1 import documents
 
 
+API_PREFIX = '/search/api/v1/documents'
+
+# Дорогие эндпоинты и их классы контроля допуска
+ADMISSION_ROUTES = {
+    f'{API_PREFIX}/process/': 'ingestion',
+    f'{API_PREFIX}/process/batch/': 'ingestion',
+    f'{API_PREFIX}/multimodal_search': 'multimodal_search',
+    f'{API_PREFIX}/batch_search/': 'batch_search',
+}
+
+
 @asynccontextmanager
 async def lifespan(_: FastAPI):
-    elastic.es = AsyncElasticsearch(hosts=[es_settings.elastic_url])
-    lifespan_manager = LifespanManager(elastic.es)
-    await lifespan_manager.init_es(indicies=es_settings.indicies)
+    # Логгеры uvicorn и корневой логгер к этому моменту настроены: их вывод тоже уходит в фоновый поток
+    enqueue_handlers(logging.getLogger(), logging.getLogger("uvicorn"), logging.getLogger("uvicorn.access"))
+    if search_backend_settings.backend == "embedded":
+        lifespan_manager = LifespanManager(None)
+        await lifespan_manager.load_projections()
+        await lifespan_manager.init_embedded(indicies=es_settings.indicies)
+    else:
+        elastic.es = elastic.create_client(es_settings)
+        elastic.breaker = elastic.CircuitBreaker(
+            es_settings.circuit_failure_threshold,
+            es_settings.circuit_reset_timeout,
+        )
+        lifespan_manager = LifespanManager(elastic.es)
+        await lifespan_manager.load_projections()
+        await lifespan_manager.init_es(indicies=es_settings.indicies)
     await lifespan_manager.upload_preprocessing_models()
+    if admission_settings.enabled:
+        ingestion_limit = min(
+            admission_settings.ingestion_limit,
+            admission_settings.capacity - admission_settings.search_reserved,
+        )
+        if ingestion_limit < 1:
+            raise RuntimeError(
+                f"ADMISSION_CAPACITY ({admission_settings.capacity}) must exceed "
+                f"ADMISSION_SEARCH_RESERVED ({admission_settings.search_reserved}) "
+                f"to leave room for document uploads"
+            )
+        admission.controller = admission.AdmissionController(
+            [
+                admission.AdmissionClass(
+                    'multimodal_search',
+                    admission_settings.multimodal_limit,
+                    admission_settings.multimodal_queue,
+                    priority=0,
+                ),
+                admission.AdmissionClass(
+                    'batch_search',
+                    admission_settings.batch_search_limit,
+                    admission_settings.batch_search_queue,
+                    priority=0,
+                ),
+                admission.AdmissionClass(
+                    'ingestion',
+                    ingestion_limit,
+                    admission_settings.ingestion_queue,
+                    priority=1,
+                ),
+            ],
+            capacity=admission_settings.capacity,
+            queue_timeout=admission_settings.queue_timeout,
+            retry_after=admission_settings.retry_after,
+        )
+    # Запускается после загрузки моделей: загрузка блокирует цикл событий намеренно
+    if loop_monitor_settings.enabled:
+        loop_monitor.monitor = loop_monitor.LoopMonitor(
+            interval=loop_monitor_settings.interval,
+            threshold=loop_monitor_settings.threshold,
+            capture_stacks=loop_monitor_settings.debug,
+        )
+        loop_monitor.monitor.start()
     yield
-    await elastic.es.close()
+    if loop_monitor.monitor is not None:
+        await loop_monitor.monitor.stop()
+    preprocessing.shutdown_page_pool()
+    if preprocessing.TERM_STATS is not None:
+        preprocessing.TERM_STATS.close()
+    if preprocessing.NEAR_DUPLICATES is not None:
+        preprocessing.NEAR_DUPLICATES.close()
+    if embedded.engine is not None:
+        embedded.engine.close()
+    if elastic.es is not None:
+        await elastic.es.close()
 
 app = FastAPI(
     title=settings.project_name,
@@ -37,27 +131,152 @@ app = FastAPI(
 )
 
 
+# Объявлен раньше before_request, поэтому выполняется внутри него: отказы попадают в логи и метрики
+@app.middleware('http')
+async def admission_control(request: Request, call_next):
+    # Проверка выполняется до чтения тела запроса: отказ не ждет загрузки файла
+    name = ADMISSION_ROUTES.get(request.url.path) if request.method == 'POST' else None
+    if admission.controller is None or name is None:
+        return await call_next(request)
+
+    try:
+        async with admission.controller.slot(name):
+            return await call_next(request)
+    except admission.AdmissionRejected as e:
+        return ORJSONResponse(
+            status_code=429,
+            content={"detail": str(e)},
+            headers={"Retry-After": str(math.ceil(e.retry_after))},
+        )
+    except deadline.DeadlineExceeded as e:
+        return await deadline_exceeded_handler(request, e)
+
+
 @app.middleware('http')
 async def before_request(request: Request, call_next):
+    request_id = request.headers.get("X-Request-ID") or uuid.uuid4().hex
+    request_id_token = REQUEST_ID.set(request_id)
+
+    # Срок запроса: загрузка документов по умолчанию без срока
+    timeout = deadline.requested_timeout(
+        request.headers,
+        default=(
+            deadline_settings.ingestion_timeout
+            if ADMISSION_ROUTES.get(request.url.path) == 'ingestion'
+            else deadline_settings.timeout
+        ),
+        maximum=deadline_settings.max_timeout,
+    )
+    request_deadline = deadline.Deadline(timeout) if timeout is not None else None
+    deadline_token = deadline.CURRENT_DEADLINE.set(request_deadline)
+
+    # Профилирование по токену или выборочное (только служебные эндпоинты не профилируются)
+    profile_mode = requested_profile_mode(request.headers, request.query_params, profiling_settings.token)
+    sampled = (
+        profile_mode is None
+        and request.url.path not in ("/health", "/metrics")
+        and random.random() < profiling_settings.sample_rate
+    )
+    profile = None
+    if profile_mode or sampled:
+        profile = RequestProfile(request_id, profile_mode or "sampling", profiling_settings.interval)
+        profile_token = CURRENT_PROFILE.set(profile)
+        profile.start()
+
     start_time = datetime.now()
-    response = await call_next(request)
+    try:
+        response = await call_next(request)
+    finally:
+        if profile is not None:
+            profile_elapsed = profile.stop()
+            CURRENT_PROFILE.reset(profile_token)
+        REQUEST_ID.reset(request_id_token)
+        deadline.CURRENT_DEADLINE.reset(deadline_token)
     end_time = datetime.now()
+    elapsed_time = (end_time - start_time).total_seconds()
+    response.headers["X-Request-ID"] = request_id
+    if request_deadline is not None and request_deadline.degraded:
+        response.headers["X-Degraded"] = ",".join(request_deadline.degraded)
+
+    # Выборочные профили сохраняются только для медленных запросов
+    if profile is not None and (profile_mode or profile_elapsed >= profiling_settings.slow_threshold):
+        profile_path = await run_in_threadpool(profile.save, profiling_settings.path, profile_elapsed)
+        if profile_path is not None:
+            response.headers["X-Profile"] = os.path.basename(profile_path)
+            logger.info(
+                f"Saved {profile.mode} profile of request {request_id} to {profile_path}",
+                extra={"request_id": request_id},
+            )
+
+    # Шаблон пути, а не сам путь: id документов не должны порождать новые ряды метрик
+    route = request.scope.get("route")
+    HTTP_REQUEST_SECONDS.observe(
+        elapsed_time,
+        method=request.method,
+        route=route.path if route is not None else "unmatched",
+        status=response.status_code,
+    )
+
+    # Журнал доступа выборочный; ошибки и медленные запросы пишутся всегда
+    if (
+        response.status_code < 400
+        and elapsed_time < logging_settings.access_slow_threshold
+        and random.random() >= logging_settings.access_sample_rate
+    ):
+        return response
 
     logger.info(
         "middleware",
         extra={
-            "request_id": None,
+            "request_id": request_id,
             "host": settings.service_host,
             "method": request.method,
+            "path": request.url.path,
             "query_params": str(request.query_params),
             "status_code": response.status_code,
-            "elapsed_time": (end_time - start_time).total_seconds(),
+            "elapsed_time": elapsed_time,
         }
     )
 
     return response
 
 
+@app.exception_handler(FileTooLargeError)
+async def file_too_large_handler(_: Request, exc: FileTooLargeError):
+    return ORJSONResponse(status_code=413, content={"detail": str(exc)})
+
+
+@app.exception_handler(UnsupportedFileTypeError)
+async def unsupported_file_type_handler(_: Request, exc: UnsupportedFileTypeError):
+    return ORJSONResponse(status_code=415, content={"detail": str(exc)})
+
+
+@app.exception_handler(SearchNotFoundError)
+async def search_not_found_handler(_: Request, exc: SearchNotFoundError):
+    return ORJSONResponse(status_code=404, content={"detail": str(exc)})
+
+
+@app.exception_handler(SearchRequestError)
+async def search_request_handler(_: Request, exc: SearchRequestError):
+    return ORJSONResponse(status_code=400, content={"detail": str(exc)})
+
+
+@app.exception_handler(SearchUnavailableError)
+async def search_unavailable_handler(_: Request, exc: SearchUnavailableError):
+    headers = {"Retry-After": str(math.ceil(exc.retry_after))} if exc.retry_after is not None else None
+    return ORJSONResponse(status_code=503, content={"detail": str(exc)}, headers=headers)
+
+
+@app.exception_handler(SearchServiceError)
+async def search_service_handler(_: Request, exc: SearchServiceError):
+    return ORJSONResponse(status_code=502, content={"detail": str(exc)})
+
+
+@app.exception_handler(deadline.DeadlineExceeded)
+async def deadline_exceeded_handler(_: Request, exc: deadline.DeadlineExceeded):
+    return ORJSONResponse(status_code=504, content={"detail": str(exc)})
+
+
 @app.get("/health")
 async def health_check():
     return {
@@ -65,7 +284,12 @@ async def health_check():
         "timestamp": datetime.now().isoformat(),
     }
 
-app.include_router(documents.router, prefix='/search/api/v1/documents', tags=['documents'])
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Метрики процесса в текстовом формате Prometheus."""
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+app.include_router(documents.router, prefix=API_PREFIX, tags=['documents'])
 
 if __name__ == '__main__':
     uvicorn.run(
@@ -1,19 +1,64 @@
 import nltk
 
-from elasticsearch import AsyncElasticsearch
+from elasticsearch import AsyncElasticsearch, BadRequestError
 from nltk.corpus import stopwords
 from sentence_transformers import SentenceTransformer, models
 from transformers import ViTModel, ViTImageProcessor
 
 
+from core import config
+from db import embedded
+from db.term_stats import TermStatsStore
+from db.near_duplicates import NearDuplicateIndex
+from utils.minhash import MinHasher
+from utils.projection import apply_projection_dims, check_projection_dims, get_vector_dims, load_projection
+from utils.stub_models import HashTextEncoder, StubImageModel, StubImageProcessor
 from utils.logger import logger
 from services import preprocessing
 
 
+# Версии маппинга, которые только добавляют поля к предыдущей версии:
+# индекс поднимается до них на месте, без перестроения
+ADDITIVE_VERSIONS = {3}
+
+
+def get_missing_fields(current: dict, target: dict) -> dict:
+    """
+    Поля маппинга target, которых нет в current, в формате properties для put_mapping.
+
+    Поля объектов и вложенных документов (properties) сравниваются
+    рекурсивно. Изменения существующих полей (тип, параметры векторов,
+    подполя с анализаторами) на месте не применяются и требуют перестроения.
+    """
+    missing = {}
+    for name, field in target.items():
+        if name not in current:
+            missing[name] = field
+        elif "properties" in field and "properties" in current[name]:
+            fields = get_missing_fields(current[name]["properties"], field["properties"])
+            if fields:
+                missing[name] = {**field, "properties": fields}
+    return missing
+
+
 class LifespanManager:
-    def __init__(self, es_conn: AsyncElasticsearch):
+    def __init__(self, es_conn: AsyncElasticsearch | None):
         self.es = es_conn
 
+    async def init_embedded(self, indicies: list[str]):
+        """Открывает встроенный поисковый индекс вместо Elasticsearch."""
+        logger.info(f"Opening embedded search index in '{config.search_backend_settings.embedded_path}'...")
+        embedded.engine = embedded.EmbeddedSearchService(config.search_backend_settings.embedded_path)
+        for index in indicies:
+            embedded.engine.create_index(index["name"])
+            check_projection_dims(
+                index["name"],
+                embedded.engine.vector_dims(index["name"]),
+                preprocessing.TEXT_PROJECTION,
+                preprocessing.IMAGE_PROJECTION,
+                hint="Rebuild the embedded index or disable the projection.",
+            )
+
     async def init_es(
         self,
         indicies: list[str]
@@ -29,44 +74,173 @@ class LifespanManager:
         async def ensure_index_exists(
             name: str,
             body: dict,
+            version: int | None = None,
             self=self,
         ):
+            """
+            name - алиас, через который сервис читает и пишет документы.
+            Если его нет, создается физический индекс {name}_v{version}
+            с этим алиасом.
+            """
             try:
-                exists = await self.es.indices.exists(index=name)
-                if not exists:
-                    await self.es.indices.create(
-                        index=name, body=body
+                if await self.es.indices.exists_alias(name=name):
+                    logger.info(f"Alias '{name}' already exists.")
+                    await check_mapping_version(name=name, body=body, version=version)
+                elif await self.es.indices.exists(index=name):
+                    logger.warning(
+                        f"Index '{name}' is a concrete index, not an alias. "
+                        f"Run 'python -m managers.reindex' to migrate it to a versioned index."
                     )
-                    logger.info(f"Index '{name}' created successfully.")
+                    await check_mapping_version(name=name, body=body, version=version)
                 else:
-                    logger.info(f"Index '{name}' already exists.")
+                    physical_name = f"{name}_v{version}" if version is not None else f"{name}_v1"
+                    await self.es.indices.create(
+                        index=physical_name,
+                        body={**body, "aliases": {name: {}}},
+                    )
+                    logger.info(f"Index '{physical_name}' created successfully with alias '{name}'.")
             except Exception as e:
                 logger.error(f"Failed to create or check index: {e}")
                 raise
 
+        async def check_mapping_version(
+            name: str,
+            body: dict,
+            version: int | None,
+            self=self,
+        ):
+            mapping = await self.es.indices.get_mapping(index=name)
+            for index, definition in mapping.items():
+                check_projection_dims(
+                    index,
+                    get_vector_dims(definition),
+                    preprocessing.TEXT_PROJECTION,
+                    preprocessing.IMAGE_PROJECTION,
+                    hint="Run 'python -m managers.reindex' to project stored vectors before enabling the projection.",
+                )
+                if version is None:
+                    continue
+                if get_vector_dims(definition) != get_vector_dims(body):
+                    logger.warning(
+                        f"Index '{index}' vector dims {get_vector_dims(definition)} differ from "
+                        f"expected {get_vector_dims(body)}. Run 'python -m managers.reindex' to project stored vectors."
+                    )
+                current = definition["mappings"].get("_meta", {}).get("version", 1)
+                if current >= version:
+                    continue
+                # Новые поля добавляются в существующий индекс на месте: сервис пишет
+                # их в каждый документ, и без них запись в индекс со strict-маппингом
+                # невозможна. Остальные изменения маппинга требуют перестроения индекса
+                in_place = all(v in ADDITIVE_VERSIONS for v in range(current + 1, version + 1))
+                missing = get_missing_fields(
+                    definition["mappings"].get("properties", {}),
+                    body["mappings"]["properties"],
+                )
+                if missing or in_place:
+                    try:
+                        await self.es.indices.put_mapping(
+                            index=index,
+                            properties=missing,
+                            meta=body["mappings"].get("_meta") if in_place else None,
+                        )
+                    except BadRequestError as e:
+                        raise RuntimeError(
+                            f"Index '{index}' uses mapping version {current}, expected {version}, "
+                            f"and new fields {sorted(missing)} cannot be added to it: {e}. "
+                            f"Run 'python -m managers.reindex' before starting the service."
+                        ) from e
+                if in_place:
+                    logger.info(f"Index '{index}' mapping updated in place from version {current} to {version}.")
+                else:
+                    logger.warning(
+                        f"Index '{index}' uses mapping version {current}, expected {version}; "
+                        f"new fields {sorted(missing)} were added in place. "
+                        f"Run 'python -m managers.reindex' to apply the rest of the new mapping."
+                    )
+
         await check_connection()
 
         for index in indicies:
-            await ensure_index_exists(name=index["name"], body=index["body"])
+            await ensure_index_exists(
+                name=index["name"],
+                body=apply_projection_dims(
+                    index["body"],
+                    preprocessing.TEXT_PROJECTION,
+                    preprocessing.IMAGE_PROJECTION,
+                ),
+                version=index.get("version"),
+            )
 
-    async def upload_preprocessing_models(self):
-        logger.info("Loading preprocessing models...")
-        logger.info("Loading VIT model...")
-        preprocessing.VIT_MODEL = ViTModel.from_pretrained(
-            "google/vit-base-patch16-224-in21k"
+    async def load_projections(self):
+        """
+        Загружает PCA-проекции векторов; должна вызываться до init_es и
+        init_embedded, которые отказываются запускаться, если размерность
+        векторов индекса не совпадает с размерностью проекции.
+        """
+        if config.projection_settings.text_path:
+            logger.info("Loading text embedding projection...")
+        preprocessing.TEXT_PROJECTION = load_projection(
+            config.projection_settings.text_path,
+            config.embedding_settings.text_model,
         )
-        preprocessing.VIT_PROCESSOR = ViTImageProcessor.from_pretrained(
-            "google/vit-base-patch16-224-in21k"
+        if config.projection_settings.image_path:
+            logger.info("Loading image embedding projection...")
+        preprocessing.IMAGE_PROJECTION = load_projection(
+            config.projection_settings.image_path,
+            config.embedding_settings.image_model,
         )
-        logger.info("Loading vectorizer...")
-        preprocessing.VECTORIZER_MODEL = SentenceTransformer('paraphrase-multilingual-MiniLM-L12-v2')
+
+    async def upload_preprocessing_models(self):
+        logger.info("Loading preprocessing models...")
+        stub_models = config.embedding_settings.stub_models
+        if stub_models:
+            logger.warning("Using stub embedding models: vectors are not usable for real search.")
+            preprocessing.VIT_MODEL = StubImageModel()
+            preprocessing.VIT_PROCESSOR = StubImageProcessor()
+            preprocessing.VECTORIZER_MODEL = HashTextEncoder()
+        else:
+            logger.info("Loading VIT model...")
+            preprocessing.VIT_MODEL = ViTModel.from_pretrained(
+                config.embedding_settings.image_model
+            )
+            preprocessing.VIT_PROCESSOR = ViTImageProcessor.from_pretrained(
+                config.embedding_settings.image_model
+            )
+            logger.info("Loading vectorizer...")
+            preprocessing.VECTORIZER_MODEL = SentenceTransformer(config.embedding_settings.text_model)
         logger.info("Finding stopwords...")
         try:
             nltk.data.find('corpora/stopwords')
         except LookupError:
             logger.info("Downloading stopwords...")
             nltk.download('stopwords')
-        preprocessing.STOPWORD_COLLECTION = set(stopwords.words('russian'))
+        try:
+            preprocessing.STOPWORD_COLLECTION = {
+                language: set(stopwords.words(corpus))
+                for language, corpus in config.STOPWORD_LANGUAGES.items()
+            }
+        except LookupError:
+            if not stub_models:
+                raise
+            # Офлайн-стенд без скачанного корпуса: теги формируются без стоп-слов
+            logger.warning("Stopwords are not available, continuing without them.")
+            preprocessing.STOPWORD_COLLECTION = {}
+        if config.term_stats_settings.enabled:
+            logger.info("Opening term statistics...")
+            preprocessing.TERM_STATS = TermStatsStore(
+                config.term_stats_settings.path,
+                compaction_interval=config.term_stats_settings.compaction_interval,
+                max_terms=config.term_stats_settings.max_terms,
+            )
+        if config.near_duplicate_settings.enabled:
+            logger.info("Opening near-duplicate index...")
+            dedup = config.near_duplicate_settings
+            preprocessing.NEAR_DUPLICATES = NearDuplicateIndex(
+                dedup.path,
+                hasher=MinHasher(num_perm=dedup.num_perm, shingle_size=dedup.shingle_size),
+                num_bands=dedup.num_bands,
+                threshold=dedup.threshold,
+            )
         logger.info("Downloading punkt...")
         nltk.download('punkt')
         logger.info("Uploading preprocessing models complete.")
\ No newline at end of file
@@ -0,0 +1,160 @@
+"""
+Обучение и оценка PCA-проекции эмбеддингов.
+
+fit: выбирает случайную выборку векторов текущей модели из индекса, обучает
+проекцию на ее части и сохраняет артефакт; на отложенной части считает
+recall@k поиска по косинусу в пространстве проекции относительно полной
+размерности и записывает оценку в метаданные артефакта.
+
+evaluate: повторяет оценку существующего артефакта на новой выборке.
+
+Запуск из каталога services/search:
+
+    python -m managers.projection fit --field image --dims 256 --output ./data/projections/image_pca256.npz
+    python -m managers.projection evaluate --field image --path ./data/projections/image_pca256.npz
+
+Чтобы включить проекцию, путь к артефакту задается в PROJECTION_TEXT_PATH или
+PROJECTION_IMAGE_PATH, после чего индекс перестраивается командой
+python -m managers.reindex (векторы проецируются при копировании).
+"""
+import asyncio
+import argparse
+from typing import Dict, List
+
+import numpy as np
+from elasticsearch import AsyncElasticsearch
+from elasticsearch.helpers import async_scan
+
+from core.config import embedding_settings, es_settings
+from db.elastic import create_client
+from libs.es.indices.document import index_name
+from services.document import get_script_vector, image_model_filter, text_model_filter
+from utils.logger import logger
+from utils.projection import PCAProjection, recall_at_k
+
+
+FIELDS = {
+    "text": embedding_settings.text_model,
+    "image": embedding_settings.image_model,
+}
+
+
+def sample_query(field: str, seed: int) -> dict:
+    """Документы в случайном порядке с векторами исходной (непроецированной) модели."""
+    if field == "text":
+        query = {
+            "bool": {
+                "filter": [
+                    {"exists": {"field": "text_content_embedding"}},
+                    text_model_filter(FIELDS["text"]),
+                ]
+            }
+        }
+        script_fields = {
+            "text_content_embedding": {"script": {"source": "doc['text_content_embedding'].vectorValue"}}
+        }
+    else:
+        query = {
+            "nested": {
+                "path": "images",
+                "query": {
+                    "bool": {
+                        "filter": [
+                            {"exists": {"field": "images.image_embedding"}},
+                            image_model_filter(FIELDS["image"]),
+                        ]
+                    }
+                },
+                "inner_hits": {
+                    "name": "images",
+                    "size": 100,
+                    "_source": False,
+                    "script_fields": {
+                        "image_embedding": {"script": {"source": "doc['images.image_embedding'].vectorValue"}}
+                    },
+                },
+            }
+        }
+        script_fields = {}
+
+    return {
+        "query": {"function_score": {"query": query, "random_score": {"seed": seed, "field": "_seq_no"}}},
+        "_source": False,
+        "script_fields": script_fields,
+    }
+
+
+async def sample_vectors(es: AsyncElasticsearch, field: str, size: int, seed: int = 0) -> np.ndarray:
+    vectors: List[List[float]] = []
+    async for hit in async_scan(es, index=index_name, query=sample_query(field, seed), preserve_order=True, size=500):
+        if field == "text":
+            vector = get_script_vector(hit, "text_content_embedding")
+            if vector:
+                vectors.append(vector)
+        else:
+            for inner_hit in hit.get("inner_hits", {}).get("images", {}).get("hits", {}).get("hits", []):
+                vector = get_script_vector(inner_hit, "image_embedding")
+                if vector:
+                    vectors.append(vector)
+        if len(vectors) >= size:
+            break
+
+    logger.info(f"Sampled {len(vectors[:size])} {field} vectors.")
+    return np.asarray(vectors[:size], dtype=np.float32)
+
+
+def evaluate(vectors: np.ndarray, projection: PCAProjection, queries: int, ks: List[int]) -> Dict[str, float]:
+    """recall@k для отложенных запросов и оценка сокращения памяти векторов."""
+    queries = min(queries, len(vectors) // 10 or 1)
+    query_vectors, corpus = vectors[:queries], vectors[queries:]
+
+    result = {f"recall@{k}": recall_at_k(corpus, query_vectors, projection, k) for k in ks}
+    # Память вектора (float32 в doc values и int8 в HNSW) линейна по размерности
+    result["memory_reduction"] = projection.input_dims / projection.dims
+    result["queries"] = queries
+    result["corpus"] = len(corpus)
+    return result
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=("fit", "evaluate"))
+    parser.add_argument("--field", choices=tuple(FIELDS), required=True)
+    parser.add_argument("--dims", type=int, default=256)
+    parser.add_argument("--sample", type=int, default=20000)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--k", type=int, nargs="+", default=[10, 50])
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="путь для сохранения артефакта (fit)")
+    parser.add_argument("--path", help="путь к артефакту (evaluate)")
+    args = parser.parse_args()
+
+    es = create_client(es_settings, request_timeout=120, max_retries=3)
+    try:
+        vectors = await sample_vectors(es, args.field, args.sample, args.seed)
+    finally:
+        await es.close()
+
+    if args.command == "fit":
+        if not args.output:
+            parser.error("--output is required for fit")
+        # Первые vectors[:queries] остаются отложенными для оценки
+        held_out = min(args.queries, len(vectors) // 10 or 1)
+        projection = PCAProjection.fit(vectors[held_out:], args.dims, FIELDS[args.field])
+        projection.metadata["evaluation"] = evaluate(vectors, projection, args.queries, args.k)
+        projection.save(args.output)
+        logger.info(f"Saved projection {projection.version} to {args.output}")
+    else:
+        if not args.path:
+            parser.error("--path is required for evaluate")
+        projection = PCAProjection.load(args.path)
+        projection.metadata["evaluation"] = evaluate(vectors, projection, args.queries, args.k)
+
+    print(f"{projection.version}: {args.field} {projection.input_dims} -> {projection.dims}, "
+          f"explained variance {projection.metadata['explained_variance']:.3f}")
+    for key, value in projection.metadata["evaluation"].items():
+        print(f"  {key}: {value:.3f}" if isinstance(value, float) else f"  {key}: {value}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,234 @@
+"""
+Фоновый пересчет эмбеддингов после смены модели.
+
+Выбирает документы, текстовый вектор или хотя бы один вектор изображения
+которых получен не текущей моделью (config.embedding_settings), и
+пересчитывает их по сохраненному в индексе очищенному тексту и извлеченным
+изображениям, не разбирая исходные файлы.
+
+- Скорость ограничена REEMBED_MAX_DOCS_PER_SECOND, torch использует
+  REEMBED_TORCH_THREADS потоков, чтобы не отнимать ресурсы у поиска.
+- Прогресс сохраняется в REEMBED_STATE_PATH после каждой пачки: прерванный
+  запуск продолжается с места остановки.
+- Изображения, файл которых не найден, остаются без вектора с моделью
+  config.UNAVAILABLE_IMAGE_MODEL и повторно не выбираются.
+- Документ перезаписывается только если не менялся с момента чтения
+  (if_seq_no/if_primary_term); конфликтующие документы остаются устаревшими
+  и выбираются следующим запуском.
+
+Запуск из каталога services/search:
+
+    python -m managers.reembed [--batch-size 16] [--max-docs-per-second 2] [--reset]
+"""
+import os
+import json
+import time
+import asyncio
+import argparse
+from typing import Any, Dict, List
+
+import torch
+from elasticsearch import AsyncElasticsearch
+from sentence_transformers import SentenceTransformer
+from transformers import ViTModel, ViTImageProcessor
+
+from core import config
+from db.elastic import create_client
+from libs.es.indices.document import index_name
+from services.document import image_model_filter, text_model_filter
+from services.preprocessing import PreprocessingService
+from utils.logger import logger
+from utils.projection import load_projection
+
+
+class ReembedJob:
+    def __init__(
+        self,
+        es_conn: AsyncElasticsearch,
+        preprocessing_service: PreprocessingService,
+        index: str = index_name,
+        batch_size: int = config.reembed_settings.batch_size,
+        max_docs_per_second: float = config.reembed_settings.max_docs_per_second,
+        state_path: str = config.reembed_settings.state_path,
+    ):
+        self.es = es_conn
+        self.preprocessing_service = preprocessing_service
+        self.index = index
+        self.batch_size = batch_size
+        self.max_docs_per_second = max_docs_per_second
+        self.state_path = state_path
+        self.models = {
+            "text_model": preprocessing_service.text_model_version,
+            "image_model": preprocessing_service.image_model_version,
+        }
+
+    def stale_query(self) -> dict:
+        """
+        Документы с текстовым вектором или изображением не текущей модели,
+        кроме изображений, файл которых не найден.
+        """
+        return {
+            "bool": {
+                "should": [
+                    {"bool": {"must_not": [text_model_filter(self.models["text_model"])]}},
+                    {
+                        "nested": {
+                            "path": "images",
+                            "query": {
+                                "bool": {
+                                    "must_not": [
+                                        image_model_filter(self.models["image_model"]),
+                                        {"term": {"images.image_embedding_model": config.UNAVAILABLE_IMAGE_MODEL}},
+                                    ]
+                                }
+                            },
+                        }
+                    },
+                ],
+                "minimum_should_match": 1,
+            }
+        }
+
+    def load_state(self) -> Dict[str, Any]:
+        """Состояние прерванного запуска для тех же моделей или новое."""
+        if os.path.exists(self.state_path):
+            with open(self.state_path, encoding="utf-8") as f:
+                state = json.load(f)
+            if state.get("models") == self.models:
+                return state
+            logger.info("Saved re-embedding state belongs to other models, starting over.")
+        return {"models": self.models, "search_after": None, "processed": 0, "failed": 0}
+
+    def save_state(self, state: Dict[str, Any]) -> None:
+        os.makedirs(os.path.dirname(self.state_path) or ".", exist_ok=True)
+        partial_path = f"{self.state_path}.part"
+        with open(partial_path, "w", encoding="utf-8") as f:
+            json.dump(state, f)
+        os.replace(partial_path, self.state_path)
+
+    def reset_state(self) -> None:
+        if os.path.exists(self.state_path):
+            os.remove(self.state_path)
+
+    def reembed_batch(self, hits: List[dict]) -> List[dict]:
+        return [self.preprocessing_service.reembed_document(hit["_source"]) for hit in hits]
+
+    async def write_batch(self, hits: List[dict], documents: List[dict]) -> int:
+        """Перезаписывает документы с новыми векторами, возвращает число ошибок."""
+        operations = []
+        for hit, document in zip(hits, documents):
+            operations.append({
+                "index": {
+                    "_index": self.index,
+                    "_id": hit["_id"],
+                    "if_seq_no": hit["_seq_no"],
+                    "if_primary_term": hit["_primary_term"],
+                }
+            })
+            operations.append(document)
+
+        response = await self.es.bulk(operations=operations)
+        failed = 0
+        for item in response["items"]:
+            result = item["index"]
+            if result.get("error"):
+                failed += 1
+                if result["status"] == 409:
+                    logger.info(f"Document {result['_id']} changed during re-embedding, skipped.")
+                else:
+                    logger.error(f"Failed to re-embed document {result['_id']}: {result['error']}")
+        return failed
+
+    async def run(self) -> Dict[str, Any]:
+        state = self.load_state()
+        remaining = (await self.es.count(index=self.index, query=self.stale_query()))["count"]
+        logger.info(
+            f"Re-embedding with {self.models}: {remaining} stale documents, "
+            f"{state['processed']} already processed."
+        )
+
+        started = time.monotonic()
+        processed_now = 0
+
+        while True:
+            batch_started = time.monotonic()
+            body = {
+                "size": self.batch_size,
+                "query": self.stale_query(),
+                "sort": [{"document_id": {"order": "asc", "missing": "_last"}}],
+                "seq_no_primary_term": True,
+            }
+            if state["search_after"] is not None:
+                body["search_after"] = state["search_after"]
+
+            response = await self.es.search(index=self.index, body=body)
+            hits = response["hits"]["hits"]
+            if not hits:
+                break
+
+            documents = await asyncio.to_thread(self.reembed_batch, hits)
+            failed = await self.write_batch(hits, documents)
+
+            state["search_after"] = hits[-1]["sort"]
+            state["processed"] += len(hits) - failed
+            state["failed"] += failed
+            self.save_state(state)
+
+            processed_now += len(hits)
+            rate = processed_now / (time.monotonic() - started)
+            eta = max(remaining - processed_now, 0) / rate if rate else 0
+            logger.info(
+                f"Re-embedded {processed_now}/{remaining} "
+                f"({state['failed']} failed), {rate:.2f} docs/s, ETA {eta:.0f}s"
+            )
+
+            # Ограничение скорости: пачка занимает не меньше len(hits) / max_docs_per_second секунд
+            if self.max_docs_per_second > 0:
+                delay = len(hits) / self.max_docs_per_second - (time.monotonic() - batch_started)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+
+        logger.info(f"Re-embedding complete: {state['processed']} processed, {state['failed']} failed.")
+        self.reset_state()
+        return state
+
+
+def load_preprocessing_service() -> PreprocessingService:
+    """Загружает только модели векторизации: разбор файлов и теги не нужны."""
+    logger.info("Loading embedding models...")
+    return PreprocessingService(
+        stopwords_collection={},
+        vectorizer_model=SentenceTransformer(config.embedding_settings.text_model),
+        vit_model=ViTModel.from_pretrained(config.embedding_settings.image_model),
+        vit_processor=ViTImageProcessor.from_pretrained(config.embedding_settings.image_model),
+        text_projection=load_projection(config.projection_settings.text_path, config.embedding_settings.text_model),
+        image_projection=load_projection(config.projection_settings.image_path, config.embedding_settings.image_model),
+    )
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batch-size", type=int, default=config.reembed_settings.batch_size)
+    parser.add_argument("--max-docs-per-second", type=float, default=config.reembed_settings.max_docs_per_second)
+    parser.add_argument("--reset", action="store_true", help="начать заново, игнорируя сохраненный прогресс")
+    args = parser.parse_args()
+
+    torch.set_num_threads(config.reembed_settings.torch_threads)
+
+    es = create_client(config.es_settings, request_timeout=120, max_retries=3)
+    try:
+        job = ReembedJob(
+            es,
+            load_preprocessing_service(),
+            batch_size=args.batch_size,
+            max_docs_per_second=args.max_docs_per_second,
+        )
+        if args.reset:
+            job.reset_state()
+        await job.run()
+    finally:
+        await es.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
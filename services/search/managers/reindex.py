@@ -0,0 +1,361 @@
+"""
+Перестроение индекса документов без остановки поиска.
+
+Сервис читает и пишет документы через алиас (libs.es.indices.document.index_name),
+за которым стоит физический индекс {alias}_v{version}. Команда:
+
+1. создает новый физический индекс с текущим маппингом, на время загрузки
+   отключая refresh и реплики;
+2. копирует документы из текущего индекса, сохраняя _id; эмбеддинги не
+   хранятся в _source, поэтому читаются из doc values через script_fields;
+3. возвращает refresh_interval и количество реплик, делает refresh;
+4. переносит изменения, сделанные в старом индексе во время копирования:
+   новые и измененные документы (по _seq_no и _primary_term) копируются
+   заново, удаленные - удаляются из нового индекса;
+5. запрещает запись в старый индекс (index.blocks.write), еще раз переносит
+   изменения и атомарно переключает алиас на новый индекс, затем снимает
+   запрет. Пока запрет действует (обычно несколько секунд), запись документов
+   завершается ошибкой и ее нужно повторить, но ни одно изменение не теряется.
+
+Если заданы PCA-проекции (PROJECTION_TEXT_PATH, PROJECTION_IMAGE_PATH),
+размерности векторов в новом индексе берутся из них, а векторы текущих
+моделей при копировании проецируются без повторной векторизации.
+
+С --drop-stale-vectors векторы, полученные не текущей моделью, не копируются
+(например, если у новой модели другая размерность и маппинг изменен); затем
+их пересчитывает python -m managers.reembed.
+
+Эмбеддинги изображений читаются через inner_hits не больше MAX_INNER_IMAGES
+за запрос; у документов с большим числом изображений остальные дочитываются
+по image_id.
+
+Пока идет перестроение, поиск продолжает работать со старым индексом.
+
+Запуск из каталога services/search:
+
+    python -m managers.reindex [--delete-old] [--drop-stale-vectors] [--batch-size 500]
+"""
+import asyncio
+import argparse
+from datetime import datetime
+from typing import AsyncIterator, Dict, Iterable, List, Set, Tuple
+
+from elasticsearch import AsyncElasticsearch
+from elasticsearch.helpers import async_bulk, async_scan
+
+from core.config import (
+    LEGACY_IMAGE_MODEL,
+    LEGACY_TEXT_MODEL,
+    embedding_settings,
+    es_settings,
+    projection_settings,
+)
+from db.elastic import create_client
+from libs.es.indices.document import index_name, index_json, index_version
+from services.document import (
+    MAX_INNER_IMAGES,
+    get_image_script_vectors,
+    get_script_vector,
+    stored_vectors_body,
+)
+from utils.projection import PCAProjection, apply_projection_dims, load_projection
+from utils.logger import logger
+
+
+class ReindexManager:
+    def __init__(
+        self,
+        es_conn: AsyncElasticsearch,
+        alias: str = index_name,
+        body: dict = index_json,
+        version: int = index_version,
+        batch_size: int = 500,
+        drop_stale_vectors: bool = False,
+        text_projection: PCAProjection | None = None,
+        image_projection: PCAProjection | None = None,
+    ):
+        self.es = es_conn
+        self.alias = alias
+        self.body = apply_projection_dims(body, text_projection, image_projection)
+        self.version = version
+        self.batch_size = batch_size
+        self.drop_stale_vectors = drop_stale_vectors
+        self.text_projection = text_projection
+        self.image_projection = image_projection
+        self.text_model = (
+            text_projection.model_version(embedding_settings.text_model)
+            if text_projection is not None else embedding_settings.text_model
+        )
+        self.image_model = (
+            image_projection.model_version(embedding_settings.image_model)
+            if image_projection is not None else embedding_settings.image_model
+        )
+        # (индекс-источник, _id) -> (_seq_no, _primary_term) скопированной версии документа
+        self.copied_versions: Dict[Tuple[str, str], Tuple[int, int]] = {}
+
+    async def get_current_indices(self) -> List[str]:
+        """Физические индексы за алиасом или сам индекс, если алиаса еще нет."""
+        if await self.es.indices.exists_alias(name=self.alias):
+            aliases = await self.es.indices.get_alias(name=self.alias)
+            return list(aliases.keys())
+        if await self.es.indices.exists(index=self.alias):
+            return [self.alias]
+        return []
+
+    def _read_query(self, ids: List[str] | None = None) -> dict:
+        """Запрос, возвращающий документы вместе с текстовыми и image-эмбеддингами."""
+        scope = {"ids": {"values": ids}} if ids is not None else {"match_all": {}}
+        return {**stored_vectors_body(scope), "seq_no_primary_term": True}
+
+    async def read_image_vectors(self, source: str, hit: dict) -> Dict[int, List[float]]:
+        """
+        Эмбеддинги изображений документа: позиция в images -> вектор.
+
+        inner_hits возвращают не больше MAX_INNER_IMAGES изображений, эмбеддинги
+        остальных дочитываются отдельными запросами по image_id.
+        """
+        vectors = get_image_script_vectors(hit)
+        images = hit["_source"].get("images") or []
+        if len(images) <= MAX_INNER_IMAGES:
+            return vectors
+
+        remaining = [image.get("image_id") for offset, image in enumerate(images) if offset not in vectors]
+        if None in remaining:
+            raise RuntimeError(
+                f"Document {hit['_id']} has {len(images)} images and some have no image_id: "
+                f"embeddings beyond the first {MAX_INNER_IMAGES} cannot be read."
+            )
+        for start in range(0, len(remaining), MAX_INNER_IMAGES):
+            body = stored_vectors_body(
+                {"ids": {"values": [hit["_id"]]}},
+                image_ids=remaining[start:start + MAX_INNER_IMAGES],
+            )
+            response = await self.es.search(index=source, body={**body, "_source": False, "size": 1})
+            for found in response["hits"]["hits"]:
+                vectors.update(get_image_script_vectors(found))
+        return vectors
+
+    def restore_document(self, hit: dict, image_vectors: Dict[int, List[float]]) -> dict:
+        """Возвращает в документ эмбеддинги, исключенные из _source."""
+        document = hit["_source"]
+
+        if "text_content_embedding" not in document:
+            vector = get_script_vector(hit, "text_content_embedding")
+            if vector:
+                document["text_content_embedding"] = vector
+
+        images = document.get("images") or []
+        for offset, vector in image_vectors.items():
+            if offset < len(images) and "image_embedding" not in images[offset]:
+                images[offset]["image_embedding"] = vector
+
+        # Векторы текущей модели без проекции проецируются при копировании
+        if (
+            self.text_projection is not None
+            and document.get("text_content_embedding")
+            and document.get("text_embedding_model", LEGACY_TEXT_MODEL) == embedding_settings.text_model
+        ):
+            document["text_content_embedding"] = self.text_projection.transform(document["text_content_embedding"]).tolist()
+            document["text_embedding_model"] = self.text_model
+        if self.image_projection is not None:
+            for image in images:
+                if (
+                    image.get("image_embedding")
+                    and image.get("image_embedding_model", LEGACY_IMAGE_MODEL) == embedding_settings.image_model
+                ):
+                    image["image_embedding"] = self.image_projection.transform(image["image_embedding"]).tolist()
+                    image["image_embedding_model"] = self.image_model
+
+        if self.drop_stale_vectors:
+            if document.get("text_embedding_model", LEGACY_TEXT_MODEL) != self.text_model:
+                document.pop("text_content_embedding", None)
+                document.pop("text_embedding_model", None)
+            for image in images:
+                if image.get("image_embedding_model", LEGACY_IMAGE_MODEL) != self.image_model:
+                    image.pop("image_embedding", None)
+                    image.pop("image_embedding_model", None)
+
+        return document
+
+    async def _actions(self, source: str, target: str, ids: List[str] | None = None) -> AsyncIterator[dict]:
+        async for hit in async_scan(
+            self.es,
+            index=source,
+            query=self._read_query(ids),
+            size=self.batch_size,
+            preserve_order=False,
+        ):
+            self.copied_versions[(source, hit["_id"])] = (hit["_seq_no"], hit["_primary_term"])
+            image_vectors = await self.read_image_vectors(source, hit)
+            yield {
+                "_op_type": "index",
+                "_index": target,
+                "_id": hit["_id"],
+                "_source": self.restore_document(hit, image_vectors),
+            }
+
+    async def copy(self, source: str, target: str, ids: List[str] | None = None) -> int:
+        success, errors = await async_bulk(
+            self.es,
+            self._actions(source, target, ids),
+            chunk_size=self.batch_size,
+            raise_on_error=False,
+        )
+        for error in errors:
+            logger.error(f"Failed to copy document: {error}")
+            # Нескопированный документ должен попасть в следующую докопировку
+            self.copied_versions.pop((source, error["index"]["_id"]), None)
+        return success
+
+    async def delete_removed(self, present: Set[str], target: str) -> int:
+        """Удаляет из target документы, которых больше нет в источниках (present - их _id)."""
+        await self.es.indices.refresh(index=target)
+        removed = [
+            hit["_id"]
+            async for hit in async_scan(self.es, index=target, query={"_source": False}, size=self.batch_size)
+            if hit["_id"] not in present
+        ]
+        actions: Iterable[dict] = (
+            {"_op_type": "delete", "_index": target, "_id": document_id}
+            for document_id in removed
+        )
+        success, errors = await async_bulk(self.es, actions, chunk_size=self.batch_size, raise_on_error=False)
+        for error in errors:
+            logger.error(f"Failed to delete document: {error}")
+        return success
+
+    async def catch_up(self, sources: List[str], target: str) -> Tuple[int, int]:
+        """
+        Переносит в target изменения источников, сделанные после копирования.
+
+        Документы, _seq_no или _primary_term которых отличается от скопированных
+        (новые, обновленные, удаленные и записанные заново), копируются еще раз;
+        документы, удаленные из источников, удаляются из target.
+
+        :return: число скопированных и удаленных документов.
+        """
+        if not sources:
+            return 0, 0
+        await self.es.indices.refresh(index=sources)
+        present: Set[str] = set()
+        copied = 0
+        for source in sources:
+            changed = []
+            async for hit in async_scan(
+                self.es,
+                index=source,
+                query={"_source": False, "seq_no_primary_term": True},
+                size=self.batch_size,
+            ):
+                present.add(hit["_id"])
+                if self.copied_versions.get((source, hit["_id"])) != (hit["_seq_no"], hit["_primary_term"]):
+                    changed.append(hit["_id"])
+            for start in range(0, len(changed), self.batch_size):
+                copied += await self.copy(source, target, ids=changed[start:start + self.batch_size])
+        deleted = await self.delete_removed(present, target)
+        return copied, deleted
+
+    async def set_write_block(self, sources: List[str], blocked: bool) -> None:
+        # Пустой список индексов в put_settings означает все индексы кластера
+        if not sources:
+            return
+        # None снимает настройку, возвращая индекс в исходное состояние
+        await self.es.indices.put_settings(index=sources, settings={"index.blocks.write": True if blocked else None})
+
+    async def get_replicas(self, sources: List[str]) -> str:
+        if not sources:
+            return "1"
+        settings = await self.es.indices.get_settings(index=sources[0], name="index.number_of_replicas")
+        return next(iter(settings.values()))["settings"]["index"]["number_of_replicas"]
+
+    async def reindex(self, delete_old: bool = False) -> str:
+        sources = await self.get_current_indices()
+        replicas = await self.get_replicas(sources)
+        refresh_interval = self.body.get("settings", {}).get("refresh_interval", "1s")
+
+        target = f"{self.alias}_v{self.version}_{datetime.now().strftime('%Y%m%d%H%M%S')}"
+        body = {
+            **self.body,
+            "settings": {
+                **self.body.get("settings", {}),
+                "refresh_interval": "-1",
+                "number_of_replicas": 0,
+            },
+        }
+        await self.es.indices.create(index=target, body=body)
+        logger.info(f"Created index '{target}', copying documents from {sources}...")
+
+        for source in sources:
+            copied = await self.copy(source, target)
+            logger.info(f"Copied {copied} documents from '{source}'.")
+
+        await self.es.indices.put_settings(
+            index=target,
+            settings={"refresh_interval": refresh_interval, "number_of_replicas": replicas},
+        )
+        await self.es.indices.refresh(index=target)
+        await self.es.cluster.health(index=target, wait_for_status="yellow", timeout="5m")
+
+        # Основная часть изменений переносится, пока запись в старый индекс открыта
+        copied, deleted = await self.catch_up(sources, target)
+        logger.info(f"Caught up {copied} changed and {deleted} deleted documents, blocking writes to {sources}...")
+
+        legacy_concrete = sources == [self.alias]
+        if legacy_concrete:
+            # Имя алиаса занято самим индексом: старый индекс удаляется
+            # в той же атомарной операции, что и создание алиаса
+            actions = [
+                {"add": {"index": target, "alias": self.alias}},
+                {"remove_index": {"index": self.alias}},
+            ]
+        else:
+            actions = [{"remove": {"index": source, "alias": self.alias}} for source in sources]
+            actions.append({"add": {"index": target, "alias": self.alias}})
+
+        # Без запрета записи изменения между последней докопировкой и
+        # переключением алиаса остались бы только в старом индексе
+        switched = False
+        await self.set_write_block(sources, True)
+        try:
+            copied, deleted = await self.catch_up(sources, target)
+            await self.es.indices.refresh(index=target)
+            await self.es.indices.update_aliases(actions=actions)
+            switched = True
+        finally:
+            if not (legacy_concrete and switched):
+                await self.set_write_block(sources, False)
+        logger.info(f"Caught up {copied} changed and {deleted} deleted documents while writes were blocked.")
+        logger.info(f"Alias '{self.alias}' now points to '{target}'.")
+
+        if delete_old and not legacy_concrete:
+            for source in sources:
+                await self.es.indices.delete(index=source)
+                logger.info(f"Deleted index '{source}'.")
+
+        return target
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--delete-old", action="store_true", help="удалить старые индексы после переключения")
+    parser.add_argument("--drop-stale-vectors", action="store_true", help="не копировать векторы не текущих моделей")
+    parser.add_argument("--batch-size", type=int, default=500)
+    args = parser.parse_args()
+
+    es = create_client(es_settings, request_timeout=120, max_retries=3)
+    try:
+        manager = ReindexManager(
+            es,
+            batch_size=args.batch_size,
+            drop_stale_vectors=args.drop_stale_vectors,
+            text_projection=load_projection(projection_settings.text_path, embedding_settings.text_model),
+            image_projection=load_projection(projection_settings.image_path, embedding_settings.image_model),
+        )
+        target = await manager.reindex(delete_old=args.delete_old)
+        print(target)
+    finally:
+        await es.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
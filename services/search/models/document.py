@@ -5,14 +5,15 @@ from datetime import date
 
 class Image(BaseModel):
     image_id: str
-    image_embedding: list
+    image_embedding: Union[list, None] = None
+    image_embedding_model: Union[str, None] = None
     position: str
     image_path: str
 
 
 class Metadata(BaseModel):
     author: Union[str, None]
-    created_date: date
+    created_date: Union[date, None] = None
     tags: List[str]
 
 
@@ -20,6 +21,10 @@ class Document(BaseModel):
     document_id: str
     title: str
     text_content: str
-    text_content_embedding: list
+    text_content_embedding: Union[list, None] = None
+    text_embedding_model: Union[str, None] = None
+    language: Union[str, None] = None
     metadata: Metadata
-    images: List[Image]
\ No newline at end of file
+    images: List[Image]
+    duplicate_of: Union[str, None] = None
+    duplicate_group: Union[str, None] = None
\ No newline at end of file
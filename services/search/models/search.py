@@ -0,0 +1,63 @@
+from datetime import date
+from pydantic import BaseModel, Field, model_validator
+from typing import List, Union
+
+import core.config as config
+from models.document import Document
+
+
+class SearchQuery(BaseModel):
+    query: str = Field(default='', description=config.QUERY_DESC)
+    vector: Union[List[float], None] = Field(default=None, description=config.VECTOR_DESC)
+    semantic: bool = Field(default=False, description=config.SEMANTIC_DESC)
+    page: int = Field(default=1, ge=1, description=config.PAGE_DESC)
+    size: int = Field(default=10, ge=1, le=config.MAX_PAGE_SIZE, description=config.SIZE_DESC)
+    collapse_duplicates: bool = Field(default=False, description=config.COLLAPSE_DUPLICATES_DESC)
+
+    @model_validator(mode='after')
+    def check_semantic_query(self):
+        if self.semantic and not self.query and self.vector is None:
+            raise ValueError("semantic search requires a text query or a vector")
+        return self
+
+
+class BatchSearchRequest(BaseModel):
+    queries: List[SearchQuery] = Field(min_length=1, max_length=config.MAX_BATCH_QUERIES)
+
+
+class SearchResult(BaseModel):
+    total: int = 0
+    documents: List[Document] = []
+    error: Union[str, None] = None
+
+
+class DocumentFilters(BaseModel):
+    """Фильтры документов; из параметров запроса строятся dependencies.filters.get_document_filters."""
+    language: Union[str, None] = None
+    tags: Union[List[str], None] = None
+    author: Union[str, None] = None
+    created_from: Union[date, None] = None
+    created_to: Union[date, None] = None
+
+    def to_query(self) -> List[dict]:
+        """Условия фильтрации Elasticsearch для заданных полей."""
+        filters = []
+        if self.language:
+            filters.append({"term": {"language": self.language}})
+
+        metadata = []
+        if self.tags:
+            metadata.append({"terms": {"metadata.tags": self.tags}})
+        if self.author:
+            metadata.append({"match": {"metadata.author": self.author}})
+        if self.created_from or self.created_to:
+            created = {}
+            if self.created_from:
+                created["gte"] = self.created_from.isoformat()
+            if self.created_to:
+                created["lte"] = self.created_to.isoformat()
+            metadata.append({"range": {"metadata.created_date": created}})
+        if metadata:
+            filters.append({"nested": {"path": "metadata", "query": {"bool": {"filter": metadata}}}})
+
+        return filters
@@ -1,5 +1,5 @@
 import os
-from typing import List, Union
+from typing import Dict, List, Union
 
 from functools import lru_cache
 from fastapi import Depends
@@ -8,37 +8,216 @@ from fastapi.responses import FileResponse
 
 from utils.abstract import AsyncSearchService
 from models.document import Document
+from models.search import SearchResult
 from libs.es.indices.document import index_name
 from dependencies.search import get_search_service
+from core.config import (
+    ANALYZED_LANGUAGES,
+    LEGACY_IMAGE_MODEL,
+    LEGACY_TEXT_MODEL,
+    embedding_settings,
+)
+from utils import deadline
+from utils.language import detect_script_language
+
+
+MAX_INNER_IMAGES = 100
+
+
+def get_script_vector(hit: dict, field: str) -> List[float]:
+    """Достает вектор из script_fields ответа Elasticsearch."""
+    value = hit.get("fields", {}).get(field, [])
+    if value and isinstance(value[0], list):
+        return value[0]
+    # Скрипт возвращает null для документов без вектора
+    return [v for v in value if v is not None]
+
+
+def stored_vectors_body(scope: dict, image_ids: List[str] | None = None) -> dict:
+    """
+    Тело запроса, возвращающего документы scope вместе с текстовым
+    эмбеддингом и эмбеддингами изображений (до MAX_INNER_IMAGES на документ).
+
+    Эмбеддинги исключены из _source, поэтому читаются из doc values через
+    script_fields документа и script_fields вложенных inner_hits. Если задан
+    image_ids, возвращаются эмбеддинги только этих изображений: так по частям
+    читаются изображения документов, в которых их больше MAX_INNER_IMAGES.
+    """
+    image_scope = {"terms": {"images.image_id": image_ids}} if image_ids is not None else {"match_all": {}}
+    nested_images = {
+        "nested": {
+            "path": "images",
+            "query": image_scope,
+            "score_mode": "none",
+            "inner_hits": {
+                "name": "images",
+                "size": MAX_INNER_IMAGES,
+                "_source": False,
+                "script_fields": {
+                    "image_embedding": {
+                        "script": {"source": "doc['images.image_embedding'].size() == 0 ? null : doc['images.image_embedding'].vectorValue"}
+                    }
+                },
+            },
+        }
+    }
+    return {
+        "query": {
+            "bool": {
+                "filter": [scope],
+                "should": [nested_images],
+            }
+        },
+        "_source": True,
+        "script_fields": {
+            "text_content_embedding": {
+                "script": {"source": "doc['text_content_embedding'].size() == 0 ? null : doc['text_content_embedding'].vectorValue"}
+            }
+        },
+    }
+
+
+def get_image_script_vectors(hit: dict) -> Dict[int, List[float]]:
+    """Эмбеддинги изображений из ответа на stored_vectors_body: позиция в images -> вектор."""
+    vectors = {}
+    for inner_hit in hit.get("inner_hits", {}).get("images", {}).get("hits", {}).get("hits", []):
+        vector = get_script_vector(inner_hit, "image_embedding")
+        if vector:
+            vectors[inner_hit["_nested"]["offset"]] = vector
+    return vectors
+
+
+def embedding_model_filter(vector_field: str, model_field: str, model: str, legacy_model: str) -> dict:
+    """
+    Условие на векторы, полученные моделью model.
+
+    Векторы без поля модели загружены до его появления и считаются
+    полученными legacy_model.
+    """
+    should = [{"term": {model_field: model}}]
+    if model == legacy_model:
+        should.append({
+            "bool": {
+                "must": [{"exists": {"field": vector_field}}],
+                "must_not": [{"exists": {"field": model_field}}],
+            }
+        })
+    return {"bool": {"should": should, "minimum_should_match": 1}}
+
+
+def text_model_filter(model: str = embedding_settings.text_model) -> dict:
+    return embedding_model_filter("text_content_embedding", "text_embedding_model", model, LEGACY_TEXT_MODEL)
+
+
+def image_model_filter(model: str = embedding_settings.image_model) -> dict:
+    return embedding_model_filter("images.image_embedding", "images.image_embedding_model", model, LEGACY_IMAGE_MODEL)
+
+
+def image_score_query(image_vector: List[float], image_model: str = embedding_settings.image_model) -> dict:
+    """
+    Оценка документа по лучшему из его изображений, полученных моделью
+    image_model: косинусная близость к image_vector плюс 1.0.
+
+    В отличие от вложенного kNN, script_score фильтрует изображения по полям
+    images, поэтому векторы других моделей не попадают в кандидаты.
+    """
+    return {
+        "nested": {
+            "path": "images",
+            "score_mode": "max",
+            "query": {
+                "script_score": {
+                    "query": {
+                        "bool": {
+                            "filter": [
+                                {"exists": {"field": "images.image_embedding"}},
+                                image_model_filter(image_model),
+                            ]
+                        }
+                    },
+                    "script": {
+                        "source": "cosineSimilarity(params.image_vector, 'images.image_embedding') + 1.0",
+                        "params": {"image_vector": image_vector},
+                    },
+                }
+            },
+        }
+    }
 
 
 class DocumentService:
     def __init__(self, search_service: AsyncSearchService):
         self.search_service = search_service
 
-    async def get_documents_by_query(
+    def get_query_fields(self, query: str) -> List[str]:
+        """
+        Поля для полнотекстового поиска: стандартный анализатор плюс
+        подполя с анализатором языка запроса (стоп-слова и стемминг).
+        """
+        fields = ["title", "text_content"]
+        language = detect_script_language(query)
+        if language in ANALYZED_LANGUAGES:
+            fields += [f"title.{language}", f"text_content.{language}"]
+        return fields
+
+    def build_query_body(
         self,
         query: str,
         page: int,
-        size: int
-    ) -> List[Union[Document, None]]:
-        page -= 1
-        
+        size: int,
+        collapse_duplicates: bool = False,
+        vector: List[float] | None = None,
+        text_model: str = embedding_settings.text_model,
+    ) -> dict:
+        """
+        Тело поискового запроса: полнотекстовый поиск по query и/или kNN
+        по текстовому эмбеддингу vector. Если заданы оба, оценки складываются.
+        """
         body = {
-                "from": page,
+                "from": (page - 1) * size,
                 "size": size,
         }
-        
-        if not query:
+
+        if collapse_duplicates:
+            # Из группы почти-дубликатов возвращается только лучший документ
+            body["collapse"] = {"field": "duplicate_group"}
+
+        if vector:
+            body["knn"] = {
+                "field": "text_content_embedding",
+                "query_vector": vector,
+                "k": page * size,
+                "num_candidates": max(100, page * size * 2),
+                "filter": text_model_filter(text_model),
+            }
+            if query:
+                body["query"] = {
+                    "multi_match": {
+                        "query": query,
+                        "fields": self.get_query_fields(query),
+                    }
+                }
+        elif not query:
             body["query"] = {"match_all": {}}
         else:
             body["query"] = {
                 "multi_match": {
                     "query": query,
-                    "fields": ["title", "text_content"],
+                    "fields": self.get_query_fields(query),
                 }
             }
-        
+
+        return body
+
+    async def get_documents_by_query(
+        self,
+        query: str,
+        page: int,
+        size: int,
+        collapse_duplicates: bool = False,
+    ) -> List[Union[Document, None]]:
+        body = self.build_query_body(query, page, size, collapse_duplicates)
+
         doc = await self.search_service.search(
             index=index_name,
             body=body,
@@ -47,6 +226,32 @@ class DocumentService:
 
         return [Document(**i['_source']) for i in doc['hits']['hits']]
 
+    async def search_batch(self, bodies: List[dict]) -> List[SearchResult]:
+        """
+        Выполняет несколько поисковых запросов одним обращением _msearch.
+
+        Ошибка отдельного запроса не прерывает остальные и возвращается
+        в его результате.
+        """
+        searches = []
+        for body in bodies:
+            searches.append({"index": index_name})
+            searches.append(body)
+
+        response = await self.search_service.msearch(searches=searches)
+
+        results = []
+        for item in response["responses"]:
+            if "error" in item:
+                error = item["error"]
+                results.append(SearchResult(error=error.get("reason", str(error)) if isinstance(error, dict) else str(error)))
+                continue
+            results.append(SearchResult(
+                total=item["hits"]["total"]["value"],
+                documents=[Document(**hit["_source"]) for hit in item["hits"]["hits"]],
+            ))
+        return results
+
     async def add_document(self, document: Document) -> dict:
         response = await self.search_service.index(
             index=index_name,
@@ -54,7 +259,97 @@ class DocumentService:
         )
         return response
     
-    async def get_documents_vectors(self) -> List[List[float]]:
+    async def get_similar_documents(
+        self,
+        document_id: str,
+        page: int,
+        size: int,
+        filters: List[dict] | None = None,
+        include_duplicates: bool = False,
+        image_model: str = embedding_settings.image_model,
+    ) -> List[Document] | None:
+        """
+        Документы, похожие на document_id, по его сохраненным эмбеддингам.
+
+        Векторы документа читаются из индекса, поэтому модель не вызывается.
+        Текстовый kNN сравнивает только векторы той же модели, что у документа.
+        Изображения сравниваются по центроиду векторов документа, полученных
+        моделью image_model, с изображениями той же модели через script_score
+        (image_score_query): фильтр вложенного kNN не поддерживает условия на
+        поля images. Оценки складываются; kNN-оценка (1 + cos) / 2 удваивается,
+        чтобы текст и изображения весили одинаково.
+
+        Returns:
+            List[Document] | None: Похожие документы или None, если документ не найден.
+        """
+        response = await self.search_service.search(
+            index=index_name,
+            body={**stored_vectors_body({"term": {"document_id": document_id}}), "size": 1},
+        )
+        if not response["hits"]["hits"]:
+            return None
+
+        hit = response["hits"]["hits"][0]
+        source = hit["_source"]
+
+        must_not = [{"term": {"document_id": document_id}}]
+        if not include_duplicates and source.get("duplicate_group"):
+            must_not.append({"term": {"duplicate_group": source["duplicate_group"]}})
+        candidates = {"bool": {"filter": filters or [], "must_not": must_not}}
+
+        k = page * size
+        body = {
+            "from": (page - 1) * size,
+            "size": size,
+        }
+
+        text_vector = get_script_vector(hit, "text_content_embedding")
+        if text_vector:
+            body["knn"] = {
+                "field": "text_content_embedding",
+                "query_vector": text_vector,
+                "k": k,
+                "num_candidates": max(100, k * 2),
+                "filter": [
+                    candidates,
+                    text_model_filter(source.get("text_embedding_model", LEGACY_TEXT_MODEL)),
+                ],
+                "boost": 2.0,
+            }
+
+        images = source.get("images") or []
+        image_vectors = [
+            vector for offset, vector in get_image_script_vectors(hit).items()
+            if offset < len(images)
+            and images[offset].get("image_embedding_model", LEGACY_IMAGE_MODEL) == image_model
+        ]
+        if image_vectors:
+            centroid = [sum(values) / len(image_vectors) for values in zip(*image_vectors)]
+            body["query"] = {
+                "bool": {
+                    "filter": [candidates],
+                    "should": [image_score_query(centroid, image_model)],
+                    "minimum_should_match": 1,
+                }
+            }
+
+        if "knn" not in body and "query" not in body:
+            return []
+
+        response = await self.search_service.search(
+            index=index_name,
+            body=body,
+        )
+
+        return [Document(**i['_source']) for i in response['hits']['hits']]
+
+    async def get_documents_vectors(self, text_model: str = embedding_settings.text_model) -> List[List[float]]:
+        """
+        Возвращает текстовые эмбеддинги всех документов.
+
+        Эмбеддинги исключены из _source, поэтому читаются из doc values
+        через script_fields. Возвращаются только векторы модели text_model.
+        """
         vectors = []
         size = 100
         from_ = 0
@@ -62,22 +357,31 @@ class DocumentService:
             body = {
                 "from": from_,
                 "size": size,
-                "_source": ["text_content_embedding"],
+                "_source": False,
                 "query": {
-                    "match_all": {}
-                }
+                    "bool": {
+                        "filter": [
+                            {"exists": {"field": "text_content_embedding"}},
+                            text_model_filter(text_model),
+                        ]
+                    }
+                },
+                "script_fields": {
+                    "text_content_embedding": {
+                        "script": {"source": "doc['text_content_embedding'].vectorValue"}
+                    }
+                },
             }
             response = await self.search_service.search(
                 index=index_name,
                 body=body,
-                _source_includes=["text_content_embedding"]
             )
 
             hits = response['hits']['hits']
             if not hits:
                 break
 
-            vectors.extend(hit["_source"]["text_content_embedding"] for hit in hits)
+            vectors.extend(get_script_vector(hit, "text_content_embedding") for hit in hits)
             from_ += size
 
         return vectors
@@ -89,74 +393,64 @@ class DocumentService:
         image_vector: List[float],  # Вектор изображения
         page: int,
         size: int,
-    ) -> dict:
+        text_model: str = embedding_settings.text_model,
+        image_model: str = embedding_settings.image_model,
+        fallback_query: str = '',
+    ) -> dict | None:
         """
         Выполняет мультимодальный поиск по вектору изображения и текстовому вектору.
+
+        Векторы запроса получены моделями text_model и image_model, поэтому
+        сравниваются только с векторами документов, полученными теми же моделями.
+        Оценка документа - сумма текстовой оценки и лучшей оценки его изображений.
+        Если векторов нет (не хватило времени на инференс или векторизация
+        не удалась), выполняется полнотекстовый поиск по fallback_query.
         """
-        # Проверяем наличие векторов
         if not image_vector and not query_vector:
-            return {"message": "No image or query vector provided for the search."}
+            if not fallback_query:
+                return None
+            deadline.degrade("bm25_only")
+            return await self.search_service.search(
+                index=index_name,
+                body=self.build_query_body(fallback_query, page, size),
+                _source_includes=["document_id", "title"],
+            )
 
-        # Строим тело запроса
-        body = {
-            "query": {
+        should = []
+        if query_vector:
+            should.append({
                 "script_score": {
                     "query": {
-                        "match_all": {}  # Ищем все документы
+                        "bool": {
+                            "filter": [
+                                {"exists": {"field": "text_content_embedding"}},
+                                text_model_filter(text_model),
+                            ]
+                        }
                     },
                     "script": {
-                        "source": """
-                            double image_score = 0.0;
-                            double text_score = 0.0;
-
-                            // Проверяем, есть ли вектор изображения
-                            if (params.image_vector != null && doc['image_embedding'].size() > 0) {
-                                image_score = cosineSimilarity(params.image_vector, doc['image_embedding']) + 1.0;
-                            }
-
-                            // Проверяем, есть ли текстовый вектор
-                            if (params.query_vector != null && doc['text_content_embedding'].size() > 0) {
-                                text_score = cosineSimilarity(params.query_vector, doc['text_content_embedding']) + 1.0;
-                            }
-
-                            // Суммируем оценки
-                            return image_score + text_score;
-                        """,
-                        "params": {
-                            "image_vector": image_vector,
-                            "query_vector": query_vector
-                        }
-                    }
+                        "source": "cosineSimilarity(params.query_vector, 'text_content_embedding') + 1.0",
+                        "params": {"query_vector": query_vector},
+                    },
                 }
+            })
+        if image_vector:
+            should.append(image_score_query(image_vector, image_model))
+
+        body = {
+            "query": {
+                "bool": {"should": should, "minimum_should_match": 1}
             },
             "from": (page - 1) * size,
             "size": size,
         }
 
-        # Выполняем запрос в Elasticsearch
-        response = await self.search_service.search(
+        return await self.search_service.search(
             index=index_name,
             body=body,
-            _source_includes=["document_id", "image_embedding", "text_content_embedding"]
+            _source_includes=["document_id", "title"],
         )
 
-        # Проверка на None в случае ошибки Elasticsearch
-        if response is None or response["hits"] is None:
-            return {"message": "No documents found or error in search."}
-
-        # Обработка успешного ответа
-        hits = response["hits"]["hits"]
-        if not hits:
-            return {"message": "No documents found matching your query."}
-
-        best_hit = hits[0]
-        document_id = best_hit["_source"]["document_id"]
-        image_embedding = best_hit["_source"]["image_embedding"]
-
-        # Возвращаем лучший результат
-        return {"document_id": document_id, "image_embedding": image_embedding}
-
-
 
 @lru_cache()
 def get_document_service(
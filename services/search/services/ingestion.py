@@ -0,0 +1,288 @@
+import os
+import asyncio
+import zipfile
+from typing import Any, AsyncIterator, Dict, List, Tuple
+
+from fastapi import Depends, UploadFile
+from starlette.concurrency import run_in_threadpool
+
+from core import config
+from utils import deadline
+from utils.abstract import AsyncSearchService, SearchServiceError
+from utils.file import SavedFile, UploadError, save_file, save_archive_member
+from utils.profiling import stage
+from libs.es.indices.document import index_name
+from dependencies.search import get_search_service
+from services.preprocessing import PreprocessingService, get_preprocessing_service
+
+
+# Источник для конвейера: (имя файла, сохраненный файл или None, ошибка или None)
+Source = Tuple[str, SavedFile | None, str | None]
+
+_DONE = object()
+
+
+class IngestionService:
+    """
+    Пакетная загрузка документов.
+
+    Файлы проходят через двухэтапный конвейер: пока для документа N
+    считаются эмбеддинги, для документа N + 1 уже извлекаются текст и
+    изображения. Готовые документы индексируются пачками через bulk API.
+    """
+
+    def __init__(
+        self,
+        preprocessing_service: PreprocessingService,
+        search_service: AsyncSearchService,
+        bulk_size: int = config.ingestion_settings.bulk_size,
+        pipeline_depth: int = config.ingestion_settings.pipeline_depth,
+        max_files: int = config.ingestion_settings.max_batch_files,
+    ) -> None:
+        self.preprocessing_service = preprocessing_service
+        self.search_service = search_service
+        self.bulk_size = bulk_size
+        self.pipeline_depth = pipeline_depth
+        self.max_files = max_files
+
+    async def ingest_files(self, files: List[UploadFile]) -> Dict[str, Any]:
+        """
+        Обрабатывает и индексирует набор загруженных документов и ZIP-архивов.
+
+        Returns:
+            Dict[str, Any]: Сводка с результатом по каждому файлу.
+        """
+        results = await self._run(self._limit(self._iter_uploads(files)))
+
+        return {
+            "total": len(results),
+            "indexed": sum(1 for r in results if r["status"] == "indexed"),
+            "failed": sum(1 for r in results if r["status"] == "failed"),
+            "results": results,
+        }
+
+    """
+    Источники файлов
+    """
+    async def _iter_uploads(self, files: List[UploadFile]) -> AsyncIterator[Source]:
+        max_size = max(
+            config.upload_settings.max_document_size,
+            config.ingestion_settings.max_archive_size,
+        )
+        for file in files:
+            try:
+                saved = await save_file(
+                    file,
+                    config.UPLOAD_FILES_DIR,
+                    max_size=max_size,
+                    chunk_size=config.upload_settings.chunk_size,
+                    allowed_types=config.DOCUMENT_FILE_TYPES | config.ARCHIVE_FILE_TYPES,
+                )
+            except UploadError as e:
+                yield file.filename, None, str(e)
+                continue
+
+            if os.path.splitext(saved.path)[-1] in config.ARCHIVE_FILE_TYPES:
+                async for source in self._iter_archive(saved):
+                    yield source
+            elif saved.size > config.upload_settings.max_document_size:
+                os.remove(saved.path)
+                yield saved.filename, None, "File exceeds maximum upload size"
+            else:
+                yield saved.filename, saved, None
+
+    async def _iter_archive(self, archive_file: SavedFile) -> AsyncIterator[Source]:
+        try:
+            archive = await run_in_threadpool(zipfile.ZipFile, archive_file.path)
+        except zipfile.BadZipFile as e:
+            os.remove(archive_file.path)
+            yield archive_file.filename, None, f"Invalid archive: {e}"
+            return
+
+        try:
+            members = [
+                member for member in archive.infolist()
+                if not member.is_dir() and not member.filename.startswith("__MACOSX/")
+            ]
+            for member in members:
+                try:
+                    saved = await run_in_threadpool(
+                        save_archive_member,
+                        archive,
+                        member,
+                        config.UPLOAD_FILES_DIR,
+                        config.upload_settings.max_document_size,
+                        config.upload_settings.chunk_size,
+                        config.DOCUMENT_FILE_TYPES,
+                    )
+                except UploadError as e:
+                    yield member.filename, None, str(e)
+                    continue
+                yield member.filename, saved, None
+        finally:
+            archive.close()
+            os.remove(archive_file.path)
+
+    async def _limit(self, sources: AsyncIterator[Source]) -> AsyncIterator[Source]:
+        count = 0
+        async for filename, saved, error in sources:
+            count += 1
+            if count > self.max_files:
+                if saved is not None:
+                    os.remove(saved.path)
+                yield filename, None, f"Batch exceeds maximum of {self.max_files} files"
+                continue
+            yield filename, saved, error
+
+    """
+    Конвейер обработки
+    """
+    async def _run(self, sources: AsyncIterator[Source]) -> List[Dict[str, Any]]:
+        results: List[Dict[str, Any]] = []
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.pipeline_depth)
+
+        async def extract():
+            try:
+                async for filename, saved, error in sources:
+                    entry = {"filename": filename, "status": "failed"}
+                    results.append(entry)
+                    if error is not None:
+                        entry["error"] = error
+                        continue
+                    extracted = {}
+                    # При отмене конвейера файл, который держит extract, удаляется здесь
+                    try:
+                        extracted = await run_in_threadpool(
+                            self.preprocessing_service.extract_document,
+                            saved.path,
+                            saved.title,
+                        )
+                    except asyncio.CancelledError:
+                        self._discard(saved, extracted)
+                        raise
+                    except Exception as e:
+                        entry["error"] = f"Extraction failed: {e}"
+                    if extracted:
+                        entry["skipped_images"] = extracted["image_stats"]["skipped"]
+                    try:
+                        await queue.put((entry, saved, extracted))
+                    except asyncio.CancelledError:
+                        self._discard(saved, extracted)
+                        raise
+            finally:
+                # После отмены embed очередь никто не читает
+                if not asyncio.current_task().cancelling():
+                    await queue.put(_DONE)
+
+        async def embed():
+            pending = []
+            flush_task = None
+            # Документы загрузки регистрируются в индексе почти-дубликатов только после
+            # индексации своей пачки, поэтому дубликаты внутри загрузки ищутся здесь
+            batch = self.preprocessing_service.near_duplicate_batch()
+            try:
+                while (item := await queue.get()) is not _DONE:
+                    entry, saved, extracted = item
+                    if not extracted:
+                        entry.setdefault("error", "Unsupported or unreadable document")
+                        self._discard(saved, extracted)
+                        continue
+                    try:
+                        deadline.check("embedding")
+                        document = await run_in_threadpool(
+                            self.preprocessing_service.embed_document, extracted, batch
+                        )
+                    except Exception as e:
+                        entry["error"] = f"Embedding failed: {e}"
+                        self._discard(saved, extracted)
+                        continue
+
+                    pending.append((entry, saved, extracted, document))
+                    if len(pending) >= self.bulk_size:
+                        if flush_task is not None:
+                            await flush_task
+                        flush_task = asyncio.create_task(self._flush(pending))
+                        pending = []
+
+                if flush_task is not None:
+                    await flush_task
+                if pending:
+                    batch, pending = pending, []
+                    await self._flush(batch)
+            except BaseException:
+                # Документы, не отправленные на индексацию, удаляются
+                for _, saved, extracted, _ in pending:
+                    self._discard(saved, extracted)
+                # Индексация предыдущей пачки не должна продолжаться после завершения конвейера
+                if flush_task is not None:
+                    flush_task.cancel()
+                    await asyncio.gather(flush_task, return_exceptions=True)
+                raise
+
+        tasks = [asyncio.create_task(extract()), asyncio.create_task(embed())]
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            # Ошибка одного этапа отменяет другой: иначе extract ждал бы места
+            # в очереди, которую embed уже не читает
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            while not queue.empty():
+                item = queue.get_nowait()
+                if item is not _DONE:
+                    self._discard(item[1], item[2])
+        return results
+
+    def _discard(self, saved: SavedFile, extracted: Dict[str, Any]) -> None:
+        """Удаляет сохраненный файл и извлеченные изображения документа, который не будет проиндексирован."""
+        os.remove(saved.path)
+        if extracted:
+            self.preprocessing_service.remove_document_folder(extracted["document_id"])
+
+    async def _flush(self, batch: List[Tuple[Dict[str, Any], SavedFile, Dict[str, Any], Dict[str, Any]]]) -> None:
+        """Индексирует пачку документов одним bulk-запросом."""
+        operations = []
+        for _, _, _, document in batch:
+            operations.append({"index": {"_index": index_name}})
+            operations.append(document)
+
+        try:
+            with stage("indexing"):
+                response = await self.search_service.bulk(operations=operations)
+        except (SearchServiceError, deadline.DeadlineExceeded) as e:
+            for entry, saved, extracted, _ in batch:
+                entry["error"] = str(e)
+                self._discard(saved, extracted)
+            return
+
+        for (entry, saved, extracted, document), item in zip(batch, response["items"]):
+            action = item.get("index", {})
+            if "error" in action:
+                entry["error"] = str(action["error"])
+                self._discard(saved, extracted)
+                continue
+
+            new_file_path = os.path.join(
+                config.UPLOAD_FILES_DIR,
+                f"{action['_id']}{os.path.splitext(saved.path)[-1]}",
+            )
+            os.rename(saved.path, new_file_path)
+            await run_in_threadpool(self.preprocessing_service.register_document, extracted)
+
+            entry.update({
+                "status": "indexed",
+                "_id": action["_id"],
+                "document_id": document["document_id"],
+                "file_path": new_file_path,
+                "content_hash": saved.content_hash,
+                "images": len(document["images"]),
+                "duplicate_of": document.get("duplicate_of"),
+            })
+
+
+def get_ingestion_service(
+    preprocessing_service: PreprocessingService = Depends(get_preprocessing_service),
+    search_service: AsyncSearchService = Depends(get_search_service),
+) -> IngestionService:
+    return IngestionService(preprocessing_service, search_service)
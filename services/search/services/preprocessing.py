@@ -1,39 +1,126 @@
 import os
 import re
 import fitz
+import shutil
 import uuid
+import hashlib
 import PyPDF2
 import torch
+import numpy as np
 
 from functools import lru_cache
 from datetime import datetime
-from typing import List, Dict, Any
+from itertools import repeat
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from typing import List, Dict, Any, Iterator, Tuple
 
 from docx import Document
 from PIL import Image, ImageOps, ImageEnhance
 from collections import Counter
-from langdetect import detect
 from typing import Dict, Any, List
 from datetime import datetime
 
+from core import config
+from db.term_stats import TermStatsStore
+from db.near_duplicates import BatchSignatures, NearDuplicateIndex
+from utils import text as text_utils
+from utils import language as language_utils
+from utils import stub_models
+from utils.logger import logger
+from utils.pdf import count_pdf_pages, extract_pdf_text_range, iter_page_windows
+from utils.metrics import BYTES_PROCESSED, DOCUMENTS_PROCESSED, IMAGES_PROCESSED, PAGES_PROCESSED
+from utils.profiling import stage
+from utils.projection import PCAProjection
+
 
 VECTORIZER_MODEL = None
 STOPWORD_COLLECTION = None
 VIT_MODEL = None
 VIT_PROCESSOR = None
+TERM_STATS = None
+NEAR_DUPLICATES = None
+TEXT_PROJECTION = None
+IMAGE_PROJECTION = None
+PAGE_POOL = None
+
+
+def get_page_pool(max_workers: int) -> ProcessPoolExecutor:
+    """Возвращает пул процессов для параллельного извлечения текста страниц."""
+    global PAGE_POOL
+    if PAGE_POOL is None:
+        # spawn, чтобы не форкать процесс с загруженными моделями и потоками torch
+        PAGE_POOL = ProcessPoolExecutor(max_workers=max_workers, mp_context=get_context("spawn"))
+    return PAGE_POOL
+
+
+def shutdown_page_pool() -> None:
+    global PAGE_POOL
+    if PAGE_POOL is not None:
+        PAGE_POOL.shutdown(cancel_futures=True)
+        PAGE_POOL = None
+
 
 class PreprocessingService:
     def __init__(
         self, 
-        stopwords_collection: set, 
+        stopwords_collection: Dict[str, set], 
         vectorizer_model: object, 
         vit_model: object, 
         vit_processor: object,
+        page_window: int = config.preprocessing_settings.page_window,
+        parallel_pages_threshold: int = config.preprocessing_settings.parallel_pages_threshold,
+        workers: int = config.preprocessing_settings.workers,
+        image_memory_limit: int = config.preprocessing_settings.image_memory_limit,
+        image_batch_size: int = config.preprocessing_settings.image_batch_size,
+        image_filter: config.ImageFilterSettings = config.image_filter_settings,
+        image_decode_size: int = config.preprocessing_settings.image_decode_size,
+        language_settings: config.LanguageSettings = config.language_settings,
+        term_stats: TermStatsStore | None = None,
+        near_duplicates: NearDuplicateIndex | None = None,
+        near_duplicate_settings: config.NearDuplicateSettings = config.near_duplicate_settings,
+        embedding_settings: config.EmbeddingSettings = config.embedding_settings,
+        text_projection: PCAProjection | None = None,
+        image_projection: PCAProjection | None = None,
     ) -> None:
-        self.stopwords = stopwords_collection
+        self.stopwords = stopwords_collection or {}
+        self.all_stopwords = set().union(*self.stopwords.values())
         self.vectorizer_model = vectorizer_model
         self.vit_model = vit_model
         self.vit_processor = vit_processor
+        self.text_projection = text_projection
+        self.image_projection = image_projection
+        # Версия векторов включает проекцию: векторы до и после нее несравнимы.
+        # Векторы заглушек (EMBEDDING_STUB_MODELS) получают собственную версию
+        if embedding_settings.stub_models:
+            text_model, image_model = stub_models.TEXT_MODEL_VERSION, stub_models.IMAGE_MODEL_VERSION
+        else:
+            text_model, image_model = embedding_settings.text_model, embedding_settings.image_model
+        self.text_model_version = (
+            text_projection.model_version(text_model) if text_projection is not None else text_model
+        )
+        self.image_model_version = (
+            image_projection.model_version(image_model) if image_projection is not None else image_model
+        )
+        self.term_stats = term_stats
+        self.near_duplicates = near_duplicates
+        self.near_duplicate_min_tokens = near_duplicate_settings.min_tokens
+        self.skip_duplicate_images = near_duplicate_settings.skip_images
+        self.page_window = page_window
+        self.parallel_pages_threshold = parallel_pages_threshold
+        self.workers = workers
+        self.image_memory_limit = image_memory_limit
+        self.image_batch_size = image_batch_size
+        self.image_decode_size = image_decode_size
+        self.language_sample_size = language_settings.sample_size
+        self.language_sample_windows = language_settings.sample_windows
+        self.default_language = language_settings.default_language
+        self.image_filter_enabled = image_filter.enabled
+        self.image_min_bytes = image_filter.min_bytes
+        self.image_min_side = image_filter.min_side
+        self.image_max_aspect = image_filter.max_aspect
+        self.image_min_entropy = image_filter.min_entropy
+        self.image_max_repeats = image_filter.max_repeats
         
     """
     Извлечение и генерация метаданных
@@ -84,7 +171,7 @@ class PreprocessingService:
                     try:
                         pdf.decrypt('')
                     except:
-                        print(f"PDF файл {pdf_path} защищен паролем")
+                        logger.warning(f"PDF файл {pdf_path} защищен паролем")
                         return metadata
                 
                 if pdf.metadata:
@@ -100,7 +187,7 @@ class PreprocessingService:
                             date_obj = self.parse_pdf_date(str(created_date))
                             metadata['created_date'] = date_obj.strftime('%Y-%m-%d')
                         except Exception as e:
-                            print(f"Не удалось преобразовать дату создания: {created_date}. Ошибка: {str(e)}")
+                            logger.warning(f"Не удалось преобразовать дату создания: {created_date}. Ошибка: {str(e)}")
                             
                             # Пробуем альтернативное поле даты, если есть
                             mod_date = pdf.metadata.get('/ModDate', None)
@@ -109,11 +196,11 @@ class PreprocessingService:
                                     date_obj = self.parse_pdf_date(str(mod_date))
                                     metadata['created_date'] = date_obj.strftime('%Y-%m-%d')
                                 except:
-                                    print(f"Не удалось преобразовать альтернативную дату: {mod_date}")
+                                    logger.warning(f"Не удалось преобразовать альтернативную дату: {mod_date}")
                     
             return metadata
         except Exception as e:
-            print(f"Не удалось извлечь метаданные из PDF: {e}")
+            logger.error(f"Не удалось извлечь метаданные из PDF: {e}")
             return {'author': None, 'created_date': None}
 
     def extract_metadata_word(self, docx_path: str) -> Dict[str, any]:
@@ -139,18 +226,65 @@ class PreprocessingService:
                 
             return metadata
         except Exception as e:
-            print(f"Не удалось извлечь метаданные из Word: {e}")
+            logger.error(f"Не удалось извлечь метаданные из Word: {e}")
             return {'author': None, 'created_date': None}
 
     def preprocess_text(self, text: str) -> List[str]:
         """
         Очищает текст: удаляет пунктуацию, разрезает на слова и приводит к нижнему регистру.
         """
-        # Убираем пунктуацию и лишние символы
-        text = re.sub(r'[^\w\s]', '', text)
-        # Разбиваем на слова и приводим к нижнему регистру
-        words = text.lower().split()
-        return words
+        return text_utils.tokenize(text)
+
+    def detect_language(self, text: str) -> str | None:
+        """
+        Определяет язык текста по ограниченной выборке.
+
+        Время не зависит от длины документа, результат детерминирован.
+        """
+        try:
+            return language_utils.detect_language(
+                text,
+                sample_size=self.language_sample_size,
+                windows=self.language_sample_windows,
+                default=self.default_language,
+            )
+        except Exception as e:
+            logger.error(f"Ошибка определения языка: {e}")
+            return self.default_language
+
+    def get_stopwords(self, language: str | None) -> set:
+        """
+        Возвращает стоп-слова для языка.
+
+        Для языков без собственного списка используется объединение всех
+        загруженных списков, так как документы часто смешанные.
+        """
+        if language in self.stopwords:
+            return self.stopwords[language]
+        return self.all_stopwords
+
+    def generate_tags_tfidf(
+        self,
+        term_counts: Dict[str, int],
+        stopwords: set,
+        num_tags: int = 10,
+    ) -> Tuple[List[str], List[str]]:
+        """
+        Генерирует теги по TF-IDF относительно корпусной статистики.
+
+        Общие для всего корпуса слова получают низкий IDF и не вытесняют
+        характерные для документа термины.
+
+        Returns:
+            Tuple[List[str], List[str]]: Теги и термины документа, которые
+            register_document учтет в статистике после индексации.
+        """
+        candidates = text_utils.tag_candidates(term_counts, stopwords)
+        try:
+            return self.term_stats.top_tfidf_terms(candidates, num_tags), list(candidates)
+        except Exception as e:
+            logger.error(f"Ошибка формирования TF-IDF тегов: {e}")
+            return text_utils.top_terms(term_counts, stopwords, num_tags), list(candidates)
 
     def generate_tags_multilang(self, text: str, num_tags: int = 5) -> List[str]:
         """
@@ -164,66 +298,56 @@ class PreprocessingService:
             List[str]: Список ключевых слов.
         """
         try:
-            # Определяем язык текста
-            lang = detect(text)
-            print(f"Определён язык текста: {lang}")
-
             # Выбираем стоп-слова в зависимости от языка
-            if lang == 'ru':
-                stop_words = self.stopwords
-            else:
-                stop_words = self.stopwords
-
-            # Токенизация текста
-            words = self.preprocess_text(text)
-
-            # Убираем стоп-слова
-            meaningful_words = [word for word in words if word not in stop_words]
+            stop_words = self.get_stopwords(self.detect_language(text))
 
-            # Подсчитываем частоту слов
-            word_counts = Counter(meaningful_words)
+            # Токенизация текста и подсчет частоты слов
+            word_counts = Counter(self.preprocess_text(text))
 
-            # Извлекаем num_tags самых частых слов
-            tags = [word for word, _ in word_counts.most_common(num_tags)]
-            
-            return tags
+            # Извлекаем num_tags самых частых слов без стоп-слов
+            return text_utils.top_terms(word_counts, stop_words, num_tags)
 
         except Exception as e:
-            print(f"Ошибка формирования тегов: {e}")
+            logger.error(f"Ошибка формирования тегов: {e}")
             return []
         
     """
     Извлечение текста
     """
     def extract_text_from_pdf(self, pdf_path: str) -> str:
-        """Извлекает текст из PDF-документа, включая зашифрованные файлы."""
+        """
+        Извлекает текст из PDF-документа, включая зашифрованные файлы.
+
+        Страницы разбираются окнами по page_window страниц, поэтому объекты
+        разобранных страниц одновременно хранятся только для одного окна.
+        Извлеченный текст всего документа при этом собирается целиком: он
+        индексируется одним документом, и его размер растет с числом страниц.
+        Для документов от parallel_pages_threshold страниц окна распределяются
+        по пулу процессов.
+        """
         try:
-            text = ""
-            with open(pdf_path, 'rb') as f:
-                reader = PyPDF2.PdfReader(f)
-                
-                # Проверяем, зашифрован ли документ
-                if reader.is_encrypted:
-                    try:
-                        # Пробуем расшифровать без пароля
-                        reader.decrypt('')
-                    except:
-                        print(f"PDF файл {pdf_path} защищен паролем")
-                        return ""
-                
-                # Извлекаем текст
-                for page in reader.pages:
-                    try:
-                        page_text = page.extract_text()
-                        if page_text:
-                            text += page_text
-                    except Exception as e:
-                        print(f"Ошибка при извлечении текста со страницы: {e}")
-                        continue
-                        
-            return text.strip()
+            page_count = count_pdf_pages(pdf_path)
+            if not page_count:
+                logger.warning(f"PDF файл {pdf_path} пуст или защищен паролем")
+                return ""
+            PAGES_PROCESSED.inc(page_count)
+
+            windows = list(iter_page_windows(page_count, self.page_window))
+
+            if page_count >= self.parallel_pages_threshold and len(windows) > 1:
+                starts, stops = zip(*windows)
+                parts = get_page_pool(self.workers).map(
+                    extract_pdf_text_range, repeat(pdf_path), starts, stops
+                )
+            else:
+                parts = (
+                    extract_pdf_text_range(pdf_path, start, stop)
+                    for start, stop in windows
+                )
+
+            return "".join(parts).strip()
         except Exception as e:
-            print(f"Ошибка извлечения текста из PDF {pdf_path}: {e}")
+            logger.error(f"Ошибка извлечения текста из PDF {pdf_path}: {e}")
             return ""
 
     def extract_text_from_word(self, word_path: str) -> str:
@@ -232,7 +356,7 @@ class PreprocessingService:
             doc = Document(word_path)
             return "\n".join(paragraph.text for paragraph in doc.paragraphs).strip()
         except Exception as e:
-            print(f"Ошибка извлечения текста из Word {word_path}: {e}")
+            logger.error(f"Ошибка извлечения текста из Word {word_path}: {e}")
             return ""
         
     """ 
@@ -245,12 +369,25 @@ class PreprocessingService:
             os.makedirs(folder_path, exist_ok=True)
             return folder_path
         except Exception as e:
-            print(f"Ошибка создания папки: {e}")
+            logger.error(f"Ошибка создания папки: {e}")
             return ""
 
+    def remove_document_folder(self, document_id: str) -> None:
+        """Удаляет папку изображений документа, который не будет проиндексирован."""
+        shutil.rmtree(f"data/{document_id}", ignore_errors=True)
+
     def preprocess_image(self, image_path: str) -> Image:
 
-        """Комплексная предобработка изображения."""
+        """
+        Комплексная предобработка изображения.
+
+        Если задан image_decode_size, изображение декодируется сразу в
+        уменьшенном размере (draft-режим JPEG и thumbnail) не больше
+        image_decode_size по большей стороне, и только затем переводится
+        в оттенки серого и повышается резкость: ViT все равно работает
+        с 224x224. При image_decode_size = 0 (по умолчанию) изображение
+        обрабатывается в исходном размере.
+        """
         
         try:
         
@@ -258,6 +395,12 @@ class PreprocessingService:
         
             image = Image.open(image_path)
 
+            if self.image_decode_size:
+                size = (self.image_decode_size, self.image_decode_size)
+                # Для JPEG декодер сразу отдает уменьшенное изображение в оттенках серого
+                image.draft("L", size)
+                image.thumbnail(size, Image.Resampling.BICUBIC, reducing_gap=2.0)
+
             # Конвертация в оттенки серого
         
             gray_image = ImageOps.grayscale(image)
@@ -274,7 +417,7 @@ class PreprocessingService:
         
         except Exception as e:
         
-            print(f"Ошибка предобработки изображения: {e}")
+            logger.error(f"Ошибка предобработки изображения: {e}")
         
             return Image.open(image_path)
 
@@ -297,8 +440,9 @@ class PreprocessingService:
                     image_path = f"{folder_path}/image_page{page_num + 1}_img{img_index + 1}.{image_ext}"
                     os.rename(temp_path, image_path)
                     images.append(image_path)
+            doc.close()
         except Exception as e:
-            print(f"Ошибка извлечения изображений из PDF {pdf_path}: {e}")
+            logger.error(f"Ошибка извлечения изображений из PDF {pdf_path}: {e}")
         return images
 
     def extract_images_from_word(self, word_path: str, folder_path: str) -> List[str]:
@@ -318,9 +462,79 @@ class PreprocessingService:
                     os.rename(temp_path, image_path)
                     images.append(image_path)
         except Exception as e:
-            print(f"Ошибка извлечения изображений из Word {word_path}: {e}")
+            logger.error(f"Ошибка извлечения изображений из Word {word_path}: {e}")
         return images
 
+    def filter_images(self, image_paths: List[str]) -> Tuple[List[str], Dict[str, Any]]:
+        """
+        Отбрасывает декоративные изображения до предобработки и векторизации.
+
+        Проверки идут от дешевых к дорогим: размер файла, число повторов
+        одного и того же изображения в документе (логотипы, колонтитулы),
+        размеры и пропорции по заголовку файла (иконки, разделители) и
+        энтропия яркости по уменьшенной копии (заливки, пустые плашки).
+        Отброшенные файлы удаляются с диска.
+
+        Returns:
+            Tuple[List[str], Dict[str, Any]]: Оставленные пути и статистика
+            с количеством пропущенных изображений по причинам.
+        """
+        stats = {"total": len(image_paths), "skipped": 0, "reasons": {}}
+        if not self.image_filter_enabled or not image_paths:
+            return image_paths, stats
+
+        def skip(image_path: str, reason: str) -> None:
+            stats["skipped"] += 1
+            stats["reasons"][reason] = stats["reasons"].get(reason, 0) + 1
+            try:
+                os.remove(image_path)
+            except OSError:
+                pass
+
+        digests = {}
+        for image_path in image_paths:
+            with open(image_path, "rb") as f:
+                digests[image_path] = hashlib.md5(f.read()).digest()
+        repeats = Counter(digests.values())
+
+        kept = []
+        for image_path in image_paths:
+            if os.path.getsize(image_path) < self.image_min_bytes:
+                skip(image_path, "small_file")
+                continue
+
+            if repeats[digests[image_path]] >= self.image_max_repeats:
+                skip(image_path, "repeated")
+                continue
+
+            try:
+                with Image.open(image_path) as image:
+                    width, height = image.size
+                    if min(width, height) < self.image_min_side:
+                        skip(image_path, "small_dimensions")
+                        continue
+
+                    if max(width, height) / min(width, height) > self.image_max_aspect:
+                        skip(image_path, "aspect_ratio")
+                        continue
+
+                    image.draft("L", (64, 64))
+                    image.thumbnail((64, 64))
+                    if image.convert("L").entropy() < self.image_min_entropy:
+                        skip(image_path, "low_entropy")
+                        continue
+            except Exception as e:
+                logger.error(f"Ошибка проверки изображения {image_path}: {e}")
+                skip(image_path, "unreadable")
+                continue
+
+            kept.append(image_path)
+
+        if stats["skipped"]:
+            logger.info(f"Пропущено изображений: {stats['skipped']} из {stats['total']} {stats['reasons']}")
+
+        return kept, stats
+
     """
     Получение эмбеддингов для изображений
     """
@@ -330,39 +544,97 @@ class PreprocessingService:
         with torch.no_grad():
             outputs = self.vit_model(**inputs)
         
-        return outputs.last_hidden_state.mean(dim=1).squeeze().cpu().numpy().tolist()
+        embedding = outputs.last_hidden_state.mean(dim=1).squeeze().cpu().numpy()
+        if self.image_projection is not None:
+            embedding = self.image_projection.transform(embedding)
+        return embedding.tolist()
+
+    def vectorize_image_batch(self, images: List[Image.Image]) -> List[List[float]]:
+        """Векторизует несколько изображений за один проход модели."""
+        inputs = self.vit_processor(images=images, return_tensors="pt")
+
+        with torch.no_grad():
+            outputs = self.vit_model(**inputs)
+
+        embeddings = outputs.last_hidden_state.mean(dim=1).cpu().numpy()
+        if self.image_projection is not None:
+            embeddings = self.image_projection.transform(embeddings)
+        return embeddings.tolist()
+
+    def vectorize_images(self, image_paths: List[str]) -> Iterator[List[float]]:
+        """
+        Предобрабатывает и векторизует изображения окнами.
+
+        Окно закрывается, когда суммарный размер декодированных изображений
+        достигает image_memory_limit байт или в нем image_batch_size изображений,
+        так что декодированные изображения одновременно хранятся только для
+        одного окна. Ограничение не касается эмбеддингов: вызывающий код
+        получает вектор каждого изображения и обычно хранит их все до индексации.
+        """
+        window: List[Image.Image] = []
+        window_bytes = 0
+
+        def embed_window(window: List[Image.Image]) -> List[List[float]]:
+            with stage("image_embedding"):
+                embeddings = self.vectorize_image_batch(window)
+            for item in window:
+                item.close()
+            return embeddings
+
+        for image_path in image_paths:
+            with stage("image_preprocessing"):
+                image = self.preprocess_image(image_path)
+            window.append(image)
+            window_bytes += image.width * image.height * len(image.getbands())
+
+            if window_bytes >= self.image_memory_limit or len(window) >= self.image_batch_size:
+                yield from embed_window(window)
+                window, window_bytes = [], 0
+
+        if window:
+            yield from embed_window(window)
         
     """
     Очистка текста
     """ 
     def decode_unicode_sequence(self, text: str) -> str:
         """Декодирует строки Unicode в читаемый текст."""
-        # Найдем все /uniXXXX и преобразуем их в символы Unicode
-        decoded_text = re.sub(
-            r"/uni([0-9A-Fa-f]{4})",  # Паттерн для /uniXXXX
-            lambda x: chr(int(x.group(1), 16)),  # Преобразование кодов в Unicode-символы
-            text
-        )
-        return decoded_text
+        return text_utils.decode_unicode_sequence(text)
 
     def clean_text(self, text: str) -> str:
         """Очищает текст от лишних пробелов, некорректных символов и декодирует Unicode."""
         try:
-            # Декодируем Unicode-последовательности
-            text = self.decode_unicode_sequence(text)
-
-            # Удаляем все специальные символы, оставляя буквы, цифры, точки и запятые
-            text = re.sub(r'[^a-zA-Zа-яА-Я0-9.,\s]', '', text)
-
-            # Удаляем лишние пробелы
-            text = re.sub(r'\s+', ' ', text).strip()
-            
-            # Возвращаем очищенный текст
-            return text
+            return text_utils.clean_text(text)
         except Exception as e:
-            print(f"Ошибка очистки текста: {e}")
+            logger.error(f"Ошибка очистки текста: {e}")
             return text
 
+    def analyze_text(self, text: str, num_tags: int = 10) -> text_utils.TextAnalysis:
+        """
+        Очищает текст, определяет язык и за один проход получает токены,
+        частоты слов и теги с учетом стоп-слов этого языка.
+        """
+        try:
+            with stage("text_preprocessing"):
+                cleaned_text = text_utils.clean_text(text)
+                language = self.detect_language(cleaned_text)
+                stopwords = self.get_stopwords(language)
+                analysis = text_utils.analyze_cleaned_text(
+                    cleaned_text,
+                    stopwords,
+                    num_tags=num_tags,
+                    language=language,
+                )
+            if self.term_stats is not None:
+                with stage("tagging"):
+                    analysis.tags, analysis.tag_terms = self.generate_tags_tfidf(
+                        analysis.term_counts, stopwords, num_tags
+                    )
+            return analysis
+        except Exception as e:
+            logger.error(f"Ошибка анализа текста: {e}")
+            return text_utils.TextAnalysis(cleaned_text=self.clean_text(text))
+
     """
     Генерация ID
     """
@@ -372,6 +644,48 @@ class PreprocessingService:
         """
         return str(uuid.uuid4())
 
+    """
+    Поиск почти-дубликатов
+    """
+    def near_duplicate_batch(self) -> BatchSignatures | None:
+        """Индекс почти-дубликатов для документов одной пакетной загрузки."""
+        if self.near_duplicates is None:
+            return None
+        return self.near_duplicates.batch()
+
+    def find_near_duplicate(
+        self,
+        document_id: str,
+        tokens: List[str],
+        batch: BatchSignatures | None = None,
+    ) -> Tuple[str | None, np.ndarray | None]:
+        """
+        Проверяет документ на почти-дубликат по MinHash-сигнатуре шинглов.
+        В LSH-индексе документ регистрирует register_document после индексации,
+        поэтому при пакетной загрузке дубликаты ищутся и в batch - среди
+        документов той же загрузки.
+
+        Returns:
+            Tuple[str | None, np.ndarray | None]: document_id исходного
+            документа или None и сигнатура документа для регистрации.
+        """
+        if self.near_duplicates is None or len(tokens) < self.near_duplicate_min_tokens:
+            return None, None
+
+        try:
+            signature = self.near_duplicates.hasher.signature(tokens)
+            duplicate_of, similarity = self.near_duplicates.find(signature)
+            if batch is not None:
+                batch_duplicate_of, batch_similarity = batch.find(signature)
+                if batch_duplicate_of and batch_similarity > similarity:
+                    duplicate_of, similarity = batch_duplicate_of, batch_similarity
+            if duplicate_of:
+                logger.info(f"Документ {document_id} - почти-дубликат {duplicate_of} (сходство {similarity:.2f})")
+            return duplicate_of, signature
+        except Exception as e:
+            logger.error(f"Ошибка поиска почти-дубликатов: {e}")
+            return None, None
+
     """
     Векторизация
     """
@@ -379,58 +693,148 @@ class PreprocessingService:
         """Преобразует текст в dense vector."""
         try:
             dense_vector = self.vectorizer_model.encode(text, convert_to_numpy=True)
+            if self.text_projection is not None:
+                dense_vector = self.text_projection.transform(dense_vector)
             return dense_vector.tolist()
         except Exception as e:
-            print(f"Ошибка векторизации текста: {e}")
+            logger.error(f"Ошибка векторизации текста: {e}")
             return []
 
+    def vectorize_texts(self, texts: List[str]) -> List[list]:
+        """Преобразует несколько текстов в dense vectors за один вызов модели."""
+        if not texts:
+            return []
+        try:
+            dense_vectors = self.vectorizer_model.encode(texts, convert_to_numpy=True)
+            if self.text_projection is not None:
+                dense_vectors = self.text_projection.transform(dense_vectors)
+            return dense_vectors.tolist()
+        except Exception as e:
+            logger.error(f"Ошибка векторизации текстов: {e}")
+            return [[] for _ in texts]
+
     """
     Процессинг документа из хранилища
     """
-    def process_document(self, file_path: str) -> Dict[str, Any]:
-        """Общий процесс обработки документа (PDF или Word)."""
+    def extract_document(self, file_path: str, title: str | None = None) -> Dict[str, Any]:
+        """
+        Первый этап обработки: извлечение текста, метаданных и изображений.
+
+        Этап не использует модели, поэтому при пакетной обработке он может
+        выполняться для следующего файла параллельно с векторизацией текущего.
+
+        Args:
+            file_path: Путь к файлу в хранилище.
+            title: Название документа; по умолчанию имя файла без расширения.
+
+        Returns:
+            Dict[str, Any]: Промежуточный результат для embed_document
+            или пустой словарь, если формат не поддерживается.
+        """
         ext = os.path.splitext(file_path)[-1].lower()
-        result = {}
 
         # Получаем название файла без расширения и создаем ID документа
-        file_name = os.path.splitext(os.path.basename(file_path))[0]
+        file_name = title or os.path.splitext(os.path.basename(file_path))[0]
         document_id = self.generate_document_id()
 
-        # Создаем папку для изображений документа
-        folder_path = self.create_document_folder(document_id)
-
         # Извлекаем текст, метаданные и изображения
         if ext == ".pdf":
-            text = self.extract_text_from_pdf(file_path)
-            metadata = self.extract_metadata_pdf(file_path)
-            images = self.extract_images_from_pdf(file_path, folder_path)
+            extract_text, extract_metadata, extract_images = (
+                self.extract_text_from_pdf, self.extract_metadata_pdf, self.extract_images_from_pdf
+            )
         elif ext == ".docx":
-            text = self.extract_text_from_word(file_path)
-            metadata = self.extract_metadata_word(file_path)
-            images = self.extract_images_from_word(file_path, folder_path)
+            extract_text, extract_metadata, extract_images = (
+                self.extract_text_from_word, self.extract_metadata_word, self.extract_images_from_word
+            )
         else:
-            print(f"Формат файла {ext} не поддерживается.")
+            logger.warning(f"Формат файла {ext} не поддерживается.")
             return {}
-        
-        # Убедимся, что изображения — это объекты PIL.Image
-        image_objects = [self.preprocess_image(img_path) for img_path in images]
 
-        # Векторизуем изображения
-        image_embeddings = [self.vectorize_image(img) for img in image_objects]
+        # Создаем папку для изображений документа
+        folder_path = self.create_document_folder(document_id)
+
+        DOCUMENTS_PROCESSED.inc(format=ext[1:])
+        try:
+            BYTES_PROCESSED.inc(os.path.getsize(file_path))
+            with stage("text_extraction"):
+                text = extract_text(file_path)
+            with stage("metadata"):
+                metadata = extract_metadata(file_path)
+            with stage("image_extraction"):
+                images = extract_images(file_path, folder_path)
+
+            # Отбрасываем декоративные изображения до векторизации
+            with stage("image_filtering"):
+                images, image_stats = self.filter_images(images)
+        except Exception:
+            self.remove_document_folder(document_id)
+            raise
+        IMAGES_PROCESSED.inc(image_stats["total"], result="extracted")
+        IMAGES_PROCESSED.inc(image_stats["skipped"], result="skipped")
+
+        return {
+            "document_id": document_id,
+            "title": file_name,
+            "text": text,
+            "metadata": metadata,
+            "images": images,
+            "image_stats": image_stats,
+        }
+
+    def embed_document(self, extracted: Dict[str, Any], batch: BatchSignatures | None = None) -> Dict[str, Any]:
+        """
+        Второй этап обработки: очистка текста, поиск почти-дубликатов,
+        векторизация и генерация тегов.
+
+        Данные для register_document (сигнатура и термины документа) сохраняются в extracted.
+
+        Args:
+            extracted: Результат extract_document.
+            batch: Почти-дубликаты документов той же пакетной загрузки;
+                документ добавляется в него после векторизации.
+        """
+        if not extracted:
+            return {}
 
-        # Очищаем текст
-        cleaned_text = self.clean_text(text)
+        result = {}
+        images = extracted["images"]
+        metadata = extracted["metadata"]
+
+        # Очищаем текст и получаем теги за один проход
+        analysis = self.analyze_text(extracted["text"], num_tags=10)
+        cleaned_text = analysis.cleaned_text
+
+        # Ищем почти-дубликаты среди уже загруженных документов
+        with stage("near_duplicates"):
+            duplicate_of, signature = self.find_near_duplicate(extracted["document_id"], analysis.tokens, batch)
+        extracted["signature"] = signature
+        extracted["duplicate_of"] = duplicate_of
+        extracted["tag_terms"] = analysis.tag_terms
+
+        # Предобрабатываем и векторизуем изображения окнами ограниченного размера;
+        # эмбеддинги всех изображений нужны документу и хранятся до индексации
+        if duplicate_of and self.skip_duplicate_images:
+            # Изображения дубликата не индексируются, извлеченные файлы не нужны
+            images = []
+            self.remove_document_folder(extracted["document_id"])
+        image_embeddings = list(self.vectorize_images(images))
+        IMAGES_PROCESSED.inc(len(image_embeddings), result="embedded")
 
         # Векторизуем очищенный текст
-        text_vector = self.vectorize_text(cleaned_text)
+        with stage("text_embedding"):
+            text_vector = self.vectorize_text(cleaned_text)
 
         # Собираем итоговый результат
-        result["document_id"] = document_id
-        result["title"] = file_name  # Название файла без расширения
+        result["document_id"] = extracted["document_id"]
+        result["title"] = extracted["title"]  # Название файла без расширения
         result["text_content"] = cleaned_text
+        result["language"] = analysis.language
         result["text_content_embedding"] = text_vector  # Добавляем векторное представление текста
-        metadata["tags"] = self.generate_tags_multilang(cleaned_text, num_tags=10)  # Сгенерированные ключевые слова для текста
+        result["text_embedding_model"] = self.text_model_version
+        metadata["tags"] = analysis.tags  # Сгенерированные ключевые слова для текста
         result["metadata"] = metadata  # Все метаданные, включая теги
+        result["duplicate_of"] = duplicate_of
+        result["duplicate_group"] = duplicate_of or extracted["document_id"]
 
         # Формируем информацию о каждом изображении
         result["images"] = []
@@ -438,41 +842,99 @@ class PreprocessingService:
             image_info = {
                 "image_id": f"img_{idx}",
                 "image_embedding": img_embedding,
+                "image_embedding_model": self.image_model_version,
                 "position": f"Page {idx}",
                 "image_path": img_path
             }
             result["images"].append(image_info)
 
-        return result
-
-@lru_cache()
-def get_preprocessing_service():
-    return PreprocessingService(
-        stopwords_collection=STOPWORD_COLLECTION,
-        vectorizer_model=VECTORIZER_MODEL,
-        vit_model=VIT_MODEL,
-        vit_processor=VIT_PROCESSOR,
-    )
-
-
-
-
-
-
-
-
-
-
-
-
-
+        if batch is not None and signature is not None:
+            batch.add(extracted["document_id"], signature, canonical_id=duplicate_of or extracted["document_id"])
 
+        return result
 
+    def register_document(self, extracted: Dict[str, Any]) -> None:
+        """
+        Учитывает документ в корпусной статистике терминов и регистрирует
+        его в LSH-индексе почти-дубликатов.
 
+        Вызывается после успешной индексации документа: иначе отклоненные
+        и неудачные загрузки завышали бы документную частоту терминов,
+        а следующие загрузки получали бы duplicate_of, указывающий на
+        документ, которого нет в индексе, и лишались бы изображений.
 
+        Args:
+            extracted: Результат extract_document после embed_document.
+        """
+        tag_terms = extracted.get("tag_terms")
+        if self.term_stats is not None and tag_terms is not None:
+            try:
+                self.term_stats.add_document(tag_terms)
+            except Exception as e:
+                logger.error(f"Ошибка обновления статистики терминов: {e}")
+
+        signature = extracted.get("signature")
+        if self.near_duplicates is not None and signature is not None:
+            try:
+                self.near_duplicates.add(
+                    extracted["document_id"],
+                    signature,
+                    canonical_id=extracted.get("duplicate_of") or extracted["document_id"],
+                )
+            except Exception as e:
+                logger.error(f"Ошибка регистрации документа в индексе почти-дубликатов: {e}")
+
+    def reembed_document(self, document: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Пересчитывает эмбеддинги документа текущими моделями по сохраненному
+        очищенному тексту и извлеченным изображениям, не разбирая исходный файл.
 
+        Args:
+            document: Документ из индекса (_source без эмбеддингов).
 
+        Returns:
+            Dict[str, Any]: Документ с новыми эмбеддингами и версиями моделей.
+        """
+        result = dict(document)
+        result["text_content_embedding"] = self.vectorize_text(document.get("text_content") or "")
+        result["text_embedding_model"] = self.text_model_version
+
+        images = [dict(image) for image in document.get("images") or []]
+        available = [image for image in images if os.path.exists(image["image_path"])]
+        if len(available) < len(images):
+            logger.warning(f"Не найдено изображений документа {document.get('document_id')}: {len(images) - len(available)}")
+
+        for image in images:
+            # У изображения без файла нет вектора текущей модели: старый вектор
+            # не сохраняется, а модель помечается как недоступная
+            image.pop("image_embedding", None)
+            image["image_embedding_model"] = config.UNAVAILABLE_IMAGE_MODEL
+        for image, embedding in zip(available, self.vectorize_images([image["image_path"] for image in available])):
+            image["image_embedding"] = embedding
+            image["image_embedding_model"] = self.image_model_version
+        result["images"] = images
 
+        return result
 
+    def process_document(self, file_path: str, title: str | None = None) -> Dict[str, Any]:
+        """
+        Общий процесс обработки документа (PDF или Word).
 
+        Args:
+            file_path: Путь к файлу в хранилище.
+            title: Название документа; по умолчанию имя файла без расширения.
+        """
+        return self.embed_document(self.extract_document(file_path, title=title))
 
+@lru_cache()
+def get_preprocessing_service():
+    return PreprocessingService(
+        stopwords_collection=STOPWORD_COLLECTION,
+        vectorizer_model=VECTORIZER_MODEL,
+        vit_model=VIT_MODEL,
+        vit_processor=VIT_PROCESSOR,
+        term_stats=TERM_STATS,
+        near_duplicates=NEAR_DUPLICATES,
+        text_projection=TEXT_PROJECTION,
+        image_projection=IMAGE_PROJECTION,
+    )
@@ -0,0 +1,8 @@
+import os
+import sys
+
+SERVICE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Тесты импортируют модули сервиса так же, как main.py: из каталога services/search
+sys.path.insert(0, SERVICE_DIR)
+os.environ.setdefault("SEARCH_SERVICE_PROJECT_NAME", "search-tests")
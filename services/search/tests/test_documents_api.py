@@ -0,0 +1,143 @@
+"""
+Эндпоинты документов поверх встроенного бэкенда.
+
+Приложение собирается из роутера без lifespan: модели не загружаются,
+сервисы подставляются через dependency_overrides.
+"""
+import asyncio
+import io
+import os
+import types
+
+import httpx
+import pytest
+from fastapi import FastAPI
+
+from api.v1 import documents
+from db.embedded import EmbeddedSearchService
+from dependencies.search import get_search_service
+from libs.es.indices.document import index_name
+from services.document import DocumentService, get_document_service
+from services.preprocessing import PreprocessingService, get_preprocessing_service
+from utils.abstract import SearchServiceError
+from utils.stub_models import HashTextEncoder, StubImageModel, StubImageProcessor
+
+from test_embedded import IMAGE_MODEL, TEXT_MODEL, make_document
+from test_ingestion import make_docx
+
+
+class RecordingSearchService(EmbeddedSearchService):
+    """Встроенный бэкенд, запоминающий тела поисковых запросов."""
+
+    def __init__(self, path: str) -> None:
+        super().__init__(path)
+        self.bodies = []
+
+    async def search(self, index: str, body: dict | None = None, **kwargs):
+        self.bodies.append(body)
+        return await super().search(index=index, body=body, **kwargs)
+
+
+class FailingSearchService(EmbeddedSearchService):
+    """Встроенный бэкенд, отклоняющий индексацию документов."""
+
+    async def index(self, index: str, body: dict, id: str | None = None, **kwargs):
+        raise SearchServiceError("index is read-only")
+
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = RecordingSearchService(str(tmp_path))
+    engine.create_index(index_name)
+    yield engine
+    engine.close()
+
+
+@pytest.fixture
+def app(engine):
+    app = FastAPI()
+    app.include_router(documents.router, prefix="/api/v1/documents")
+    preprocessing_service = types.SimpleNamespace(text_model_version=TEXT_MODEL, image_model_version=IMAGE_MODEL)
+    app.dependency_overrides[get_search_service] = lambda: engine
+    app.dependency_overrides[get_document_service] = lambda: DocumentService(engine)
+    app.dependency_overrides[get_preprocessing_service] = lambda: preprocessing_service
+    return app
+
+
+def get(app: FastAPI, url: str, **kwargs) -> httpx.Response:
+    async def request():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await client.get(url, **kwargs)
+
+    return asyncio.run(request())
+
+
+def post(app: FastAPI, url: str, **kwargs) -> httpx.Response:
+    async def request():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await client.post(url, **kwargs)
+
+    return asyncio.run(request())
+
+
+def index(engine, *documents):
+    for document in documents:
+        asyncio.run(engine.index(index=index_name, body=document, id=document["document_id"]))
+
+
+class TestSimilarDocumentsFilters:
+    def test_tags_are_query_parameters(self, app):
+        operation = get(app, "/openapi.json").json()["paths"]["/api/v1/documents/{document_id}/similar/"]["get"]
+
+        assert "requestBody" not in operation
+        assert {"name": "tags", "in": "query"} in [
+            {"name": parameter["name"], "in": parameter["in"]} for parameter in operation["parameters"]
+        ]
+
+    def test_tags_filter_the_similar_documents(self, app, engine):
+        index(
+            engine,
+            make_document("a", "source", vector=[1.0, 0.0]),
+            make_document("finance", "finance", vector=[0.9, 0.1], tags=["finance"]),
+            make_document("legal", "legal", vector=[0.8, 0.2], tags=["legal"]),
+            make_document("untagged", "untagged", vector=[1.0, 0.0]),
+        )
+
+        response = get(app, "/api/v1/documents/a/similar/", params={"tags": ["finance", "legal"]})
+
+        assert response.status_code == 200
+        assert [document["title"] for document in response.json()] == ["finance", "legal"]
+        nested = engine.bodies[-1]["knn"]["filter"][0]["bool"]["filter"][0]["nested"]
+        assert nested["query"]["bool"]["filter"] == [{"terms": {"metadata.tags": ["finance", "legal"]}}]
+
+    def test_unknown_document(self, app):
+        assert get(app, "/api/v1/documents/missing/similar/").status_code == 404
+
+
+class TestProcessDocument:
+    def test_failed_indexing_removes_the_document(self, tmp_path, monkeypatch):
+        # Загруженные файлы и изображения сервис хранит в ./data
+        monkeypatch.chdir(tmp_path)
+        engine = FailingSearchService(str(tmp_path / "index"))
+        engine.create_index(index_name)
+        preprocessing_service = PreprocessingService(
+            stopwords_collection={},
+            vectorizer_model=HashTextEncoder(),
+            vit_model=StubImageModel(),
+            vit_processor=StubImageProcessor(),
+        )
+        app = FastAPI()
+        app.include_router(documents.router, prefix="/api/v1/documents")
+        app.dependency_overrides[get_search_service] = lambda: engine
+        app.dependency_overrides[get_preprocessing_service] = lambda: preprocessing_service
+
+        with pytest.raises(SearchServiceError):
+            post(app, "/api/v1/documents/process/", files={
+                "file": ("report.docx", io.BytesIO(make_docx("annual report")), "application/octet-stream"),
+            })
+        engine.close()
+
+        assert os.listdir("data/uploaded_documents") == []
+        assert os.listdir("data") == ["uploaded_documents"]
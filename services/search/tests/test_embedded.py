@@ -0,0 +1,416 @@
+"""
+Поведение встроенного бэкенда на запросах, которые строит DocumentService.
+
+Встроенный индекс воспроизводит подмножество семантики Elasticsearch,
+поэтому каждый вид запроса сервиса проверяется здесь на результат:
+какие документы найдены, в каком порядке и с какими полями.
+"""
+import asyncio
+
+import numpy as np
+import pytest
+
+from core.config import LEGACY_IMAGE_MODEL, LEGACY_TEXT_MODEL
+from db.embedded import EmbeddedSearchService
+from libs.es.indices.document import index_name
+from models.search import DocumentFilters
+from services.document import DocumentService, stored_vectors_body
+from utils.abstract import SearchNotFoundError, SearchRequestError
+from utils.projection import PCAProjection, check_projection_dims
+
+TEXT_MODEL = "text-model"
+IMAGE_MODEL = "image-model"
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+def make_document(
+    document_id: str,
+    title: str,
+    text: str = "",
+    vector=None,
+    text_model: str | None = TEXT_MODEL,
+    images=(),
+    tags=(),
+    author: str | None = None,
+    created_date: str | None = "2024-01-01",
+    language: str = "en",
+    duplicate_group: str | None = None,
+) -> dict:
+    document = {
+        "document_id": document_id,
+        "title": title,
+        "text_content": text,
+        "language": language,
+        "metadata": {"author": author, "created_date": created_date, "tags": list(tags)},
+        "images": [
+            {
+                "image_id": f"img_{offset + 1}",
+                "image_embedding": image_vector,
+                "image_embedding_model": image_model,
+                "position": f"Page {offset + 1}",
+                "image_path": f"data/{document_id}/{offset + 1}.png",
+            }
+            for offset, (image_vector, image_model) in enumerate(images)
+        ],
+        "duplicate_of": None,
+        "duplicate_group": duplicate_group or document_id,
+    }
+    if vector is not None:
+        document["text_content_embedding"] = vector
+        if text_model is not None:
+            document["text_embedding_model"] = text_model
+    return document
+
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = EmbeddedSearchService(str(tmp_path))
+    engine.create_index(index_name)
+    yield engine
+    engine.close()
+
+
+@pytest.fixture
+def service(engine):
+    return DocumentService(engine)
+
+
+def index(engine, *documents):
+    for document in documents:
+        run(engine.index(index=index_name, body=document, id=document["document_id"]))
+
+
+def ids(hits):
+    return [hit["_id"] for hit in hits]
+
+
+def titles(documents):
+    return [document.title for document in documents]
+
+
+class TestFullText:
+    def test_match_all_returns_every_document_in_insertion_order(self, engine, service):
+        index(engine, make_document("a", "first"), make_document("b", "second"))
+
+        documents = run(service.get_documents_by_query(query="", page=1, size=10))
+
+        assert titles(documents) == ["first", "second"]
+
+    def test_multi_match_ranks_by_bm25(self, engine, service):
+        index(
+            engine,
+            make_document("a", "gardening", "tomatoes and cucumbers"),
+            make_document("b", "elastic search", "search engines search documents"),
+            make_document("c", "search", "a short note"),
+        )
+
+        documents = run(service.get_documents_by_query(query="search", page=1, size=10))
+
+        assert set(titles(documents)) == {"elastic search", "search"}
+
+    def test_language_subfields_search_the_parent_field(self, engine, service):
+        index(engine, make_document("a", "отчет", "годовой отчет компании", language="ru"))
+
+        body = service.build_query_body("отчет", page=1, size=10)
+
+        assert "title.ru" in body["query"]["multi_match"]["fields"]
+        assert ids(run(engine.search(index=index_name, body=body))["hits"]["hits"]) == ["a"]
+
+    def test_pagination(self, engine, service):
+        index(engine, *(make_document(str(i), f"doc {i}") for i in range(5)))
+
+        documents = run(service.get_documents_by_query(query="", page=2, size=2))
+
+        assert titles(documents) == ["doc 2", "doc 3"]
+
+    def test_collapse_keeps_the_best_document_of_each_duplicate_group(self, engine, service):
+        index(
+            engine,
+            make_document("a", "report", "report report report", duplicate_group="g"),
+            make_document("b", "report copy", "report", duplicate_group="g"),
+            make_document("c", "other report", "report"),
+        )
+
+        documents = run(service.get_documents_by_query(query="report", page=1, size=10, collapse_duplicates=True))
+
+        assert titles(documents) == ["report", "other report"]
+
+
+class TestKnn:
+    def test_knn_orders_by_cosine_and_filters_by_model(self, engine, service):
+        index(
+            engine,
+            make_document("near", "near", vector=[1.0, 0.0, 0.0]),
+            make_document("far", "far", vector=[0.0, 1.0, 0.0]),
+            make_document("other-model", "other", vector=[1.0, 0.0, 0.0], text_model="old-model"),
+        )
+
+        body = service.build_query_body("", page=1, size=10, vector=[1.0, 0.1, 0.0], text_model=TEXT_MODEL)
+        hits = run(engine.search(index=index_name, body=body))["hits"]["hits"]
+
+        assert ids(hits) == ["near", "far"]
+        # Оценка Elasticsearch для cosine: (1 + cos) / 2
+        assert hits[0]["_score"] == pytest.approx((1 + 1 / 1.01 ** 0.5) / 2, rel=1e-6)
+
+    def test_vectors_without_model_field_count_as_legacy_model(self, engine, service):
+        index(engine, make_document("legacy", "legacy", vector=[1.0, 0.0], text_model=None))
+
+        current = service.build_query_body("", 1, 10, vector=[1.0, 0.0], text_model=TEXT_MODEL)
+        legacy = service.build_query_body("", 1, 10, vector=[1.0, 0.0], text_model=LEGACY_TEXT_MODEL)
+
+        assert run(engine.search(index=index_name, body=current))["hits"]["hits"] == []
+        assert ids(run(engine.search(index=index_name, body=legacy))["hits"]["hits"]) == ["legacy"]
+
+    def test_hybrid_query_adds_bm25_and_knn_scores(self, engine, service):
+        index(
+            engine,
+            make_document("text", "budget", "budget budget", vector=[0.0, 1.0]),
+            make_document("both", "budget plan", "budget", vector=[1.0, 0.0]),
+        )
+
+        body = service.build_query_body("budget", 1, 10, vector=[1.0, 0.0], text_model=TEXT_MODEL)
+        hits = run(engine.search(index=index_name, body=body))["hits"]["hits"]
+
+        assert ids(hits) == ["both", "text"]
+
+    def test_mismatched_vector_dimensions_are_a_request_error(self, engine, service):
+        index(engine, make_document("a", "a", vector=[1.0, 0.0]))
+
+        body = service.build_query_body("", 1, 10, vector=[1.0, 0.0, 0.0], text_model=TEXT_MODEL)
+
+        with pytest.raises(SearchRequestError):
+            run(engine.search(index=index_name, body=body))
+
+
+class TestBatch:
+    def test_results_are_returned_in_query_order(self, engine, service):
+        index(engine, make_document("a", "alpha"), make_document("b", "beta"))
+
+        results = run(service.search_batch([
+            service.build_query_body("beta", 1, 10),
+            service.build_query_body("alpha", 1, 10),
+            service.build_query_body("", 1, 1),
+        ]))
+
+        assert [titles(result.documents) for result in results] == [["beta"], ["alpha"], ["alpha"]]
+        assert results[2].total == 2
+
+    def test_documents_without_creation_date(self, engine, service):
+        index(engine, make_document("a", "undated", created_date=None))
+
+        results = run(service.search_batch([service.build_query_body("undated", 1, 10)]))
+
+        assert results[0].error is None
+        assert results[0].documents[0].metadata.created_date is None
+
+    def test_a_failing_query_does_not_fail_the_others(self, engine, service):
+        index(engine, make_document("a", "alpha"))
+
+        results = run(service.search_batch([
+            {"query": {"fuzzy": {"title": "alpah"}}},
+            service.build_query_body("alpha", 1, 10),
+        ]))
+
+        assert results[0].error is not None and not results[0].documents
+        assert titles(results[1].documents) == ["alpha"]
+
+
+class TestStoredVectors:
+    def test_vectors_are_excluded_from_source_and_read_through_script_fields(self, engine):
+        index(engine, make_document(
+            "a", "a", vector=[1.0, 0.0],
+            images=[([0.0, 1.0], IMAGE_MODEL), (None, None), ([1.0, 1.0], IMAGE_MODEL)],
+        ))
+
+        body = {**stored_vectors_body({"term": {"document_id": "a"}}), "size": 1}
+        hit = run(engine.search(index=index_name, body=body))["hits"]["hits"][0]
+
+        assert "text_content_embedding" not in hit["_source"]
+        assert hit["fields"]["text_content_embedding"] == [1.0, 0.0]
+        inner = {
+            inner_hit["_nested"]["offset"]: inner_hit.get("fields", {}).get("image_embedding")
+            for inner_hit in hit["inner_hits"]["images"]["hits"]["hits"]
+        }
+        assert inner == {0: [0.0, 1.0], 1: None, 2: [1.0, 1.0]}
+
+    def test_image_ids_limit_the_inner_hits(self, engine):
+        index(engine, make_document("a", "a", images=[([0.0, 1.0], IMAGE_MODEL), ([1.0, 0.0], IMAGE_MODEL)]))
+
+        body = {**stored_vectors_body({"ids": {"values": ["a"]}}, image_ids=["img_2"]), "size": 1}
+        hit = run(engine.search(index=index_name, body=body))["hits"]["hits"][0]
+
+        assert [inner["_nested"]["offset"] for inner in hit["inner_hits"]["images"]["hits"]["hits"]] == [1]
+
+    def test_documents_vectors_returns_only_the_requested_model(self, engine, service):
+        index(
+            engine,
+            make_document("a", "a", vector=[1.0, 0.0]),
+            make_document("b", "b", vector=[0.0, 1.0], text_model="old-model"),
+            make_document("c", "c"),
+        )
+
+        assert run(service.get_documents_vectors(text_model=TEXT_MODEL)) == [[1.0, 0.0]]
+
+
+class TestSimilar:
+    def test_similar_documents_exclude_the_document_and_its_duplicates(self, engine, service):
+        index(
+            engine,
+            make_document("a", "source", vector=[1.0, 0.0], duplicate_group="g"),
+            make_document("dup", "duplicate", vector=[1.0, 0.0], duplicate_group="g"),
+            make_document("near", "near", vector=[0.9, 0.1]),
+            make_document("far", "far", vector=[0.0, 1.0]),
+        )
+
+        documents = run(service.get_similar_documents("a", page=1, size=10, image_model=IMAGE_MODEL))
+        with_duplicates = run(service.get_similar_documents(
+            "a", page=1, size=10, include_duplicates=True, image_model=IMAGE_MODEL,
+        ))
+
+        assert titles(documents) == ["near", "far"]
+        assert titles(with_duplicates) == ["duplicate", "near", "far"]
+
+    def test_similar_documents_apply_nested_metadata_filters(self, engine, service):
+        index(
+            engine,
+            make_document("a", "source", vector=[1.0, 0.0]),
+            make_document("tagged", "tagged", vector=[0.0, 1.0], tags=["finance"], created_date="2024-05-01"),
+            make_document("old", "old", vector=[1.0, 0.0], tags=["finance"], created_date="2020-01-01"),
+            make_document("untagged", "untagged", vector=[1.0, 0.0]),
+        )
+
+        filters = DocumentFilters(
+            language=None, tags=["finance"], author=None, created_from="2024-01-01", created_to=None,
+        ).to_query()
+        documents = run(service.get_similar_documents("a", 1, 10, filters=filters, image_model=IMAGE_MODEL))
+
+        assert titles(documents) == ["tagged"]
+
+    def test_similar_documents_by_images_of_the_same_model(self, engine, service):
+        index(
+            engine,
+            make_document("a", "source", images=[([1.0, 0.0], IMAGE_MODEL), ([0.0, 1.0], "old-model")]),
+            make_document("near", "near", images=[([0.0, 1.0], IMAGE_MODEL), ([1.0, 0.1], IMAGE_MODEL)]),
+            make_document("stale", "stale", images=[([1.0, 0.0], "old-model")]),
+            make_document("none", "no images"),
+        )
+
+        documents = run(service.get_similar_documents("a", 1, 10, image_model=IMAGE_MODEL))
+
+        assert titles(documents) == ["near"]
+
+    def test_text_and_image_similarity_are_added(self, engine, service):
+        index(
+            engine,
+            make_document("a", "source", vector=[1.0, 0.0], images=[([1.0, 0.0], IMAGE_MODEL)]),
+            make_document("text", "text", vector=[1.0, 0.0], images=[([-1.0, 0.0], IMAGE_MODEL)]),
+            make_document("both", "both", vector=[0.8, 0.6], images=[([1.0, 0.0], IMAGE_MODEL)]),
+            make_document("image", "image", vector=[-1.0, 0.0], images=[([0.6, 0.8], IMAGE_MODEL)]),
+        )
+
+        documents = run(service.get_similar_documents("a", 1, 10, image_model=IMAGE_MODEL))
+
+        # text: 2.0 + 0.0, both: 1.8 + 2.0, image: 0.0 + 1.6
+        assert titles(documents) == ["both", "text", "image"]
+
+    def test_unknown_document(self, engine, service):
+        assert run(service.get_similar_documents("missing", 1, 10, image_model=IMAGE_MODEL)) is None
+
+
+class TestMultimodal:
+    def test_text_and_image_scores_are_added(self, engine, service):
+        index(
+            engine,
+            make_document("text", "text match", vector=[1.0, 0.0], images=[([0.0, 1.0], IMAGE_MODEL)]),
+            make_document("both", "both match", vector=[1.0, 0.0], images=[([0.0, 1.0], IMAGE_MODEL), ([1.0, 0.0], IMAGE_MODEL)]),
+            make_document("image", "image match", vector=[0.0, 1.0], images=[([1.0, 0.0], IMAGE_MODEL)]),
+        )
+
+        response = run(service.get_documents_by_multimodal_query(
+            query_vector=[1.0, 0.0], image_vector=[1.0, 0.0], page=1, size=10,
+            text_model=TEXT_MODEL, image_model=IMAGE_MODEL,
+        ))
+        hits = response["hits"]["hits"]
+
+        assert ids(hits) == ["both", "text", "image"]
+        # script_score: cosine + 1.0 для текста и лучшего изображения
+        assert hits[0]["_score"] == pytest.approx(4.0)
+        assert set(hits[0]["_source"]) == {"document_id", "title"}
+
+    def test_vectors_of_other_models_are_ignored(self, engine, service):
+        index(
+            engine,
+            make_document("current", "current", images=[([1.0, 0.0], IMAGE_MODEL)]),
+            make_document("stale", "stale", images=[([1.0, 0.0], "old-model")]),
+            make_document("legacy", "legacy", images=[([1.0, 0.0], None)]),
+        )
+
+        response = run(service.get_documents_by_multimodal_query(
+            query_vector=None, image_vector=[1.0, 0.0], page=1, size=10,
+            text_model=TEXT_MODEL, image_model=IMAGE_MODEL,
+        ))
+
+        assert ids(response["hits"]["hits"]) == ["current"]
+
+    def test_without_vectors_falls_back_to_bm25(self, engine, service):
+        index(engine, make_document("a", "invoice"), make_document("b", "contract"))
+
+        response = run(service.get_documents_by_multimodal_query(
+            query_vector=None, image_vector=None, page=1, size=10, fallback_query="contract",
+        ))
+
+        assert ids(response["hits"]["hits"]) == ["b"]
+
+
+class TestStorage:
+    def test_documents_survive_reopening(self, tmp_path):
+        engine = EmbeddedSearchService(str(tmp_path))
+        engine.create_index(index_name)
+        index(engine, make_document("a", "persisted", vector=[1.0, 0.0]))
+        engine.close()
+
+        reopened = EmbeddedSearchService(str(tmp_path))
+        try:
+            response = run(reopened.get(index=index_name, id="a"))
+            body = {**stored_vectors_body({"ids": {"values": ["a"]}}), "size": 1}
+            hit = run(reopened.search(index=index_name, body=body))["hits"]["hits"][0]
+        finally:
+            reopened.close()
+
+        assert response["_source"]["title"] == "persisted"
+        assert hit["fields"]["text_content_embedding"] == [1.0, 0.0]
+
+    def test_directory_cannot_be_opened_twice(self, engine, tmp_path):
+        with pytest.raises(RuntimeError, match="single process"):
+            EmbeddedSearchService(str(tmp_path))
+
+    def test_projection_must_match_stored_vector_dims(self, engine):
+        index(engine, make_document("a", "a", vector=[1.0, 0.0, 0.0], images=[([1.0, 0.0], IMAGE_MODEL)]))
+        projection = PCAProjection(np.zeros(3), np.eye(2, 3), {"source_model": TEXT_MODEL})
+        dims = engine.vector_dims(index_name)
+
+        assert dims == {"text_content_embedding": 3, "images.image_embedding": 2}
+        check_projection_dims(index_name, dims, None, projection, hint="")
+        with pytest.raises(RuntimeError, match="3-dimensional text_content_embedding"):
+            check_projection_dims(index_name, dims, projection, None, hint="")
+
+    def test_missing_index_and_document(self, engine):
+        with pytest.raises(SearchNotFoundError):
+            run(engine.search(index="missing", body={"query": {"match_all": {}}}))
+        with pytest.raises(SearchNotFoundError):
+            run(engine.get(index=index_name, id="missing"))
+
+    def test_bulk_reports_per_item_results(self, engine):
+        response = run(engine.bulk(operations=[
+            {"index": {"_index": index_name, "_id": "a"}},
+            make_document("a", "a"),
+            {"create": {"_index": index_name, "_id": "a"}},
+            make_document("a", "a"),
+            {"delete": {"_index": index_name, "_id": "missing"}},
+        ]))
+
+        assert response["errors"] is True
+        assert [item[next(iter(item))]["status"] for item in response["items"]] == [201, 409, 404]
@@ -0,0 +1,151 @@
+"""
+Пакетная загрузка документов через IngestionService.
+
+Векторизация выполняется заглушками моделей (utils.stub_models), индекс -
+встроенный бэкенд, индекс почти-дубликатов - SQLite во временном каталоге.
+"""
+import io
+import os
+import asyncio
+import random
+
+import docx
+import pytest
+from fastapi import UploadFile
+
+from db.embedded import EmbeddedSearchService
+from db.near_duplicates import NearDuplicateIndex
+from libs.es.indices.document import index_name
+from services.ingestion import IngestionService
+from services.preprocessing import PreprocessingService
+from utils.minhash import MinHasher
+from utils.stub_models import HashTextEncoder, StubImageModel, StubImageProcessor
+
+WORDS = (
+    "annual report production nickel copper output plant mining revenue growth "
+    "capacity smelter refinery shipment contract market price forecast"
+).split()
+
+
+def make_docx(text: str) -> bytes:
+    document = docx.Document()
+    document.add_paragraph(text)
+    buffer = io.BytesIO()
+    document.save(buffer)
+    return buffer.getvalue()
+
+
+def make_upload(filename: str, text: str) -> UploadFile:
+    return UploadFile(file=io.BytesIO(make_docx(text)), filename=filename)
+
+
+class HangingUpload(UploadFile):
+    """Загрузка, чтение которой не завершается."""
+
+    async def read(self, size: int = -1) -> bytes:
+        await asyncio.Event().wait()
+
+
+class HangingSearchService(EmbeddedSearchService):
+    """Встроенный бэкенд, bulk-запрос к которому не завершается."""
+
+    def __init__(self, path: str) -> None:
+        super().__init__(path)
+        self.bulk_started = asyncio.Event()
+        self.bulk_cancelled = False
+
+    async def bulk(self, operations: list, **kwargs):
+        self.bulk_started.set()
+        try:
+            await asyncio.Event().wait()
+        except asyncio.CancelledError:
+            self.bulk_cancelled = True
+            raise
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    # Загруженные файлы и изображения сервис хранит в ./data
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+@pytest.fixture
+def engine(workdir):
+    engine = EmbeddedSearchService(str(workdir / "index"))
+    engine.create_index(index_name)
+    yield engine
+    engine.close()
+
+
+@pytest.fixture
+def near_duplicates(workdir):
+    index = NearDuplicateIndex(str(workdir / "near_duplicates.sqlite3"), hasher=MinHasher())
+    yield index
+    index.close()
+
+
+@pytest.fixture
+def ingestion(engine, near_duplicates):
+    preprocessing_service = PreprocessingService(
+        stopwords_collection={},
+        vectorizer_model=HashTextEncoder(),
+        vit_model=StubImageModel(),
+        vit_processor=StubImageProcessor(),
+        near_duplicates=near_duplicates,
+    )
+    return IngestionService(preprocessing_service, engine, bulk_size=10)
+
+
+class TestNearDuplicates:
+    def test_revisions_in_one_batch_are_linked(self, ingestion):
+        rng = random.Random(0)
+        words = [rng.choice(WORDS) for _ in range(400)]
+        revision = words[:-1] + ["forecast2"]
+
+        summary = asyncio.run(ingestion.ingest_files([
+            make_upload("report_v1.docx", " ".join(words)),
+            make_upload("report_v2.docx", " ".join(revision)),
+            make_upload("other.docx", " ".join(rng.choice(WORDS) for _ in range(400))),
+        ]))
+
+        first, second, other = summary["results"]
+        assert summary["indexed"] == 3
+        assert first["duplicate_of"] is None
+        assert second["duplicate_of"] == first["document_id"]
+        assert other["duplicate_of"] is None
+        # Изображения дубликата не индексируются, и его папка изображений удалена
+        assert second["images"] == 0
+        assert os.path.isdir(f"data/{first['document_id']}")
+        assert not os.path.exists(f"data/{second['document_id']}")
+
+
+class TestCancellation:
+    def test_cancel_stops_indexing_in_flight(self, workdir, near_duplicates):
+        engine = HangingSearchService(str(workdir / "index"))
+        engine.create_index(index_name)
+        preprocessing_service = PreprocessingService(
+            stopwords_collection={},
+            vectorizer_model=HashTextEncoder(),
+            vit_model=StubImageModel(),
+            vit_processor=StubImageProcessor(),
+            near_duplicates=near_duplicates,
+        )
+        ingestion = IngestionService(preprocessing_service, engine, bulk_size=1)
+
+        async def run():
+            # Первый документ уходит на индексацию, пока конвейер ждет второй файл
+            task = asyncio.create_task(ingestion.ingest_files([
+                make_upload("report.docx", "annual report"),
+                HangingUpload(file=io.BytesIO(), filename="hanging.docx"),
+            ]))
+            await engine.bulk_started.wait()
+            task.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await task
+            return engine.bulk_cancelled
+
+        try:
+            assert asyncio.run(run())
+        finally:
+            engine.close()
@@ -1,6 +1,26 @@
 from abc import ABC, abstractmethod
 
 
+class SearchServiceError(RuntimeError):
+    """Base error of a search backend request."""
+
+
+class SearchNotFoundError(SearchServiceError):
+    """The requested index or document does not exist."""
+
+
+class SearchRequestError(SearchServiceError, ValueError):
+    """The backend rejected the request as invalid."""
+
+
+class SearchUnavailableError(SearchServiceError):
+    """The backend is unreachable, timed out or is failing fast while unhealthy."""
+
+    def __init__(self, message: str, retry_after: float | None = None):
+        self.retry_after = retry_after
+        super().__init__(message)
+
+
 class AsyncSearchService(ABC):
     @abstractmethod
     async def get(
@@ -23,4 +43,12 @@ class AsyncSearchService(ABC):
         id: str | None = None,
         **kwargs
     ):
-        pass
\ No newline at end of file
+        pass
+
+    @abstractmethod
+    async def bulk(self, operations: list, **kwargs):
+        pass
+
+    @abstractmethod
+    async def msearch(self, searches: list, **kwargs):
+        pass
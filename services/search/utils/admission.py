@@ -0,0 +1,157 @@
+"""
+Контроль допуска дорогих запросов.
+
+Дорогие эндпоинты (загрузка документов, поиск по изображению, пакетный
+поиск) разбиты на классы. У каждого класса свой предел одновременных
+запросов и ограниченная очередь ожидания, а общий предел capacity
+ограничивает все классы вместе. Освободившееся место отдается ожидающему
+запросу с наименьшим priority, поэтому поисковые запросы обгоняют загрузку
+документов. Приоритет упорядочивает только ожидающих, поэтому предел
+загрузки документов задается меньше capacity (ADMISSION_SEARCH_RESERVED):
+иначе долгие загрузки занимают все места и поиск отклоняется по таймауту
+очереди. Запрос, не поместившийся в очередь или не дождавшийся места
+за queue_timeout секунд, отклоняется AdmissionRejected (ответ 429 с
+Retry-After). Ожидание не дольше срока запроса (utils.deadline): если срок
+истек в очереди, выбрасывается DeadlineExceeded. Полнотекстовый поиск через
+контроль допуска не проходит.
+
+Состояние не защищено блокировками: контроллер используется только из
+цикла событий.
+"""
+import time
+import asyncio
+import itertools
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from typing import AsyncIterator, Dict, Iterable, List, Tuple
+
+from utils import deadline
+from utils.metrics import (
+    ADMISSION_IN_FLIGHT,
+    ADMISSION_QUEUE_DEPTH,
+    ADMISSION_REJECTIONS,
+    ADMISSION_WAIT_SECONDS,
+)
+
+
+controller: "AdmissionController | None" = None
+
+
+@dataclass(frozen=True)
+class AdmissionClass:
+    name: str
+    limit: int
+    queue_size: int
+    # Меньше - раньше получает освободившееся место
+    priority: int
+
+
+class AdmissionRejected(Exception):
+    def __init__(self, name: str, reason: str, retry_after: float):
+        self.name = name
+        self.reason = reason
+        self.retry_after = retry_after
+        super().__init__(f"Too many concurrent {name} requests, retry later")
+
+
+class AdmissionController:
+    def __init__(
+        self,
+        classes: Iterable[AdmissionClass],
+        capacity: int,
+        queue_timeout: float,
+        retry_after: float,
+    ) -> None:
+        self.classes: Dict[str, AdmissionClass] = {cls.name: cls for cls in classes}
+        self.capacity = capacity
+        self.queue_timeout = queue_timeout
+        self.retry_after = retry_after
+        self.running: Dict[str, int] = {name: 0 for name in self.classes}
+        self.waiting: Dict[str, int] = {name: 0 for name in self.classes}
+        # (priority, порядковый номер, класс, future) - ожидающие в порядке допуска
+        self._waiters: List[Tuple[int, int, str, asyncio.Future]] = []
+        self._sequence = itertools.count()
+
+    def _can_run(self, cls: AdmissionClass) -> bool:
+        return self.running[cls.name] < cls.limit and sum(self.running.values()) < self.capacity
+
+    def _update_metrics(self, name: str) -> None:
+        ADMISSION_IN_FLIGHT.set(self.running[name], endpoint=name)
+        ADMISSION_QUEUE_DEPTH.set(self.waiting[name], endpoint=name)
+
+    def _dispatch(self) -> None:
+        """Допускает ожидающих по приоритету, пока хватает мест."""
+        remaining = []
+        for entry in sorted(self._waiters):
+            _, _, name, future = entry
+            # Отмененные по таймауту или разрыву соединения уже сняты с учета
+            if future.done():
+                continue
+            if self._can_run(self.classes[name]):
+                self.running[name] += 1
+                self.waiting[name] -= 1
+                self._update_metrics(name)
+                future.set_result(None)
+            else:
+                remaining.append(entry)
+        self._waiters = remaining
+
+    def _release(self, name: str) -> None:
+        self.running[name] -= 1
+        self._update_metrics(name)
+        self._dispatch()
+
+    def _reject(self, name: str, reason: str) -> AdmissionRejected:
+        ADMISSION_REJECTIONS.inc(endpoint=name, reason=reason)
+        return AdmissionRejected(name, reason, self.retry_after)
+
+    async def _acquire(self, name: str) -> None:
+        cls = self.classes[name]
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.append((cls.priority, next(self._sequence), name, future))
+        self.waiting[name] += 1
+        self._dispatch()
+        if future.done():
+            return
+
+        if self.waiting[name] > cls.queue_size:
+            future.cancel()
+            self.waiting[name] -= 1
+            self._update_metrics(name)
+            raise self._reject(name, "queue_full")
+        self._update_metrics(name)
+
+        budget = deadline.remaining()
+        timeout = self.queue_timeout if budget is None else max(min(self.queue_timeout, budget), 0.0)
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            self.waiting[name] -= 1
+            self._update_metrics(name)
+            if timeout < self.queue_timeout:
+                raise deadline.DeadlineExceeded("admission")
+            raise self._reject(name, "timeout")
+        except asyncio.CancelledError:
+            # Место могло быть выдано одновременно с отменой: его нужно вернуть
+            if future.done() and not future.cancelled():
+                self._release(name)
+            else:
+                self.waiting[name] -= 1
+                self._update_metrics(name)
+            raise
+        ADMISSION_WAIT_SECONDS.observe(time.perf_counter() - started, endpoint=name)
+
+    @asynccontextmanager
+    async def slot(self, name: str) -> AsyncIterator[None]:
+        """
+        Место для запроса класса name на время блока.
+
+        :raises AdmissionRejected: если очередь класса заполнена или место не освободилось за queue_timeout.
+        :raises DeadlineExceeded: если срок запроса истек раньше.
+        """
+        await self._acquire(name)
+        try:
+            yield
+        finally:
+            self._release(name)
@@ -0,0 +1,88 @@
+"""
+Крайний срок обработки запроса.
+
+Middleware создает Deadline для каждого запроса (значение по умолчанию
+из настроек или заголовок X-Request-Timeout) и кладет его в контекстную
+переменную, поэтому срок виден в обработчиках, сервисах и адаптере
+Elasticsearch без передачи через параметры. Перед инференсом модели
+проверяется оставшееся время; запросы к Elasticsearch получают
+оставшееся время как таймаут поиска и таймаут HTTP-запроса. Если
+результат неполный или упрощенный (например, только BM25 без векторов),
+причина записывается в Deadline.degraded и возвращается клиенту в
+заголовке X-Degraded.
+"""
+import math
+import time
+from contextvars import ContextVar
+from typing import List, Mapping
+
+
+class DeadlineExceeded(Exception):
+    def __init__(self, stage: str):
+        self.stage = stage
+        super().__init__(f"Request deadline exceeded before {stage}")
+
+
+class Deadline:
+    def __init__(self, timeout: float) -> None:
+        self.timeout = timeout
+        self.expires_at = time.monotonic() + timeout
+        self.degraded: List[str] = []
+
+    def remaining(self) -> float:
+        return self.expires_at - time.monotonic()
+
+
+CURRENT_DEADLINE: ContextVar[Deadline | None] = ContextVar("request_deadline", default=None)
+
+
+def remaining() -> float | None:
+    """Оставшееся время текущего запроса в секундах или None, если срока нет."""
+    deadline = CURRENT_DEADLINE.get()
+    return deadline.remaining() if deadline is not None else None
+
+
+def allows(seconds: float) -> bool:
+    """Хватит ли оставшегося времени на операцию длительностью seconds."""
+    budget = remaining()
+    return budget is None or budget >= seconds
+
+
+def check(stage: str) -> None:
+    """:raises DeadlineExceeded: если срок текущего запроса истек."""
+    budget = remaining()
+    if budget is not None and budget <= 0:
+        raise DeadlineExceeded(stage)
+
+
+def degrade(reason: str) -> None:
+    """Отмечает, что ответ на текущий запрос неполный или упрощенный."""
+    deadline = CURRENT_DEADLINE.get()
+    if deadline is not None and reason not in deadline.degraded:
+        deadline.degraded.append(reason)
+
+
+def search_timeout(margin: float) -> str | None:
+    """
+    Значение параметра timeout поиска Elasticsearch: оставшееся время
+    без margin секунд на передачу и разбор ответа.
+    """
+    budget = remaining()
+    if budget is None:
+        return None
+    return f"{max(math.floor((budget - margin) * 1000), 1)}ms"
+
+
+def requested_timeout(headers: Mapping[str, str], default: float, maximum: float) -> float | None:
+    """
+    Срок запроса из заголовка X-Request-Timeout (секунды) или default
+    (0 - без срока). Срок из заголовка не больше maximum: клиент может
+    сократить или продлить срок, но не снять его.
+    """
+    try:
+        requested = float(headers.get("X-Request-Timeout", ""))
+    except ValueError:
+        requested = 0.0
+    if math.isfinite(requested) and requested > 0:
+        return min(requested, maximum) if maximum > 0 else requested
+    return default if default > 0 else None
@@ -1,15 +1,203 @@
 import os
-import shutil
+import uuid
+import hashlib
+import zipfile
+from dataclasses import dataclass
+from typing import Iterable, Optional
+
+import anyio
 from fastapi import UploadFile
 
-def save_file(file: UploadFile, upload_dir: str) -> str:
-    ext = os.path.splitext(file.filename)[-1].lower()
-    
+
+# Сигнатуры поддерживаемых форматов: первые байты файла -> возможные расширения
+FILE_SIGNATURES = (
+    (b"%PDF-", (".pdf",)),
+    (b"PK\x03\x04", (".docx", ".zip")),
+    (b"\x89PNG\r\n\x1a\n", (".png",)),
+    (b"\xff\xd8\xff", (".jpg", ".jpeg")),
+    (b"GIF87a", (".gif",)),
+    (b"GIF89a", (".gif",)),
+    (b"BM", (".bmp",)),
+    (b"II*\x00", (".tif", ".tiff")),
+    (b"MM\x00*", (".tif", ".tiff")),
+)
+
+SIGNATURE_SIZE = 16
+
+
+class UploadError(Exception):
+    """Base error for rejected uploads."""
+
+
+class FileTooLargeError(UploadError):
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        super().__init__(f"File exceeds maximum upload size of {max_size} bytes")
+
+
+class UnsupportedFileTypeError(UploadError):
+    def __init__(self, filename: str | None):
+        self.filename = filename
+        super().__init__(f"Unsupported file type: {filename}")
+
+
+@dataclass
+class SavedFile:
+    path: str
+    filename: str
+    content_hash: str
+    size: int
+
+    @property
+    def title(self) -> str:
+        """Название исходного файла без расширения."""
+        return os.path.splitext(os.path.basename(self.filename))[0]
+
+
+def detect_file_type(
+    head: bytes,
+    filename: str | None,
+    allowed_types: Optional[Iterable[str]] = None,
+) -> str | None:
+    """
+    Определяет расширение файла по первым байтам.
+
+    Расширение из имени файла используется только для выбора между
+    форматами с общей сигнатурой (например, .docx и .zip).
+    Возвращает None, если формат не поддерживается.
+    """
+    declared = os.path.splitext(filename or "")[-1].lower()
+    allowed = set(allowed_types) if allowed_types is not None else None
+
+    for signature, extensions in FILE_SIGNATURES:
+        if not head.startswith(signature):
+            continue
+        candidates = [ext for ext in extensions if allowed is None or ext in allowed]
+        if not candidates:
+            continue
+        return declared if declared in candidates else candidates[0]
+
+    return None
+
+
+async def save_file(
+    file: UploadFile,
+    upload_dir: str,
+    max_size: int,
+    chunk_size: int = 1024 * 1024,
+    allowed_types: Optional[Iterable[str]] = None,
+) -> SavedFile:
+    """
+    Потоково сохраняет загруженный файл под уникальным именем.
+
+    Файл читается и пишется чанками без блокировки event loop, по ходу
+    считается sha256 и проверяется максимальный размер. Тип файла
+    определяется по первым байтам до чтения остального тела запроса.
+
+    :raises UnsupportedFileTypeError: если формат не входит в allowed_types.
+    :raises FileTooLargeError: если размер файла превышает max_size.
+    """
     os.makedirs(upload_dir, exist_ok=True)
-    
-    local_file_path = os.path.join(upload_dir, file.filename)
-    
-    with open(local_file_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
-    
-    return local_file_path
\ No newline at end of file
+
+    head = await file.read(max(chunk_size, SIGNATURE_SIZE))
+    ext = detect_file_type(head[:SIGNATURE_SIZE], file.filename, allowed_types)
+    if ext is None:
+        raise UnsupportedFileTypeError(file.filename)
+
+    file_id = uuid.uuid4().hex
+    partial_path = os.path.join(upload_dir, f".{file_id}.part")
+    local_file_path = os.path.join(upload_dir, f"{file_id}{ext}")
+
+    digest = hashlib.sha256()
+    size = 0
+    chunk = head
+
+    try:
+        async with await anyio.open_file(partial_path, "wb") as buffer:
+            while chunk:
+                size += len(chunk)
+                if size > max_size:
+                    raise FileTooLargeError(max_size)
+                digest.update(chunk)
+                await buffer.write(chunk)
+                chunk = await file.read(chunk_size)
+        os.replace(partial_path, local_file_path)
+    except BaseException:
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+        raise
+
+    return SavedFile(
+        path=local_file_path,
+        filename=file.filename or os.path.basename(local_file_path),
+        content_hash=digest.hexdigest(),
+        size=size,
+    )
+
+
+def save_archive_member(
+    archive: zipfile.ZipFile,
+    member: zipfile.ZipInfo,
+    upload_dir: str,
+    max_size: int,
+    chunk_size: int = 1024 * 1024,
+    allowed_types: Optional[Iterable[str]] = None,
+) -> SavedFile:
+    """
+    Распаковывает один файл из ZIP-архива под уникальным именем.
+
+    Размер проверяется по фактически распакованным байтам, а не по
+    заголовку архива. Функция блокирующая и должна вызываться вне event loop.
+
+    :raises UnsupportedFileTypeError: если формат не входит в allowed_types.
+    :raises FileTooLargeError: если размер файла превышает max_size.
+    """
+    if member.file_size > max_size:
+        raise FileTooLargeError(max_size)
+
+    os.makedirs(upload_dir, exist_ok=True)
+
+    with archive.open(member) as source:
+        head = source.read(max(chunk_size, SIGNATURE_SIZE))
+        ext = detect_file_type(head[:SIGNATURE_SIZE], member.filename, allowed_types)
+        if ext is None:
+            raise UnsupportedFileTypeError(member.filename)
+
+        file_id = uuid.uuid4().hex
+        partial_path = os.path.join(upload_dir, f".{file_id}.part")
+        local_file_path = os.path.join(upload_dir, f"{file_id}{ext}")
+
+        digest = hashlib.sha256()
+        size = 0
+        chunk = head
+
+        try:
+            with open(partial_path, "wb") as buffer:
+                while chunk:
+                    size += len(chunk)
+                    if size > max_size:
+                        raise FileTooLargeError(max_size)
+                    digest.update(chunk)
+                    buffer.write(chunk)
+                    chunk = source.read(chunk_size)
+            os.replace(partial_path, local_file_path)
+        except BaseException:
+            if os.path.exists(partial_path):
+                os.remove(partial_path)
+            raise
+
+    return SavedFile(
+        path=local_file_path,
+        filename=os.path.basename(member.filename),
+        content_hash=digest.hexdigest(),
+        size=size,
+    )
+
+
+def find_uploaded_file(upload_dir: str, document_id: str, allowed_types: Iterable[str]) -> Optional[str]:
+    """Ищет загруженный файл документа: после индексации он назван по _id документа."""
+    for ext in allowed_types:
+        path = os.path.join(upload_dir, f"{document_id}{ext}")
+        if os.path.exists(path):
+            return path
+    return None
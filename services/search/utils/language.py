@@ -0,0 +1,63 @@
+from langdetect import DetectorFactory, detect
+from langdetect.lang_detect_exception import LangDetectException
+
+# Фиксируем seed, чтобы langdetect давал одинаковый результат на одном тексте
+DetectorFactory.seed = 0
+
+
+def sample_text(text: str, sample_size: int, windows: int = 3) -> str:
+    """
+    Возвращает не более sample_size символов текста, взятых равными
+    окнами из начала, середины и конца документа.
+    """
+    if len(text) <= sample_size:
+        return text
+
+    windows = max(windows, 1)
+    chunk = sample_size // windows
+    if windows == 1:
+        return text[:chunk]
+
+    step = (len(text) - chunk) // (windows - 1)
+    return " ".join(text[i * step:i * step + chunk] for i in range(windows))
+
+
+def detect_script_language(text: str) -> str | None:
+    """
+    Определяет язык по преобладающему алфавиту: кириллица -> ru, латиница -> en.
+
+    Работает за один проход по строке и подходит для коротких текстов,
+    например поисковых запросов, на которых статистические детекторы ошибаются.
+    """
+    cyrillic = latin = 0
+    for char in text:
+        if 'а' <= char <= 'я' or 'А' <= char <= 'Я' or char in 'ёЁ':
+            cyrillic += 1
+        elif 'a' <= char <= 'z' or 'A' <= char <= 'Z':
+            latin += 1
+
+    if not cyrillic and not latin:
+        return None
+    return 'ru' if cyrillic >= latin else 'en'
+
+
+def detect_language(
+    text: str,
+    sample_size: int,
+    windows: int = 3,
+    default: str | None = None,
+) -> str | None:
+    """
+    Определяет язык документа по ограниченной выборке текста.
+
+    Время работы не зависит от длины документа. Если langdetect не смог
+    определить язык, используется определение по алфавиту.
+    """
+    sample = sample_text(text, sample_size, windows)
+    if not sample.strip():
+        return default
+
+    try:
+        return detect(sample)
+    except LangDetectException:
+        return detect_script_language(sample) or default
@@ -1,28 +1,114 @@
-import uuid
-import json
 import os
+import queue
+import atexit
 import logging
-from logging.handlers import RotatingFileHandler
-from core.config import settings
+from contextvars import ContextVar
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from typing import List
+
+import orjson
+
+from core.config import settings, logging_settings
+from utils.metrics import LOG_RECORDS_DROPPED
 
 LOGS_DIR = './logs'
 
 os.makedirs(LOGS_DIR, exist_ok=True)
 
+# Идентификатор обрабатываемого запроса, устанавливается middleware
+REQUEST_ID: ContextVar[str | None] = ContextVar("request_id", default=None)
+
+
+class RequestIdFilter(logging.Filter):
+    """Добавляет к записи идентификатор текущего запроса, если он не передан явно."""
+
+    def filter(self, record):
+        if not hasattr(record, 'request_id'):
+            record.request_id = REQUEST_ID.get()
+        return True
+
 
 class JsonFormatter(logging.Formatter):
     def format(self, record):
         log_message = {
+            'timestamp': self.formatTime(record),
+            'level': record.levelname,
             'message': record.getMessage(),
-            'request_id': getattr(record, 'request_id', uuid.uuid4().hex),
+            'request_id': getattr(record, 'request_id', None),
             'host': getattr(record, 'host', settings.service_host),
             'method': getattr(record, 'method', None),
+            'path': getattr(record, 'path', None),
             'query_params': getattr(record, 'query_params', None),
             'status_code': getattr(record, 'status_code', None),
             'elapsed_time': getattr(record, 'elapsed_time', None)
         }
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            log_message['exception'] = record.exc_text
+
+        return orjson.dumps(log_message, default=str).decode()
+
+
+class BackgroundQueueHandler(QueueHandler):
+    """
+    Кладет записи в очередь, которую разбирает фоновый поток: запись на диск
+    и форматирование не выполняются в потоке, обработавшем запрос (в том числе
+    в цикле событий). При переполненной очереди запись отбрасывается.
+    """
+
+    def prepare(self, record):
+        # Формат применяют обработчики фонового потока, поэтому args сохраняются
+        # (их использует, например, форматтер журнала доступа uvicorn).
+        # Трассировка форматируется сразу: объекты кадров не должны жить в очереди
+        record = logging.makeLogRecord(record.__dict__)
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            LOG_RECORDS_DROPPED.inc()
+
+
+class BackgroundQueueListener(QueueListener):
+    def enqueue_sentinel(self):
+        # При остановке очередь может быть заполнена: ждем, пока поток ее разберет
+        self.queue.put(self._sentinel)
+
+
+_listeners: List[BackgroundQueueListener] = []
+
+
+def enqueue_handlers(*loggers: logging.Logger, queue_size: int = logging_settings.queue_size) -> None:
+    """
+    Переносит обработчики логгеров в фоновый поток: логгер получает
+    BackgroundQueueHandler, а прежние обработчики вызываются из QueueListener.
+    """
+    for target in loggers:
+        handlers = [handler for handler in target.handlers if not isinstance(handler, QueueHandler)]
+        if not handlers:
+            continue
+
+        queue_handler = BackgroundQueueHandler(queue.Queue(queue_size))
+        queue_handler.addFilter(RequestIdFilter())
+        for handler in handlers:
+            target.removeHandler(handler)
+        target.addHandler(queue_handler)
+
+        listener = BackgroundQueueListener(queue_handler.queue, *handlers, respect_handler_level=True)
+        listener.start()
+        _listeners.append(listener)
+
 
-        return json.dumps(log_message)
+@atexit.register
+def stop_listeners() -> None:
+    """Дописывает оставшиеся в очередях записи и останавливает фоновые потоки."""
+    while _listeners:
+        _listeners.pop().stop()
 
 
 app_name = 'search'
@@ -41,3 +127,4 @@ rotating_file_handler.setFormatter(formatter)
 rotating_file_handler.setLevel(logging.INFO)
 
 logger.addHandler(rotating_file_handler)
+enqueue_handlers(logger)
@@ -0,0 +1,85 @@
+"""
+Мониторинг задержки цикла событий.
+
+Корутина монитора засыпает на interval секунд и измеряет, насколько позже
+она проснулась: это время цикл событий был занят чужим кодом. Задержка
+пишется в гистограмму search_event_loop_lag_seconds, задержки не меньше
+threshold считаются блокировками (search_event_loop_blocks_total).
+Блокировка короче interval, закончившаяся до пробуждения монитора,
+может остаться незамеченной.
+
+В отладочном режиме (LOOP_MONITOR_DEBUG) отдельный поток следит за
+пробуждениями монитора и, если цикл событий занят дольше threshold,
+снимает стек потока цикла событий прямо во время блокировки и пишет его
+в лог - так видно, какой обработчик выполняет блокирующий вызов.
+"""
+import sys
+import time
+import asyncio
+import threading
+import traceback
+
+from utils.logger import logger
+from utils.metrics import EVENT_LOOP_BLOCKS, EVENT_LOOP_LAG_SECONDS
+
+
+monitor: "LoopMonitor | None" = None
+
+
+class LoopMonitor:
+    def __init__(self, interval: float = 0.1, threshold: float = 0.1, capture_stacks: bool = False) -> None:
+        self.interval = interval
+        self.threshold = threshold
+        self.capture_stacks = capture_stacks
+        self._heartbeat = time.monotonic()
+        self._loop_thread_id: int | None = None
+        self._task: asyncio.Task | None = None
+        self._watchdog: threading.Thread | None = None
+        self._stop = threading.Event()
+
+    def start(self) -> None:
+        """Запускает монитор в текущем цикле событий."""
+        self._loop_thread_id = threading.get_ident()
+        self._heartbeat = time.monotonic()
+        self._task = asyncio.get_running_loop().create_task(self._measure())
+        if self.capture_stacks:
+            self._watchdog = threading.Thread(target=self._watch, name="loop-monitor", daemon=True)
+            self._watchdog.start()
+
+    async def stop(self) -> None:
+        self._stop.set()
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        if self._watchdog is not None:
+            self._watchdog.join()
+
+    async def _measure(self) -> None:
+        while True:
+            started = time.monotonic()
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            self._heartbeat = now
+
+            lag = max(now - started - self.interval, 0.0)
+            EVENT_LOOP_LAG_SECONDS.observe(lag)
+            if lag >= self.threshold:
+                EVENT_LOOP_BLOCKS.inc()
+
+    def _watch(self) -> None:
+        reported = None
+        while not self._stop.wait(self.threshold / 2):
+            heartbeat = self._heartbeat
+            blocked = time.monotonic() - heartbeat - self.interval
+            # Одна блокировка пишется в лог один раз
+            if blocked < self.threshold or heartbeat == reported:
+                continue
+            frame = sys._current_frames().get(self._loop_thread_id)
+            if frame is None:
+                continue
+            reported = heartbeat
+            stack = "".join(traceback.format_stack(frame))
+            logger.warning(f"Event loop blocked for at least {blocked:.3f}s:\n{stack}")
@@ -0,0 +1,269 @@
+"""
+Метрики сервиса в текстовом формате Prometheus.
+
+Счетчики, текущие значения и гистограммы хранятся в памяти процесса и отдаются эндпоинтом
+/metrics; внешний сервис для сбора не нужен, но формат совместим с
+Prometheus. Метрики обновляются из потоков пула (run_in_threadpool),
+поэтому изменения защищены блокировкой.
+"""
+import math
+import time
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Sequence, Tuple
+
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+LabelValues = Tuple[str, ...]
+
+
+class Metric:
+    type = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), registry: "Registry | None" = None) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        (registry or REGISTRY).register(self)
+
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"Metric {self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def samples(self) -> Iterator[Tuple[str, Dict[str, str], float]]:
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    """Монотонно растущий счетчик."""
+
+    type = "counter"
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        if amount < 0:
+            raise ValueError("Counter can only increase")
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels: str) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+    def samples(self) -> Iterator[Tuple[str, Dict[str, str], float]]:
+        with self._lock:
+            values = list(self._values.items())
+        for key, value in values:
+            yield f"{self.name}_total", dict(zip(self.labelnames, key)), value
+
+
+class Gauge(Metric):
+    """Текущее значение, которое может расти и уменьшаться."""
+
+    type = "gauge"
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self._values: Dict[LabelValues, float] = {}
+
+    def set(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels: str) -> None:
+        self.inc(-amount, **labels)
+
+    def value(self, **labels: str) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+    def samples(self) -> Iterator[Tuple[str, Dict[str, str], float]]:
+        with self._lock:
+            values = list(self._values.items())
+        for key, value in values:
+            yield self.name, dict(zip(self.labelnames, key)), value
+
+
+class Histogram(Metric):
+    """Распределение длительностей (или других величин) по корзинам."""
+
+    type = "histogram"
+
+    def __init__(self, *args, buckets: Sequence[float] = DEFAULT_BUCKETS, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.buckets = tuple(sorted(buckets))
+        # Для каждого набора меток: счетчики по корзинам (последняя - +Inf), сумма
+        self._values: Dict[LabelValues, Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.setdefault(key, ([0] * (len(self.buckets) + 1), [0.0]))
+            counts[bisect_left(self.buckets, value)] += 1
+            total[0] += value
+
+    @contextmanager
+    def time(self, **labels: str) -> Iterator[None]:
+        """Измеряет длительность блока в секундах, в том числе завершившегося исключением."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def count(self, **labels: str) -> int:
+        values = self._values.get(self._key(labels))
+        return sum(values[0]) if values else 0
+
+    def samples(self) -> Iterator[Tuple[str, Dict[str, str], float]]:
+        with self._lock:
+            values = [(key, list(counts), total[0]) for key, (counts, total) in self._values.items()]
+        for key, counts, total in values:
+            labels = dict(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                yield f"{self.name}_bucket", {**labels, "le": format_value(bound)}, cumulative
+            yield f"{self.name}_sum", labels, total
+            yield f"{self.name}_count", labels, cumulative
+
+
+class Registry:
+    def __init__(self) -> None:
+        self.metrics: Dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> None:
+        if metric.name in self.metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self.metrics[metric.name] = metric
+
+    def render(self) -> str:
+        """Все метрики в текстовом формате Prometheus 0.0.4."""
+        lines = []
+        for metric in self.metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{format_labels(labels)} {format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+def format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    escaped = (
+        name + '="' + value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") + '"'
+        for name, value in labels.items()
+    )
+    return "{" + ",".join(escaped) + "}"
+
+
+def format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return f"{value:.1f}"
+    return repr(float(value))
+
+
+REGISTRY = Registry()
+
+
+INGESTION_STAGE_SECONDS = Histogram(
+    "search_ingestion_stage_seconds",
+    "Duration of document processing stages.",
+    ["stage"],
+)
+QUERY_EMBEDDING_SECONDS = Histogram(
+    "search_query_embedding_seconds",
+    "Duration of query vectorization.",
+    ["modality"],
+)
+ELASTICSEARCH_REQUEST_SECONDS = Histogram(
+    "search_elasticsearch_request_seconds",
+    "Duration of Elasticsearch requests made through the search adapter.",
+    ["operation"],
+)
+ELASTICSEARCH_ERRORS = Counter(
+    "search_elasticsearch_errors",
+    "Failed Elasticsearch requests made through the search adapter.",
+    ["operation"],
+)
+ELASTICSEARCH_RETRIES = Counter(
+    "search_elasticsearch_retries",
+    "Elasticsearch requests retried after a timeout, connection error or overload response.",
+    ["operation"],
+)
+ELASTICSEARCH_CIRCUIT_REJECTIONS = Counter(
+    "search_elasticsearch_circuit_rejections",
+    "Elasticsearch requests rejected without a call while the circuit breaker was open.",
+    ["operation"],
+)
+HTTP_REQUEST_SECONDS = Histogram(
+    "search_http_request_seconds",
+    "Duration of HTTP requests by route.",
+    ["method", "route", "status"],
+)
+DOCUMENTS_PROCESSED = Counter(
+    "search_documents_processed",
+    "Documents passed through extraction, by file format.",
+    ["format"],
+)
+PAGES_PROCESSED = Counter(
+    "search_pages_processed",
+    "PDF pages passed through text extraction.",
+)
+BYTES_PROCESSED = Counter(
+    "search_bytes_processed",
+    "Size of processed source documents in bytes.",
+)
+IMAGES_PROCESSED = Counter(
+    "search_images_processed",
+    "Document images by processing result: extracted, skipped by the filter, embedded.",
+    ["result"],
+)
+LOG_RECORDS_DROPPED = Counter(
+    "search_log_records_dropped",
+    "Log records dropped because the logging queue was full.",
+)
+ADMISSION_IN_FLIGHT = Gauge(
+    "search_admission_in_flight",
+    "Admitted requests currently running, by admission class.",
+    ["endpoint"],
+)
+ADMISSION_QUEUE_DEPTH = Gauge(
+    "search_admission_queue_depth",
+    "Requests waiting for admission, by admission class.",
+    ["endpoint"],
+)
+ADMISSION_WAIT_SECONDS = Histogram(
+    "search_admission_wait_seconds",
+    "Time admitted requests spent waiting in the admission queue.",
+    ["endpoint"],
+)
+ADMISSION_REJECTIONS = Counter(
+    "search_admission_rejections",
+    "Requests rejected with 429 by admission control: queue_full or timeout.",
+    ["endpoint", "reason"],
+)
+EVENT_LOOP_LAG_SECONDS = Histogram(
+    "search_event_loop_lag_seconds",
+    "Delay between the scheduled and actual wake-up of the event loop monitor.",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0),
+)
+EVENT_LOOP_BLOCKS = Counter(
+    "search_event_loop_blocks",
+    "Event loop lag measurements at or above the blocking threshold.",
+)
@@ -0,0 +1,77 @@
+import zlib
+from typing import List, Sequence
+
+import numpy as np
+
+
+MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+MAX_HASH = np.uint64((1 << 32) - 1)
+
+
+class MinHasher:
+    """
+    MinHash-сигнатуры множества словесных шинглов текста.
+
+    Доля совпадающих позиций двух сигнатур оценивает коэффициент Жаккара
+    между множествами шинглов документов. Параметры перестановок зависят
+    только от seed, поэтому сигнатуры, сохраненные ранее, остаются
+    сравнимыми с новыми.
+    """
+
+    def __init__(
+        self,
+        num_perm: int = 128,
+        shingle_size: int = 5,
+        seed: int = 1,
+        chunk_size: int = 8192,
+    ) -> None:
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        self.chunk_size = chunk_size
+
+        generator = np.random.RandomState(seed)
+        self.a = generator.randint(1, MERSENNE_PRIME, size=num_perm, dtype=np.uint64)
+        self.b = generator.randint(0, MERSENNE_PRIME, size=num_perm, dtype=np.uint64)
+
+    def shingle_hashes(self, tokens: Sequence[str]) -> np.ndarray:
+        """Возвращает 32-битные хеши уникальных шинглов из shingle_size слов."""
+        size = self.shingle_size
+        if len(tokens) < size:
+            shingles = {" ".join(tokens)} if tokens else set()
+        else:
+            shingles = {" ".join(tokens[i:i + size]) for i in range(len(tokens) - size + 1)}
+        return np.fromiter(
+            (zlib.crc32(shingle.encode("utf-8")) for shingle in shingles),
+            dtype=np.uint64,
+            count=len(shingles),
+        )
+
+    def signature(self, tokens: Sequence[str]) -> np.ndarray:
+        """
+        Вычисляет сигнатуру документа.
+
+        Хеши обрабатываются блоками по chunk_size, чтобы матрица
+        «шинглы x перестановки» не занимала память на больших текстах.
+        """
+        signature = np.full(self.num_perm, MAX_HASH, dtype=np.uint64)
+        hashes = self.shingle_hashes(tokens)
+
+        for start in range(0, len(hashes), self.chunk_size):
+            chunk = hashes[start:start + self.chunk_size, np.newaxis]
+            permuted = ((chunk * self.a + self.b) % MERSENNE_PRIME) & MAX_HASH
+            np.minimum(signature, permuted.min(axis=0), out=signature)
+
+        return signature
+
+    @staticmethod
+    def similarity(first: np.ndarray, second: np.ndarray) -> float:
+        """Оценка коэффициента Жаккара по двум сигнатурам."""
+        return float(np.count_nonzero(first == second)) / len(first)
+
+    def bands(self, signature: np.ndarray, num_bands: int) -> List[bytes]:
+        """Разбивает сигнатуру на num_bands полос для LSH."""
+        rows = self.num_perm // num_bands
+        return [
+            signature[band * rows:(band + 1) * rows].tobytes()
+            for band in range(num_bands)
+        ]
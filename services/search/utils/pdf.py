@@ -0,0 +1,54 @@
+from typing import Iterator, Tuple
+
+import PyPDF2
+
+
+def open_pdf(f) -> PyPDF2.PdfReader | None:
+    """
+    Открывает PDF и пробует расшифровать его пустым паролем.
+
+    Возвращает None, если документ защищен паролем.
+    """
+    reader = PyPDF2.PdfReader(f)
+    if reader.is_encrypted:
+        try:
+            reader.decrypt('')
+        except Exception:
+            return None
+    return reader
+
+
+def count_pdf_pages(pdf_path: str) -> int:
+    """Возвращает количество страниц PDF-документа."""
+    with open(pdf_path, 'rb') as f:
+        reader = open_pdf(f)
+        return len(reader.pages) if reader is not None else 0
+
+
+def iter_page_windows(page_count: int, window_size: int) -> Iterator[Tuple[int, int]]:
+    """Разбивает диапазон страниц на окна [start, stop)."""
+    for start in range(0, page_count, window_size):
+        yield start, min(start + window_size, page_count)
+
+
+def extract_pdf_text_range(pdf_path: str, start: int, stop: int) -> str:
+    """
+    Извлекает текст страниц [start, stop) PDF-документа.
+
+    Функция не зависит от состояния сервиса, поэтому может выполняться
+    в отдельном процессе для параллельной обработки больших файлов.
+    """
+    parts = []
+    with open(pdf_path, 'rb') as f:
+        reader = open_pdf(f)
+        if reader is None:
+            return ""
+        for page_num in range(start, stop):
+            try:
+                page_text = reader.pages[page_num].extract_text()
+                if page_text:
+                    parts.append(page_text)
+            except Exception as e:
+                print(f"Ошибка при извлечении текста со страницы {page_num + 1}: {e}")
+                continue
+    return "".join(parts)
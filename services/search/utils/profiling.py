@@ -0,0 +1,183 @@
+"""
+Профилирование отдельных запросов.
+
+Запрос профилируется по требованию (токен в заголовке) или выборочно с вероятностью PROFILING_SAMPLE_RATE. Профиль
+запроса хранится в contextvar, поэтому доступен и в обработчике, и в
+потоках пула, где выполняются этапы PreprocessingService.
+
+Режимы:
+
+- sampling - отдельный поток каждые PROFILING_INTERVAL секунд снимает
+  стеки потока цикла событий и потоков, выполняющих этапы запроса;
+  результат сохраняется как collapsed stacks (формат flamegraph.pl и
+  speedscope). Стеки потока цикла событий включают и другие запросы,
+  выполняемые одновременно.
+- cprofile - детерминированный профиль cProfile этапов обработки в потоках
+  пула, сохраняется в формате pstats. Этапы, выполняемые в потоке цикла
+  событий (например, indexing), в этом режиме учитываются только по времени:
+  cProfile в этом потоке учитывал бы чужие корутины. Поэтому тяжелые этапы
+  (извлечение, векторизация) обработчики выполняют через run_in_threadpool.
+  Если ни один этап запроса не выполнялся в пуле, сохраняется только
+  сводка времени этапов.
+"""
+import os
+import sys
+import hmac
+import time
+import pstats
+import cProfile
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Dict, Iterator, List, Mapping
+
+from utils.metrics import INGESTION_STAGE_SECONDS
+
+
+PROFILE_MODES = ("sampling", "cprofile")
+
+
+class RequestProfile:
+    def __init__(self, request_id: str, mode: str = "sampling", interval: float = 0.005) -> None:
+        if mode not in PROFILE_MODES:
+            raise ValueError(f"Unknown profile mode: {mode}")
+        self.request_id = request_id
+        self.mode = mode
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self.stage_seconds: Dict[str, float] = {}
+        self.profiles: List[cProfile.Profile] = []
+        # Потоки, стеки которых снимаются, и число активных этапов в каждом.
+        # Поток цикла событий, создавший профиль, снимается весь запрос, поэтому
+        # его этапы никогда не внешние и cProfile в нем не включается
+        self.threads: Counter = Counter({threading.get_ident(): 1})
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._sampler: threading.Thread | None = None
+
+    def start(self) -> None:
+        self.started = time.perf_counter()
+        if self.mode == "sampling":
+            self._sampler = threading.Thread(target=self._sample, name=f"profile-{self.request_id}", daemon=True)
+            self._sampler.start()
+
+    def stop(self) -> float:
+        self._stopped.set()
+        if self._sampler is not None:
+            self._sampler.join()
+        return time.perf_counter() - self.started
+
+    def _sample(self) -> None:
+        names = {}
+        while not self._stopped.wait(self.interval):
+            frames = sys._current_frames()
+            with self._lock:
+                threads = list(self.threads)
+            for thread_id in threads:
+                frame = frames.get(thread_id)
+                if frame is None:
+                    continue
+                if thread_id not in names:
+                    names.update((thread.ident, thread.name) for thread in threading.enumerate())
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                stack.append(names.get(thread_id, str(thread_id)))
+                self.stacks[";".join(reversed(stack))] += 1
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        """Профилирует этап обработки в текущем потоке."""
+        thread_id = threading.get_ident()
+        with self._lock:
+            self.threads[thread_id] += 1
+            outermost = self.threads[thread_id] == 1
+
+        profile = None
+        # cProfile один на поток: вложенные этапы учитываются внешним
+        if self.mode == "cprofile" and outermost:
+            profile = cProfile.Profile()
+            profile.enable()
+
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            if profile is not None:
+                profile.disable()
+            with self._lock:
+                self.stage_seconds[name] = self.stage_seconds.get(name, 0.0) + elapsed
+                if profile is not None:
+                    self.profiles.append(profile)
+                self.threads[thread_id] -= 1
+                if not self.threads[thread_id]:
+                    del self.threads[thread_id]
+
+    def save(self, directory: str, elapsed: float) -> str | None:
+        """Сохраняет профиль в directory; возвращает путь или None, если данных нет."""
+        os.makedirs(directory, exist_ok=True)
+        prefix = os.path.join(directory, f"{datetime.now().strftime('%Y%m%d%H%M%S')}_{self.request_id}")
+
+        if self.mode == "sampling":
+            if not self.stacks:
+                return None
+            path = f"{prefix}.collapsed"
+            with open(path, "w", encoding="utf-8") as f:
+                for stack, count in self.stacks.most_common():
+                    f.write(f"{stack} {count}\n")
+        elif self.profiles:
+            path = f"{prefix}.pstats"
+            stats = pstats.Stats(self.profiles[0])
+            for profile in self.profiles[1:]:
+                stats.add(profile)
+            stats.dump_stats(path)
+        elif not self.stage_seconds:
+            return None
+        else:
+            # Все этапы выполнялись в цикле событий: остается только время этапов
+            path = f"{prefix}.txt"
+
+        with open(f"{prefix}.txt", "w", encoding="utf-8") as f:
+            f.write(f"request_id: {self.request_id}\nmode: {self.mode}\nelapsed: {elapsed:.3f}s\n")
+            for name, seconds in sorted(self.stage_seconds.items(), key=lambda item: -item[1]):
+                f.write(f"{name}: {seconds:.3f}s\n")
+        return path
+
+
+CURRENT_PROFILE: ContextVar[RequestProfile | None] = ContextVar("current_profile", default=None)
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    """
+    Этап обработки документа: время попадает в метрику
+    search_ingestion_stage_seconds, а если запрос профилируется - в профиль.
+    """
+    profile = CURRENT_PROFILE.get()
+    with INGESTION_STAGE_SECONDS.time(stage=name):
+        if profile is None:
+            yield
+        else:
+            with profile.stage(name):
+                yield
+
+
+def requested_profile_mode(headers: Mapping[str, str], query_params: Mapping[str, str], token: str) -> str | None:
+    """
+    Режим профилирования, запрошенный клиентом: токен передается в заголовке
+    X-Profile-Token, режим - в X-Profile-Mode или параметре profile_mode.
+    Без настроенного токена профилирование по запросу выключено.
+
+    Токен принимается только в заголовке: параметры запроса пишутся в журнал
+    доступа, а профилируемые запросы обычно медленные и логируются всегда.
+    """
+    provided = headers.get("X-Profile-Token")
+    if not token or not provided or not hmac.compare_digest(provided.encode(), token.encode()):
+        return None
+    mode = headers.get("X-Profile-Mode") or query_params.get("profile_mode") or "sampling"
+    return mode if mode in PROFILE_MODES else "sampling"
@@ -0,0 +1,189 @@
+import os
+import copy
+import json
+import hashlib
+from datetime import datetime
+from typing import Any, Dict, Sequence
+
+import numpy as np
+
+
+class PCAProjection:
+    """
+    Линейная проекция эмбеддингов в пространство меньшей размерности (PCA).
+
+    Векторы нормируются, центрируются средним выборки корпуса и умножаются
+    на главные компоненты. Проекция обучается один раз и хранится как
+    артефакт (.npz); version зависит только от содержимого артефакта, поэтому
+    векторы, полученные разными проекциями, не смешиваются в индексе.
+    """
+
+    def __init__(self, mean: np.ndarray, components: np.ndarray, metadata: Dict[str, Any]) -> None:
+        self.mean = mean.astype(np.float32)
+        self.components = components.astype(np.float32)
+        self.metadata = metadata
+
+    @property
+    def dims(self) -> int:
+        return self.components.shape[0]
+
+    @property
+    def input_dims(self) -> int:
+        return self.components.shape[1]
+
+    @property
+    def source_model(self) -> str:
+        return self.metadata["source_model"]
+
+    @property
+    def version(self) -> str:
+        digest = hashlib.sha256(self.mean.tobytes() + self.components.tobytes()).hexdigest()
+        return f"pca{self.dims}-{digest[:12]}"
+
+    def model_version(self, model: str) -> str:
+        """Версия векторов: модель плюс проекция."""
+        return f"{model}+{self.version}"
+
+    @classmethod
+    def fit(cls, vectors: np.ndarray, dims: int, source_model: str) -> "PCAProjection":
+        """Обучает проекцию на выборке векторов корпуса (n x input_dims)."""
+        if dims >= vectors.shape[1]:
+            raise ValueError(f"Projection dims must be less than {vectors.shape[1]}")
+        if len(vectors) <= dims:
+            raise ValueError(f"At least {dims + 1} sample vectors are required")
+
+        normalized = normalize(vectors.astype(np.float64))
+        mean = normalized.mean(axis=0)
+        centered = normalized - mean
+        covariance = centered.T @ centered / len(centered)
+        eigenvalues, eigenvectors = np.linalg.eigh(covariance)
+
+        order = np.argsort(eigenvalues)[::-1][:dims]
+        components = eigenvectors[:, order].T
+        explained = float(eigenvalues[order].sum() / eigenvalues.sum())
+
+        return cls(mean, components, {
+            "source_model": source_model,
+            "input_dims": int(vectors.shape[1]),
+            "dims": dims,
+            "sample_size": int(len(vectors)),
+            "explained_variance": explained,
+            "fitted_at": datetime.now().isoformat(timespec="seconds"),
+        })
+
+    def transform(self, vectors: Sequence[Sequence[float]] | np.ndarray) -> np.ndarray:
+        vectors = np.asarray(vectors, dtype=np.float32)
+        single = vectors.ndim == 1
+        if single:
+            vectors = vectors[np.newaxis]
+        if vectors.shape[1] != self.input_dims:
+            raise ValueError(f"Expected {self.input_dims}-dimensional vectors, got {vectors.shape[1]}")
+
+        projected = (normalize(vectors) - self.mean) @ self.components.T
+        return projected[0] if single else projected
+
+    def save(self, path: str) -> None:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        metadata = {**self.metadata, "version": self.version}
+        with open(path, "wb") as f:
+            np.savez(f, mean=self.mean, components=self.components, metadata=json.dumps(metadata))
+
+    @classmethod
+    def load(cls, path: str) -> "PCAProjection":
+        with np.load(path) as artifact:
+            metadata = json.loads(str(artifact["metadata"]))
+            projection = cls(artifact["mean"], artifact["components"], metadata)
+        if metadata.get("version") != projection.version:
+            raise ValueError(f"Projection artifact {path} is corrupted: version mismatch")
+        return projection
+
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def recall_at_k(
+    corpus: np.ndarray,
+    queries: np.ndarray,
+    projection: PCAProjection,
+    k: int = 10,
+) -> float:
+    """
+    Доля точных top-k соседей по косинусу в полной размерности, найденных
+    top-k поиском по косинусу в пространстве проекции.
+    """
+    k = min(k, len(corpus))
+    full_scores = normalize(queries) @ normalize(corpus).T
+    projected_scores = normalize(projection.transform(queries)) @ normalize(projection.transform(corpus)).T
+
+    expected = np.argpartition(-full_scores, k - 1, axis=1)[:, :k]
+    found = np.argpartition(-projected_scores, k - 1, axis=1)[:, :k]
+
+    hits = sum(len(np.intersect1d(row_expected, row_found)) for row_expected, row_found in zip(expected, found))
+    return hits / (k * len(queries))
+
+
+def apply_projection_dims(
+    body: dict,
+    text_projection: PCAProjection | None,
+    image_projection: PCAProjection | None,
+) -> dict:
+    """Маппинг индекса документов с размерностями векторов после проекции."""
+    if text_projection is None and image_projection is None:
+        return body
+
+    body = copy.deepcopy(body)
+    properties = body.get("mappings", {}).get("properties", {})
+    if text_projection is not None and "text_content_embedding" in properties:
+        properties["text_content_embedding"]["dims"] = text_projection.dims
+    images = properties.get("images", {}).get("properties", {})
+    if image_projection is not None and "image_embedding" in images:
+        images["image_embedding"]["dims"] = image_projection.dims
+    return body
+
+
+def get_vector_dims(body: dict) -> Dict[str, int | None]:
+    """Размерности векторных полей в маппинге индекса документов."""
+    properties = body.get("mappings", body).get("properties", {})
+    images = properties.get("images", {}).get("properties", {})
+    return {
+        "text_content_embedding": properties.get("text_content_embedding", {}).get("dims"),
+        "images.image_embedding": images.get("image_embedding", {}).get("dims"),
+    }
+
+
+def load_projection(path: str, source_model: str) -> PCAProjection | None:
+    """Загружает проекцию, если путь задан, и проверяет, что она обучена на векторах source_model."""
+    if not path:
+        return None
+    projection = PCAProjection.load(path)
+    if projection.source_model != source_model:
+        raise ValueError(
+            f"Projection {path} was fitted on '{projection.source_model}' vectors, "
+            f"but the current model is '{source_model}'"
+        )
+    return projection
+
+
+def check_projection_dims(
+    index: str,
+    dims: Dict[str, int | None],
+    text_projection: PCAProjection | None,
+    image_projection: PCAProjection | None,
+    hint: str,
+) -> None:
+    """
+    Проверяет, что векторные поля индекса (dims из get_vector_dims) имеют
+    размерность включенных проекций: иначе запись спроецированных векторов
+    и поиск по ним завершались бы ошибкой для каждого документа.
+    """
+    for field, projection in (
+        ("text_content_embedding", text_projection),
+        ("images.image_embedding", image_projection),
+    ):
+        if projection is not None and dims.get(field) not in (None, projection.dims):
+            raise RuntimeError(
+                f"Index '{index}' stores {dims[field]}-dimensional {field} vectors, "
+                f"but projection {projection.version} produces {projection.dims}-dimensional vectors. {hint}"
+            )
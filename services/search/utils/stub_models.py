@@ -0,0 +1,78 @@
+"""
+Заглушки моделей векторизации для нагрузочных тестов и офлайн-стендов.
+
+Включаются EMBEDDING_STUB_MODELS=true: сервис не загружает
+SentenceTransformer и ViT, а получает детерминированные векторы той же
+размерности за микросекунды. Так нагрузочный тест измеряет сам сервис
+(разбор документов, поиск, сериализацию) без стоимости инференса.
+Векторы заглушек несравнимы с векторами настоящих моделей: индекс,
+заполненный с заглушками, не годится для реального поиска. Поэтому они
+сохраняются с версией модели stub-<размерность>, и фильтры по модели
+не смешивают их с настоящими векторами, а managers.reembed пересчитывает.
+"""
+import zlib
+from types import SimpleNamespace
+from typing import List
+
+import numpy as np
+
+from utils.text import tokenize
+
+
+# Размерности моделей по умолчанию (paraphrase-multilingual-MiniLM-L12-v2 и ViT-base)
+TEXT_DIMS = 384
+IMAGE_DIMS = 768
+IMAGE_SIDE = 16
+
+TEXT_MODEL_VERSION = f"stub-{TEXT_DIMS}"
+IMAGE_MODEL_VERSION = f"stub-{IMAGE_DIMS}"
+
+
+class HashTextEncoder:
+    """Замена SentenceTransformer: сумма случайных знаков по хешам токенов."""
+
+    def __init__(self, dims: int = TEXT_DIMS, max_tokens: int = 512) -> None:
+        self.dims = dims
+        self.max_tokens = max_tokens
+
+    def encode(self, sentences: str | List[str], convert_to_numpy: bool = True, **kwargs) -> np.ndarray:
+        single = isinstance(sentences, str)
+        texts = [sentences] if single else sentences
+
+        vectors = np.zeros((len(texts), self.dims), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for token in tokenize(text)[:self.max_tokens]:
+                digest = zlib.crc32(token.encode("utf-8"))
+                vectors[row, digest % self.dims] += 1.0 if digest & 0x10000 else -1.0
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors /= np.maximum(norms, 1e-12)
+
+        return vectors[0] if single else vectors
+
+
+class StubImageProcessor:
+    """Замена ViTImageProcessor: уменьшенная серая копия изображения."""
+
+    def __call__(self, images, return_tensors: str = "pt"):
+        import torch
+
+        images = images if isinstance(images, list) else [images]
+        pixels = [
+            np.asarray(image.convert("L").resize((IMAGE_SIDE, IMAGE_SIDE)), dtype=np.float32).ravel() / 255.0
+            for image in images
+        ]
+        return {"pixel_values": torch.from_numpy(np.stack(pixels))}
+
+
+class StubImageModel:
+    """Замена ViTModel: фиксированная случайная проекция пикселей в IMAGE_DIMS."""
+
+    def __init__(self, dims: int = IMAGE_DIMS, seed: int = 0) -> None:
+        import torch
+
+        generator = torch.Generator().manual_seed(seed)
+        self.weights = torch.randn(IMAGE_SIDE * IMAGE_SIDE, dims, generator=generator)
+
+    def __call__(self, pixel_values):
+        # (batch, 1, dims): вызывающий код усредняет last_hidden_state по токенам
+        return SimpleNamespace(last_hidden_state=(pixel_values @ self.weights).unsqueeze(1))
@@ -0,0 +1,107 @@
+import re
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Collection, Dict, List, Mapping
+
+
+UNICODE_SEQUENCE_PATTERN = re.compile(r"/uni([0-9A-Fa-f]{4})")
+DISALLOWED_CHARS_PATTERN = re.compile(r"[^a-zA-Zа-яА-Я0-9.,\s]")
+PUNCTUATION_PATTERN = re.compile(r"[^\w\s]")
+
+
+@dataclass
+class TextAnalysis:
+    cleaned_text: str
+    tokens: List[str] = field(default_factory=list)
+    term_counts: Dict[str, int] = field(default_factory=dict)
+    tags: List[str] = field(default_factory=list)
+    language: str | None = None
+    # Термины для корпусной статистики; None, если TF-IDF теги не формировались
+    tag_terms: List[str] | None = None
+
+
+def _decode_unicode_match(match: re.Match) -> str:
+    return chr(int(match.group(1), 16))
+
+
+def decode_unicode_sequence(text: str) -> str:
+    """Декодирует последовательности /uniXXXX в символы Unicode."""
+    if "/uni" not in text:
+        return text
+    return UNICODE_SEQUENCE_PATTERN.sub(_decode_unicode_match, text)
+
+
+def clean_text(text: str) -> str:
+    """
+    Декодирует Unicode-последовательности, удаляет все символы, кроме букв,
+    цифр, точек и запятых, и схлопывает пробелы.
+    """
+    text = decode_unicode_sequence(text)
+    text = DISALLOWED_CHARS_PATTERN.sub("", text)
+    return " ".join(text.split())
+
+
+def tokenize(text: str) -> List[str]:
+    """Удаляет пунктуацию, приводит к нижнему регистру и разбивает на слова."""
+    return PUNCTUATION_PATTERN.sub("", text).lower().split()
+
+
+def tokenize_cleaned(cleaned_text: str) -> List[str]:
+    """
+    Токенизация текста, уже прошедшего clean_text.
+
+    После очистки в тексте остаются только буквы, цифры, точки, запятые и
+    пробелы, поэтому вместо регулярного выражения достаточно убрать точки и
+    запятые (str.replace работает быстрее str.translate на кириллице).
+    """
+    return cleaned_text.replace(".", "").replace(",", "").lower().split()
+
+
+def top_terms(term_counts: Counter, stopwords: Collection[str], num_tags: int) -> List[str]:
+    """Возвращает num_tags самых частых слов, не входящих в стоп-слова."""
+    meaningful = Counter({
+        term: count for term, count in term_counts.items() if term not in stopwords
+    })
+    return [term for term, _ in meaningful.most_common(num_tags)]
+
+
+def tag_candidates(
+    term_counts: Mapping[str, int],
+    stopwords: Collection[str],
+    min_length: int = 3,
+) -> Dict[str, int]:
+    """Оставляет слова, пригодные для тегов: без стоп-слов, чисел и коротких слов."""
+    return {
+        term: count for term, count in term_counts.items()
+        if len(term) >= min_length and not term.isdigit() and term not in stopwords
+    }
+
+
+def analyze_cleaned_text(
+    cleaned_text: str,
+    stopwords: Collection[str],
+    num_tags: int = 10,
+    language: str | None = None,
+) -> TextAnalysis:
+    """Извлекает токены, частоты и теги из текста, уже прошедшего clean_text."""
+    tokens = tokenize_cleaned(cleaned_text)
+    term_counts = Counter(tokens)
+
+    return TextAnalysis(
+        cleaned_text=cleaned_text,
+        tokens=tokens,
+        term_counts=term_counts,
+        tags=top_terms(term_counts, stopwords, num_tags),
+        language=language,
+    )
+
+
+def analyze_text(text: str, stopwords: Collection[str], num_tags: int = 10) -> TextAnalysis:
+    """
+    Очищает текст и извлекает токены, частоты и теги за один проход.
+
+    Результат совпадает с последовательностью clean_text -> tokenize ->
+    фильтрация стоп-слов -> Counter, но шаблоны скомпилированы заранее,
+    а стоп-слова фильтруются по уникальным словам, а не по каждому токену.
+    """
+    return analyze_cleaned_text(clean_text(text), stopwords, num_tags=num_tags)